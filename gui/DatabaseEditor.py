@@ -28,6 +28,9 @@ import numpy as np
 import pandas as pd
 from ImportSeries import exploreIdeamMultipleFiles as expIDEAMFiles
 from ImportSeries import importIdeamDailyTxt as importIDEAMDaily
+from QualityControl import QCStage, flag_counts, store_flags
+from StagingImport import import_ideam_staged, format_report
+from IdeamResolver import IdeamResolver
 import SQLAlchemyQueries as SqlQuery
 from sqlalchemy.orm import sessionmaker
 from PyQt5.QtCore import pyqtSignal, QRegExp
@@ -233,6 +236,96 @@ class DbExplorer(QDialog):
         self.close()
 
 
+# %% Region explorer form
+# noinspection PyUnresolvedReferences
+class RegionExplorer(QDialog):
+
+    # signal to pass all series identifiers of the region to the main-window
+    timeSeriesIdentifiers = pyqtSignal(object)
+
+    def __init__(self, region_sites, engine, parent=None):
+        super(RegionExplorer, self).__init__(parent)
+
+        self.engine = engine
+        self.regionSites = region_sites
+        self.identifiers = []
+
+        # main layout
+        self.VLayout = QVBoxLayout()
+        self.HLayout = QHBoxLayout()
+        self.Grid = QGridLayout()
+
+        # labels
+        self.sitesLb = QLabel('Sites')
+        self.sitesNumberLb = QLabel(str(len(region_sites)))
+        self.varsLb = QLabel('Variable')
+        self.seriesLb = QLabel('Series')
+        self.seriesNumberLb = QLabel()
+
+        # buttons
+        self.findSeriesButton = QPushButton('Find series')
+        self.addSeriesButton = QPushButton('Add time series')
+        self.addSeriesButton.setEnabled(False)
+        self.closeButton = QPushButton('Close')
+        self.closeButton.clicked.connect(self.closeDialog)
+
+        # variables combo-box
+        self.varsCb = QComboBox()
+        variables = SqlQuery.get_vars_table(engine)
+        for i in range(len(variables['ID'])):
+            self.varsCb.addItem('[%02d] %s - %s' % (variables['ID'][i], variables['Variable'][i],
+                                                    variables['Type'][i]))
+        self.varsCb.currentIndexChanged.connect(self.resetSeries)
+
+        # set layout
+        self.Grid.addWidget(self.sitesLb, 0, 0)
+        self.Grid.addWidget(self.sitesNumberLb, 0, 1)
+        self.Grid.addWidget(self.varsLb, 1, 0)
+        self.Grid.addWidget(self.varsCb, 1, 1)
+        self.Grid.addWidget(self.seriesLb, 2, 0)
+        self.Grid.addWidget(self.seriesNumberLb, 2, 1)
+
+        self.HLayout.addWidget(self.findSeriesButton)
+        self.HLayout.addWidget(self.addSeriesButton)
+        self.HLayout.addWidget(self.closeButton)
+
+        self.VLayout.addLayout(self.Grid)
+        self.VLayout.addLayout(self.HLayout)
+
+        self.setLayout(self.VLayout)
+        self.setWindowTitle('Region series')
+
+        # find region series [single catalog query] and add them to workspace
+        self.findSeriesButton.clicked.connect(self.findSeries)
+        self.addSeriesButton.clicked.connect(self.emitTsIdentifiers)
+
+        # call dialog box
+        self.show()
+
+    def resetSeries(self):
+        self.identifiers = []
+        self.seriesNumberLb.setText('')
+        self.addSeriesButton.setEnabled(False)
+
+    def findSeries(self):
+        variableId = int(self.varsCb.currentText()[1:3])
+        siteIds = [int(i[0]) for i in self.regionSites]
+        self.identifiers = SqlQuery.regionSeriesQuery(siteIds, variableId, self.engine)
+
+        self.seriesNumberLb.setText(str(len(self.identifiers)))
+        self.addSeriesButton.setEnabled(len(self.identifiers) > 0)
+
+    def emitTsIdentifiers(self):
+        if self.identifiers:
+            # signal to pass time-series identifiers to main-window
+            self.timeSeriesIdentifiers.emit(self.identifiers)
+
+        self.closeDialog()
+
+    def closeDialog(self):
+        self.close()
+
+
 # %% Add Metadata form
 # noinspection PyUnresolvedReferences
 class AddMetadata(QDialog):
@@ -2266,6 +2359,7 @@ class AddSeries(QDialog):
 
         self.engine = engine
         self.fileNames = None
+        self.qcFlags = {}                       # quality control flags of last import
 
         # main layout
         self.group1 = QGroupBox('Select source')
@@ -2294,6 +2388,8 @@ class AddSeries(QDialog):
         self.qualitiesDictionary = SqlQuery.get_qualities_table(engine)
         self.censorDictionary = SqlQuery.get_censor_table(engine)
         self.unitsDictionary = SqlQuery.get_units_table(engine)
+        # header resolution shared by the files validation report and the import
+        self.ideamResolver = IdeamResolver(self.methodsDictionary, self.variablesDictionary, self.sitesDictionary)
         tUnits = self.variablesDictionary['Time Resolution'][0]
 
         # labels
@@ -2513,7 +2609,7 @@ class AddSeries(QDialog):
 
         if len(self.fileNames) > 0:
             filesReport = expIDEAMFiles(self.fileNames, self.methodsDictionary, self.variablesDictionary,
-                                        self.sitesDictionary)
+                                        self.sitesDictionary, self.ideamResolver)
             self.nSitesLb.setText('Number of sites to be imported: ' + str(filesReport[0]))
             self.nVarsLb.setText('Variables to be imported: ' + str(filesReport[1]))
             self.nMethodsLb.setText('Methods used :' + str(filesReport[2]))
@@ -2561,7 +2657,32 @@ class AddSeries(QDialog):
                 self.importSeriesBttn.setEnabled(False)
 
     def importSeries(self):
-        for i in self.fileNames:
-            importIDEAMDaily(i, self.engine, self.methodsDictionary, self.variablesDictionary,
-                             np.int(self.sourceCb.currentText()), np.int(self.qualityCb.currentText()),
-                             self.censorCb.currentText(), np.float(-5))
+        qcStage = QCStage()                     # quality control of imported daily values (one pass at the end)
+        if self.engine.dialect.name == 'postgresql':
+            # staging table and one set-based merge (duplicates skipped)
+            try:
+                report = import_ideam_staged(self.engine, self.fileNames, int(self.sourceCb.currentText()),
+                                             int(self.qualityCb.currentText()), self.censorCb.currentText(), -5.,
+                                             qcStage, self.ideamResolver)
+            except ValueError as e:             # duplicated values prevent the merge index
+                QMessageBox.critical(self, 'Import series', str(e), QMessageBox.Ok)
+                return
+            if report['duplicates'] or report['unresolved']:
+                QMessageBox.information(self, 'Import series', format_report(report), QMessageBox.Ok)
+        else:
+            for i in self.fileNames:
+                importIDEAMDaily(i, self.engine, self.methodsDictionary, self.variablesDictionary,
+                                 int(self.sourceCb.currentText()), int(self.qualityCb.currentText()),
+                                 self.censorCb.currentText(), -5., qcStage, self.ideamResolver)
+
+        # quality control flags of each imported series {(site, variable, method): [Value, Qualifier, Flags]},
+        # flagged values stored in the DataValuesQC table
+        self.qcFlags = qcStage.run()
+        stored = store_flags(self.engine, self.qcFlags, int(self.sourceCb.currentText()),
+                             int(self.qualityCb.currentText()))
+        counts = flag_counts({key: frame['Flags'] for key, frame in self.qcFlags.items()})
+        if len(counts) and counts['Flagged'].sum():
+            flagged = counts[counts['Flagged'] > 0]
+            QMessageBox.information(self, 'Quality control', '%d of %d imported values flagged in %d series '
+                                    '(%d stored in DataValuesQC)' % (flagged['Flagged'].sum(), counts['Values'].sum(),
+                                                                     len(flagged), stored), QMessageBox.Ok)
@@ -15,17 +15,31 @@ Email:      andresfduque@gmail.com
 # TODO: add morphometric analysis
 
 # %%  Main imports
+import os
 import sys
 import TableViews
 import DatabaseEditor
 import pandas as pd
 import pyqtgraph as pg
 import ManageDatabases as myDB
+import SQLAlchemyQueries as SqlQuery
+
+from SeriesCache import SeriesCache, cache_path
+from SeriesArrays import is_daily
+from MissingAnalysis import missing_report
+from Aggregation import AggregationCache, report_matrix
+from HydroStatistics import batch_statistics
+from FrequencyAnalysis import FrequencyCache, annual_maxima
+from GapFilling import fill_gaps, fill_summary
+from QualityControl import flag_series, flag_counts
+from ProjectFile import ProjectArchive, save_project, is_project, PROJECT_EXTENSION
+from Instrumentation import instrumented
+import SqlProfiler
 
 from HomeMenu import HomeWidget, PostgresForm
 
 from PyQt5.QtGui import QIcon, QKeySequence
-from PyQt5.QtCore import pyqtSlot, pyqtSignal, Qt, QFileInfo, QFile, QTextStream
+from PyQt5.QtCore import pyqtSlot, pyqtSignal, Qt, QFileInfo
 from PyQt5.QtWidgets import (QGridLayout, QHBoxLayout, QVBoxLayout, QWidget, QMessageBox, QTabWidget, QMainWindow,
                              QToolBar, QApplication, QTextEdit, QAction, QFileDialog, QDockWidget, QStyleFactory,
                              QLabel)
@@ -35,12 +49,16 @@ import qrc_resources
 
 # Project management toolbar for home ribbon
 class ProjectToolbar(QToolBar):
+    projectFile = pyqtSignal(object)                        # signal to send current project file name
+    openProject = pyqtSignal(object)                        # signal to read workspace from project file
+    saveProject = pyqtSignal(object)                        # signal to write workspace to project file
 
     def __init__(self, parent=None):
         super(ProjectToolbar, self).__init__(parent)
 
         # define default class instances
         self.curFile = None                                                 # current file
+        self.doneFile = None                                                # last project read or written
 
         # define toolbar actions [new project]
         self.newAct = QAction(QIcon(':/new_project'), '&New', self)
@@ -92,12 +110,12 @@ class ProjectToolbar(QToolBar):
 
     def new_file(self):
         if self.maybeSave():
-            self.textEdit.clear()
             self.setCurrentFile('')
 
     def open(self):
         if self.maybeSave():
-            file_name, _ = QFileDialog.getOpenFileName(self)
+            file_name, _ = QFileDialog.getOpenFileName(self, 'Open project', None,
+                                                       'HydroClimaT project (*' + PROJECT_EXTENSION + ')')
             if file_name:
                 self.loadFile(file_name)
 
@@ -108,8 +126,11 @@ class ProjectToolbar(QToolBar):
         return self.saveAs()
 
     def saveAs(self):
-        file_name, _ = QFileDialog.getSaveFileName(self)
+        file_name, _ = QFileDialog.getSaveFileName(self, 'Save project', None,
+                                                   'HydroClimaT project (*' + PROJECT_EXTENSION + ')')
         if file_name:
+            if not file_name.endswith(PROJECT_EXTENSION):
+                file_name += PROJECT_EXTENSION
             return self.saveFile(file_name)
 
         return False
@@ -121,10 +142,10 @@ class ProjectToolbar(QToolBar):
                           "toolbars, and a status bar.")
 
     def documentWasModified(self):
-        self.setWindowModified(self.textEdit.document().isModified())
+        self.setWindowModified(True)
 
     def maybeSave(self):
-        if self.textEdit.document().isModified():
+        if self.isWindowModified():
             ret = QMessageBox.warning(self, "Application", "The document has been modified.\
                                       \nDo you want to save your changes?",
                                       QMessageBox.Save | QMessageBox.Discard | QMessageBox.Cancel)
@@ -138,41 +159,53 @@ class ProjectToolbar(QToolBar):
         return True
 
     def loadFile(self, file_name):
-        file = QFile(file_name)
-        if not file.open(QFile.ReadOnly | QFile.Text):
-            QMessageBox.warning(self, "Application",
-                                "Cannot read file %s:\n%s." % (file_name, file.errorString()))
+        if not is_project(file_name):
+            QMessageBox.warning(self, "Application", "Cannot read file %s:\nNot a HydroClimaT project." % file_name)
             return
 
-        inf = QTextStream(file)
+        # workspace is restored by the main-window [series payloads are loaded on first display]; current file is
+        # set by projectDone when the project was read
+        self.doneFile = None
         QApplication.setOverrideCursor(Qt.WaitCursor)
-        self.textEdit.setPlainText(inf.readAll())
+        self.openProject.emit(file_name)
         QApplication.restoreOverrideCursor()
 
-        self.setCurrentFile(file_name)
-        self.statusBar().showMessage("File loaded", 2000)
+        return self.doneFile == file_name
 
     def saveFile(self, file_name):
-        file = QFile(file_name)
-        if not file.open(QFile.WriteOnly | QFile.Text):
-            QMessageBox.warning(self, "Application",
-                                "Cannot write file %s:\n%s." % (file_name, file.errorString()))
+        fileInfo = QFileInfo(file_name)
+        writable = fileInfo.isWritable() if fileInfo.exists() else QFileInfo(fileInfo.absolutePath()).isWritable()
+        if not writable:
+            QMessageBox.warning(self, "Application", "Cannot write file %s." % file_name)
             return False
 
-        return True
+        # workspace is written by the main-window; current file is set by projectDone when the project was written
+        self.doneFile = None
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        self.saveProject.emit(file_name)
+        QApplication.restoreOverrideCursor()
+
+        return self.doneFile == file_name
+
+    @pyqtSlot(object)
+    def projectDone(self, file_name):
+        self.doneFile = file_name
+        self.setCurrentFile(file_name)
 
     def setCurrentFile(self, file_name):
         self.curFile = file_name
-        self.textEdit.document().setModified(False)
         self.setWindowModified(False)
 
         if self.curFile:
             shownName = self.strippedName(self.curFile)
         else:
-            shownName = 'untitled.txt'
+            shownName = 'untitled' + PROJECT_EXTENSION
 
         self.setWindowTitle("%s[*] - Application" % shownName)
 
+        # emit project file to main-window (series cache is stored next to the project file)
+        self.projectFile.emit(self.curFile)
+
     @staticmethod
     def strippedName(full_file_name):
         return QFileInfo(full_file_name).fileName()
@@ -226,6 +259,48 @@ class DatabaseToolbar(QToolBar):
         self.connSignal.emit(conn_dict)
 
 
+# SQL profiling toolbar for home ribbon [statements per operation, N+1 patterns and slow-query log]
+class ProfilingToolbar(QToolBar):
+    def __init__(self, parent=None):
+        super(ProfilingToolbar, self).__init__(parent)
+
+        # define toolbar actions [enable/disable SQL profiler]
+        self.profileAct = QAction('SQL &profile', self)
+        self.profileAct.setStatusTip('Profile SQL statements of each operation (slow-query log)')
+        self.profileAct.setCheckable(True)
+        self.profileAct.setChecked(SqlProfiler.PROFILER is not None)
+        self.profileAct.toggled.connect(self.toggleProfiler)
+
+        # define toolbar actions [show profiler report]
+        self.reportAct = QAction('SQL &report', self)
+        self.reportAct.setStatusTip('Show statements per operation and possible N+1 patterns')
+        self.reportAct.triggered.connect(self.showReport)
+
+        self.addAction(self.profileAct)
+        self.addAction(self.reportAct)
+        self.setFixedHeight(40)
+        self.setWindowTitle('Profiling')
+
+    def toggleProfiler(self, checked):
+        if checked:
+            logPath, _ = QFileDialog.getSaveFileName(self, 'Slow-query log', 'slow_queries.log',
+                                                     'Log files (*.log);;All files (*)')
+            SqlProfiler.enable(logPath or None)
+        else:
+            profiler = SqlProfiler.disable()
+            if profiler is not None and profiler.logPath:
+                with open(profiler.logPath, 'a') as f:
+                    f.write('\n%s\n' % profiler.report())
+
+    def showReport(self):
+        if SqlProfiler.PROFILER is None:
+            QMessageBox.information(self, 'SQL profile', 'SQL profiler is not enabled', QMessageBox.Ok)
+            return
+        box = QMessageBox(QMessageBox.Information, 'SQL profile', 'Statements per operation', QMessageBox.Ok, self)
+        box.setDetailedText(SqlProfiler.PROFILER.report())
+        box.exec_()
+
+
 # Home Ribbon Widget
 class TabMenu(QTabWidget):
     def __init__(self, parent=None):
@@ -289,10 +364,14 @@ class HydroClimate(QMainWindow):
     tabTableView = None         # table view of database tables, also management of data
 
     timeSeriesDict = {}         # dictionary to store a single site query (related data)
+    timeSeriesData = {}         # dictionary to store loaded time-series payloads (pandas series)
+    timeSeriesResults = {}      # dictionary to store derived results of each time-series {name: pandas object}
     timeSeriesDf = pd.DataFrame()
     timeSeriesId = 0
     stackedId = 0               # index to identify the stacked workspace
 
+    projectDone = pyqtSignal(object)    # signal to send project file read or written successfully
+
     def __init__(self, parent=None):
         super(HydroClimate, self).__init__(parent)
 
@@ -308,6 +387,11 @@ class HydroClimate(QMainWindow):
         self.timeseriesPlot = None
         self.timeseriesWorkspace = None
         self.timeseriesVectorWidget = None
+        self.seriesCache = None                                         # local series cache [SeriesCache]
+        self.projectArchive = None                                      # opened project file [ProjectArchive]
+        self.statisticsWidget = None                                    # analysis view outside the workspace
+        self.aggregationCache = AggregationCache()                      # monthly matrices by series version
+        self.frequencyCache = FrequencyCache()                          # distribution fits by maxima version
         self.setContentsMargins(10, 10, 10, 10)
 
         # main window layout
@@ -315,6 +399,14 @@ class HydroClimate(QMainWindow):
         self.widget = QWidget(self)                                     # widget to set main window layout
         self.VLayout = QVBoxLayout()                                    # layout for database management widgets
         self.tabMenu = TabMenu()                                        # tab-widget for toolbars
+        self.projectToolbar = ProjectToolbar()                          # project management toolbar
+        self.projectToolbar.projectFile.connect(self.closeSeriesCache)  # series cache of the previous project
+        self.projectToolbar.openProject.connect(self.openProject)       # restore workspace from project
+        self.projectToolbar.saveProject.connect(self.saveProject)       # write workspace to project
+        self.projectDone.connect(self.projectToolbar.projectDone)        # project read or written successfully
+        self.tabMenu.homeMainWindow.addToolBar(self.projectToolbar)
+        self.profilingToolbar = ProfilingToolbar()                      # SQL profiler toggle and report
+        self.tabMenu.homeMainWindow.addToolBar(self.profilingToolbar)
         # self.tabMenu.databaseToolbar.connSignal.connect(self.addDBConn)   # add database connection
         # self.workspace = HomeWidget()                                    # widget to display time-series analysis
 
@@ -324,6 +416,10 @@ class HydroClimate(QMainWindow):
         # self.workspace.delConnButton.clicked.connect(self.deleteConnection)
         # self.workspace.treeWidget.workspaceTimeSeries.connect(self.getTimeSeries)
         # self.workspace.treeWidget.changeWorkspace.connect(self.changeWorkspace)
+        # self.workspace.treeWidget.analyzeTimeSeries.connect(self.analyzeSeries)
+        # NOTE: series display (getTimeSeries), analysis and the local series cache are reached through these tree
+        # signals and querySeries; they stay inactive until the workspace is enabled again (the cache file is only
+        # created by the first database query of series, not by opening or saving projects)
 
         self.VLayout.addWidget(self.tabMenu)
         self.VLayout.addWidget(QTextEdit())
@@ -386,11 +482,13 @@ class HydroClimate(QMainWindow):
             self.workspace.delConnButton.setEnabled(False)
 
     # tab-widget to show database structure
+    @instrumented('gui', 'db_table_views')
     def DbTableViews(self, engine):
         self.tabTableView = TableViews.DbTabView(engine)
 
         # table edition dialogs
         self.tabTableView.sitesTable.workspaceSite.connect(self.querySite)                  # query site
+        self.tabTableView.sitesTable.workspaceRegion.connect(self.queryRegion)              # query region
         self.tabTableView.sitesTable.createNewSite.connect(self.createSite)                 # create new site
         self.tabTableView.metadataTable.createNewMetadata.connect(self.createMetadata)      # create new metadata
         self.tabTableView.sourcesTable.createNewSource.connect(self.createSource)           # create new source
@@ -409,12 +507,21 @@ class HydroClimate(QMainWindow):
 
     # receive site to be consulted
     @pyqtSlot(object)
+    @instrumented('gui', 'query_site')
     def querySite(self, workspace_site):
         self.tsCode = workspace_site[0]
         self.tsName = workspace_site[1]
         self.dbBase = DatabaseEditor.DbExplorer(workspace_site, self.engine)
         self.dbBase.timeSeriesIdentifier.connect(self.addSeriesToWorkspace)
 
+    # receive sites of a region to be consulted
+    @pyqtSlot(object)
+    @instrumented('gui', 'query_region')
+    def queryRegion(self, region_sites):
+        if region_sites:
+            self.dbBase = DatabaseEditor.RegionExplorer(region_sites, self.engine)
+            self.dbBase.timeSeriesIdentifiers.connect(self.addRegionToWorkspace)
+
     # create new site
     @pyqtSlot(object)
     def createSite(self):
@@ -511,6 +618,249 @@ class HydroClimate(QMainWindow):
 #        print(self.timeSeriesDict)
 #        self.treeWidget.workspaceTimeSeries.connect(self.getTimeSeries)
 
+    # add all series of a region to tree-widget [values are fetched with a single query]
+    @pyqtSlot(object)
+    @instrumented('gui', 'add_region')
+    def addRegionToWorkspace(self, time_series_identifiers):
+        newSeries = {}
+        for time_series_identifier in time_series_identifiers:
+            time_series_identifier.append(0)                                  # stacked workspace index
+
+            # check if added time-series already exists
+            if time_series_identifier not in self.timeSeriesDict.values():
+                self.timeSeriesDict[self.timeSeriesId] = time_series_identifier
+                newSeries[self.timeSeriesId] = time_series_identifier
+                self.timeSeriesId += 1
+
+        if not newSeries:
+            return
+
+        self.workspace.treeWidget.setHidden(False)
+        self.workspace.treeWidget.addSites(newSeries)
+
+        # fetch values of all new region series with one set-based query
+        tsIds = sorted(newSeries)
+        timeSeries = SqlQuery.regionTimeSeriesQuery([newSeries[i] for i in tsIds], self.engine)
+        for ts_id, series in zip(tsIds, timeSeries):
+            self.timeSeriesData[ts_id] = series
+
+    # local series cache stored next to the project file [opened by the first database query of series]
+    def projectSeriesCache(self):
+        if self.seriesCache is None and self.projectToolbar.curFile:
+            self.seriesCache = SeriesCache(cache_path(self.projectToolbar.curFile))
+        return self.seriesCache
+
+    @pyqtSlot(object)
+    def closeSeriesCache(self, project_file):
+        if self.seriesCache is not None:
+            self.seriesCache.close()
+            self.seriesCache = None
+
+    # get time-series values [workspace, project payload (lazy loading) or local cache + database]
+    @instrumented('gui', 'query_series')
+    def querySeries(self, ts_id):
+        ts_id = int(ts_id)
+        if self.timeSeriesData.get(ts_id) is None:
+            if self.projectArchive is not None and self.projectArchive.hasSeries(ts_id):
+                self.timeSeriesData[ts_id] = self.projectArchive.series(ts_id)
+            else:
+                searchParameters = self.timeSeriesDict[ts_id]
+                self.timeSeriesData[ts_id] = SqlQuery.cachedTimeSeriesQuery(searchParameters, self.engine,
+                                                                            self.projectSeriesCache())
+        return self.timeSeriesData[ts_id]
+
+    # restore workspace from project file [only identifiers, series payloads are loaded on first display]
+    @pyqtSlot(object)
+    def openProject(self, project_file):
+        try:
+            archive = ProjectArchive(project_file)
+        except (IOError, ValueError, KeyError) as e:
+            QMessageBox.critical(self, 'Project error', str(e), QMessageBox.Ok)
+            return
+
+        if self.projectArchive is not None:
+            self.projectArchive.close()
+        self.projectArchive = archive
+
+        self.timeSeriesDict.clear()
+        self.timeSeriesData.clear()
+        self.timeSeriesResults.clear()
+        self.timeSeriesDict.update(archive.identifiers())
+        self.timeSeriesId = archive.nextId()
+
+        if getattr(self, 'workspace', None) is not None:      # workspace tree is not shown in this version
+            self.workspace.treeWidget.clear()
+            self.workspace.treeWidget.setHidden(len(self.timeSeriesDict) == 0)
+            self.workspace.treeWidget.addSites(self.timeSeriesDict)
+
+        self.projectDone.emit(project_file)
+
+    # write workspace to project file
+    @pyqtSlot(object)
+    def saveProject(self, project_file):
+        try:
+            self.projectArchive = save_project(project_file, self.timeSeriesDict, self.timeSeriesId,
+                                               self.timeSeriesData, self.timeSeriesResults, self.projectArchive)
+        except (IOError, OSError) as e:
+            QMessageBox.critical(self, 'Project error', str(e), QMessageBox.Ok)
+            return
+
+        self.projectDone.emit(project_file)
+
+    # run analysis over workspace time-series [analysis name, time-series ids]
+    @pyqtSlot(object)
+    @instrumented('gui', 'analysis')
+    def analyzeSeries(self, analysis):
+        name, tsIds = analysis
+        if name == 'missing':
+            self.missingAnalysis(tsIds)
+        elif name == 'statistics':
+            self.hydroStatistics(tsIds)
+        elif name == 'frequency':
+            self.frequencyAnalysis(tsIds)
+        elif name == 'qc':
+            self.qualityControl(tsIds)
+        elif name == 'gapfill':
+            self.gapFilling(tsIds)
+        elif name.startswith('monthly-'):
+            self.monthlyReport(tsIds, name.split('-')[1])
+
+    # daily time-series of the workspace {ts_id: label}, {label: pandas series}
+    def dailySeries(self, ts_ids, title):
+        labels = {}
+        seriesDict = {}
+        for ts_id in ts_ids:
+            series = self.querySeries(ts_id)
+            if is_daily(series):
+                labels[ts_id] = '%s [%d]' % (self.timeSeriesDict[ts_id][4][0], ts_id)
+                seriesDict[labels[ts_id]] = series
+
+        if not seriesDict:
+            QMessageBox.information(self, title, 'No daily time-series to analyze', QMessageBox.Ok)
+        return labels, seriesDict
+
+    # missing data report of daily time-series (all stations at once)
+    def missingAnalysis(self, ts_ids):
+        labels, seriesDict = self.dailySeries(ts_ids, 'Missing data analysis')
+        if not seriesDict:
+            return
+
+        report = missing_report(seriesDict)
+        for ts_id, label in labels.items():
+            self.timeSeriesResults.setdefault(ts_id, {})['missing'] = report[report['Code'] == label]
+        self.projectToolbar.documentWasModified()
+
+        self.showStatistics(TableViews.MissingReportView(report), 'Missing data analysis')
+
+    # quality control flags of daily time-series [bitmask per value stored with the series results]
+    def qualityControl(self, ts_ids):
+        labels, seriesDict = self.dailySeries(ts_ids, 'Quality control')
+        if not seriesDict:
+            return
+
+        flags = flag_series(seriesDict)
+        for ts_id, label in labels.items():
+            self.timeSeriesResults.setdefault(ts_id, {})['qc-flags'] = flags[label]
+        self.projectToolbar.documentWasModified()
+
+        self.showStatistics(TableViews.QualityControlView(flag_counts(flags)), 'Quality control')
+
+    # hydrological statistics of daily time-series [flow duration curves, percentiles and annual maxima]
+    def hydroStatistics(self, ts_ids):
+        labels, seriesDict = self.dailySeries(ts_ids, 'Hydrological statistics')
+        if not seriesDict:
+            return
+
+        statistics, fdc, maxima = batch_statistics(seriesDict, workers=os.cpu_count())
+        for ts_id, label in labels.items():
+            tsResults = self.timeSeriesResults.setdefault(ts_id, {})
+            tsResults['statistics'] = statistics.loc[[label]]
+            tsResults['fdc'] = fdc[label]
+            tsResults['annual-maxima'] = maxima[label].dropna()
+        self.projectToolbar.documentWasModified()
+
+        self.showStatistics(TableViews.StatisticsView(statistics), 'Hydrological statistics')
+
+    # frequency analysis of annual maxima [fits are recomputed only for stations with new maxima]
+    def frequencyAnalysis(self, ts_ids):
+        labels, seriesDict = self.dailySeries(ts_ids, 'Frequency analysis')
+        if not seriesDict:
+            return
+
+        maxima = annual_maxima(seriesDict)
+        quantiles, parameters = self.frequencyCache.get(maxima, workers=os.cpu_count())
+        for ts_id, label in labels.items():
+            tsResults = self.timeSeriesResults.setdefault(ts_id, {})
+            tsResults['annual-maxima'] = maxima[label].dropna()
+            tsResults['frequency-quantiles'] = quantiles.loc[[label]].reset_index()
+            tsResults['frequency-parameters'] = parameters.loc[[label]].reset_index()
+        self.projectToolbar.documentWasModified()
+
+        self.showStatistics(TableViews.FrequencyView(quantiles), 'Frequency analysis')
+
+    # fill gaps of daily time-series of a region from correlated neighbour stations (all stations at once)
+    def gapFilling(self, ts_ids):
+        labels, seriesDict = self.dailySeries(ts_ids, 'Fill gaps')
+        if len(seriesDict) < 2:
+            if seriesDict:
+                QMessageBox.information(self, 'Fill gaps', 'At least two daily time-series are needed',
+                                        QMessageBox.Ok)
+            return
+
+        # site coordinates of each series [sites table: SiteId, SiteName, Longitude, Latitude]
+        sites = SqlQuery.get_sites_table(self.engine) or {}
+        coordinates = {}
+        for ts_id, label in labels.items():
+            site = sites.get(int(self.timeSeriesDict[ts_id][4][0]))
+            if site is not None:
+                coordinates[label] = (site[2], site[3])
+
+        filled, provenance, neighbours = fill_gaps(seriesDict, coordinates or None)
+        for ts_id, label in labels.items():
+            tsResults = self.timeSeriesResults.setdefault(ts_id, {})
+            tsResults['gap-filled'] = filled[label]
+            tsResults['gap-fill-provenance'] = provenance[provenance['Code'] == label].reset_index(drop=True)
+            tsResults['gap-fill-neighbours'] = neighbours[neighbours['Code'] == label].reset_index(drop=True)
+        self.projectToolbar.documentWasModified()
+
+        self.showStatistics(TableViews.GapFillingView(fill_summary(seriesDict, provenance)), 'Fill gaps')
+
+    # year x month report of daily time-series [matrices are regenerated only for changed series]
+    def monthlyReport(self, ts_ids, statistic):
+        labels, seriesDict = self.dailySeries(ts_ids, 'Monthly report')
+        if not seriesDict:
+            return
+
+        matrices = self.aggregationCache.get(seriesDict, statistic)
+        for ts_id, label in labels.items():
+            self.timeSeriesResults.setdefault(ts_id, {})['monthly-' + statistic] = matrices[label]
+        self.projectToolbar.documentWasModified()
+
+        reports = {label: report_matrix(matrix, statistic) for label, matrix in matrices.items()}
+        self.showStatistics(TableViews.MonthlyReportView(reports), 'Monthly report (%s)' % statistic)
+
+    # show analysis view in the statistics dock of the workspace
+    def showStatistics(self, view, title):
+        widget = QWidget()
+        widget.setLayout(view)
+        if self.timeseriesWorkspace is not None:
+            self.timeseriesWorkspace.dockStatistics.setWidget(widget)
+            self.timeseriesWorkspace.dockStatistics.setWindowTitle(title)
+            self.timeseriesWorkspace.dockStatistics.raise_()
+        else:
+            self.statisticsWidget = widget
+            widget.setWindowTitle(title)
+            widget.show()
+
+    # derived result of a time-series [stored results are loaded from project on first access]
+    def seriesResult(self, ts_id, name):
+        ts_id = int(ts_id)
+        tsResults = self.timeSeriesResults.setdefault(ts_id, {})
+        if name not in tsResults and self.projectArchive is not None:
+            if name in self.projectArchive.resultNames(ts_id):
+                tsResults[name] = self.projectArchive.result(ts_id, name)
+        return tsResults.get(name)
+
     # get specific time-series from database
 #     @pyqtSlot(object)
 #     def getTimeSeries(self, ts_id):
@@ -519,7 +869,7 @@ class HydroClimate(QMainWindow):
 #
 #         searchParameters = self.timeSeriesDict[int(ts_id)]
 #         print(self.timeSeriesDict)
-#         timeseries = sqlQuery.timeSeriesQuery(searchParameters, self.engine)
+#         timeseries = self.querySeries(ts_id)
 #         dates = timeseries.index
 #         timeseriesVector = TableViews.GenericTableView({'Date': dates,
 #                                                         'Value': timeseries.values},
@@ -24,12 +24,15 @@ email:      andresfduque@gmail.com
 
 # %% Main imports
 
+import numpy as np
 import SQLAlchemyQueries as SqlQuery
+from SpatialIndex import SitesGridIndex
+from Instrumentation import instrumented, span
 from PyQt5.QtCore import QSortFilterProxyModel, Qt, pyqtSignal
 from PyQt5.QtGui import QStandardItemModel, QStandardItem, QColor, QBrush, QCursor, QFont
 from PyQt5.QtWidgets import (QComboBox, QHBoxLayout, QLineEdit, QVBoxLayout, QTableView,
                              QAbstractScrollArea, QMenu, QAction, QTabWidget, QWidget, QTreeWidget,
-                             QTreeWidgetItem, QTreeWidgetItemIterator, QHeaderView)
+                             QTreeWidgetItem, QHeaderView)
 
 
 # %% Generic table view
@@ -40,6 +43,7 @@ class GenericTableView(QVBoxLayout):
         header: column names as a vector of strings; must have same elements as dictionary vars \n
         alignment: vector of integers indicating each column alignment; 0:left, 1:center, 2:right
     """
+    @instrumented('gui', 'GenericTableView')
     def __init__(self, dictionary, header, col_alignment, parent=None):
         super(GenericTableView, self).__init__(parent)
 
@@ -113,12 +117,35 @@ class GenericTableView(QVBoxLayout):
         self.addWidget(self.tableView)
 
 
+# %% Sites filter proxy model [text filter and spatial filter]
+class SitesFilterProxyModel(QSortFilterProxyModel):
+    """
+    Filter proxy model of sites table; rows must match the text filter and belong to the spatial filter
+    (set of site codes, None to disable it)
+    """
+    def __init__(self, parent=None):
+        super(SitesFilterProxyModel, self).__init__(parent)
+        self.spatialCodes = None
+
+    def setSpatialFilter(self, codes):
+        self.spatialCodes = None if codes is None else set(str(i) for i in codes)
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.spatialCodes is not None:
+            code = self.sourceModel().data(self.sourceModel().index(source_row, 0, source_parent))
+            if code not in self.spatialCodes:
+                return False
+        return super(SitesFilterProxyModel, self).filterAcceptsRow(source_row, source_parent)
+
+
 # %% Sites table view
 # noinspection PyUnresolvedReferences
 class SitesTable(GenericTableView):
 
     # signal to pass dictionary to databases dock-widget
     workspaceSite = pyqtSignal(object)
+    workspaceRegion = pyqtSignal(object)
     createNewSite = pyqtSignal(object)
     importNewSeries = pyqtSignal(int)
 
@@ -133,6 +160,19 @@ class SitesTable(GenericTableView):
         self.tableView.customContextMenuRequested.connect(self.openMenu)
         self.tableView.verticalHeader().setDefaultSectionSize(18)
 
+        # filter proxy model with spatial filter
+        self.filter_proxy_model = SitesFilterProxyModel()
+        self.filter_proxy_model.setSourceModel(self.model)
+        self.filter_proxy_model.setFilterKeyColumn(0)   # first column
+        self.tableView.setModel(self.filter_proxy_model)
+
+        # spatial index of sites [codes, longitudes, latitudes]
+        rows = range(self.model.rowCount())
+        with span('gui.sites_index'):
+            self.sitesIndex = SitesGridIndex([self.model.data(self.model.index(i, 0)) for i in rows],
+                                             [self.coordinate(i, 3) for i in rows],
+                                             [self.coordinate(i, 2) for i in rows])
+
         # search parameters
         self.HLayout = QHBoxLayout()
         self.search_le = QLineEdit()
@@ -142,10 +182,25 @@ class SitesTable(GenericTableView):
         self.search_cb.addItem('Name')
         self.search_cb.currentIndexChanged.connect(self.cbEventChange)
 
+        # spatial search parameters
+        self.spatialHLayout = QHBoxLayout()
+        self.spatial_le = QLineEdit()
+        self.spatial_le.setPlaceholderText('min lon, min lat, max lon, max lat')
+        self.spatial_le.editingFinished.connect(self.spatialFilter)
+        self.spatial_cb = QComboBox()
+        self.spatial_cb.addItem('No spatial filter')
+        self.spatial_cb.addItem('Bounding box')
+        self.spatial_cb.addItem('Radius (km)')
+        self.spatial_cb.addItem('Nearest')
+        self.spatial_cb.currentIndexChanged.connect(self.spatialEventChange)
+
         # layout
         self.HLayout.addWidget(self.search_le)
         self.HLayout.addWidget(self.search_cb)
+        self.spatialHLayout.addWidget(self.spatial_le)
+        self.spatialHLayout.addWidget(self.spatial_cb)
         self.addLayout(self.HLayout)
+        self.addLayout(self.spatialHLayout)
         self.search_par = self.search_cb.currentText()
 
         self.menu = QMenu()
@@ -159,6 +214,7 @@ class SitesTable(GenericTableView):
         self.addTimeseries = QAction('Import timeseries (single/multiple)...', self)
         self.deleteTimeseries = QAction('Delete timeseries...', self)
         self.timeseriesQuery = QAction('Timeseries query', self)
+        self.regionQuery = QAction('Add region series to workspace...', self)
 
     def cbEventChange(self):
         if self.search_par == 'Code':
@@ -166,6 +222,38 @@ class SitesTable(GenericTableView):
         elif self.search_par == 'Name':
             self.filter_proxy_model.setFilterKeyColumn(1)   # second column
 
+    def coordinate(self, row, col):
+        try:
+            return float(self.model.data(self.model.index(row, col)))
+        except (TypeError, ValueError):
+            return float('nan')
+
+    def spatialEventChange(self):
+        placeholders = {'No spatial filter': 'min lon, min lat, max lon, max lat',
+                        'Bounding box': 'min lon, min lat, max lon, max lat',
+                        'Radius (km)': 'lon, lat, radius km', 'Nearest': 'lon, lat, number of sites'}
+        self.spatial_le.setPlaceholderText(placeholders[self.spatial_cb.currentText()])
+        self.spatialFilter()
+
+    def spatialFilter(self):
+        # filter sites with the spatial index [bounding box, radius or nearest k sites]
+        mode = self.spatial_cb.currentText()
+        try:
+            params = [float(i) for i in self.spatial_le.text().split(',')]
+        except ValueError:
+            params = []
+
+        if mode == 'Bounding box' and len(params) == 4:
+            codes = self.sitesIndex.withinBox(*params)
+        elif mode == 'Radius (km)' and len(params) == 3:
+            codes = [i[0] for i in self.sitesIndex.withinRadius(*params)]
+        elif mode == 'Nearest' and len(params) == 3:
+            codes = [i[0] for i in self.sitesIndex.nearest(params[0], params[1], int(params[2]))]
+        else:
+            codes = None
+
+        self.filter_proxy_model.setSpatialFilter(codes)
+
     # right click menu
     def openMenu(self):
         row = self.filter_proxy_model.mapToSource(self.tableView.selectionModel().currentIndex()).row()
@@ -176,6 +264,7 @@ class SitesTable(GenericTableView):
 
         # drop menu [sites menu and timeseries menu]
         self.timeseriesQuery.triggered.connect(self.emitSite)
+        self.regionQuery.triggered.connect(self.emitRegion)
         self.addSite.triggered.connect(self.createSite)
         self.addTimeseries.triggered.connect(self.importSeries)
 
@@ -189,6 +278,7 @@ class SitesTable(GenericTableView):
         self.timeseriesMenu.addAction(self.deleteTimeseries)
         self.timeseriesMenu.addSeparator()
         self.timeseriesMenu.addAction(self.timeseriesQuery)
+        self.timeseriesMenu.addAction(self.regionQuery)
 
         self.menu.addMenu(self.sitesMenu)
         self.menu.addMenu(self.timeseriesMenu)
@@ -199,6 +289,14 @@ class SitesTable(GenericTableView):
         # emit site to be consulted in the workspace
         self.workspaceSite.emit([self.code, self.name])
 
+    def emitRegion(self):
+        # emit sites shown by the current filter (region) to be consulted in the workspace
+        sites = []
+        for i in range(self.filter_proxy_model.rowCount()):
+            row = self.filter_proxy_model.mapToSource(self.filter_proxy_model.index(i, 0)).row()
+            sites.append([self.model.data(self.model.index(row, 0)), self.model.data(self.model.index(row, 1))])
+        self.workspaceRegion.emit(sites)
+
     def createSite(self):
         self.createNewSite.emit(1)
 
@@ -513,6 +611,7 @@ class TimeseriesTreeView(QTreeWidget):
     # signal to pass timeseries to timeseries dictionary in main-window
     workspaceTimeSeries = pyqtSignal(object)
     changeWorkspace = pyqtSignal(object)
+    analyzeTimeSeries = pyqtSignal(object)
 
     # define default class instances
     l1 = None
@@ -523,6 +622,12 @@ class TimeseriesTreeView(QTreeWidget):
     menu = None
     deleteTimeSeries = None
     processTimeSeries = None
+    missingAnalysis = None
+    monthlyMenu = None
+    statisticsAnalysis = None
+    frequencyAnalysis = None
+    gapFilling = None
+    qualityControl = None
 
     def __init__(self, parent=None):
         super(TimeseriesTreeView, self).__init__(parent)
@@ -534,6 +639,12 @@ class TimeseriesTreeView(QTreeWidget):
         self.setColumnHidden(4, True)
         self.setColumnHidden(5, True)
 
+        # tree-view indexes [source -> item; (source, variable) -> item; timeseries id -> item]
+        self.sourceItems = {}
+        self.variableItems = {}
+        self.seriesItems = {}
+        self.seriesKeys = {}
+
         self.setContextMenuPolicy(Qt.CustomContextMenu)
         self.customContextMenuRequested.connect(self.openMenu)
         self.itemSelectionChanged.connect(self.emitChangeWorkspace)
@@ -545,12 +656,31 @@ class TimeseriesTreeView(QTreeWidget):
         name = time_series_identifier[4][1]
 
         # tree widget structure
-        source = [time_series_identifier[0]]
-        variable = [time_series_identifier[1]]
+        source = time_series_identifier[0]
+        variable = time_series_identifier[1]
         timeseries = [code + ' - ' + name, siteType[-2:], dataQuality, str(ts_id), code, siteType]
-        self.l1 = QTreeWidgetItem(source)                   # level 1 [Source]
-        self.l2 = QTreeWidgetItem(variable)                 # level 2 [Variable]
-        self.l3 = QTreeWidgetItem(timeseries)               # level 3 [Timeseries]
+
+        # check if timeseries already exists in tree-view
+        seriesKey = (source, variable, timeseries[0], timeseries[1], timeseries[2])
+        if seriesKey in self.seriesKeys:
+            return
+
+        # level 1 [Source]
+        self.l1 = self.sourceItems.get(source)
+        if self.l1 is None:
+            self.l1 = QTreeWidgetItem([source])
+            self.addTopLevelItem(self.l1)
+            self.sourceItems[source] = self.l1
+
+        # level 2 [Variable]
+        self.l2 = self.variableItems.get((source, variable))
+        if self.l2 is None:
+            self.l2 = QTreeWidgetItem([variable])
+            self.l1.addChild(self.l2)
+            self.variableItems[(source, variable)] = self.l2
+
+        # level 3 [Timeseries]
+        self.l3 = QTreeWidgetItem(timeseries)
         self.l3.setForeground(0, QBrush(QColor("grey")))
         self.l3.setForeground(1, QBrush(QColor("grey")))
         self.l3.setForeground(2, QBrush(QColor("grey")))
@@ -559,60 +689,90 @@ class TimeseriesTreeView(QTreeWidget):
         # establish that timeseries are not processed (displayed)
         self.l3.isDisplayed = False
 
-        # get all tree-view items
-        items = []
-        # noinspection PyTypeChecker
-        treeIterator = QTreeWidgetItemIterator(self, QTreeWidgetItemIterator.All)
-        while treeIterator.value():
-            if treeIterator.value().columnCount() == 1:
-                value = treeIterator.value().text(0)
-                items.append(value)
-            else:
-                value = [treeIterator.value().text(0), treeIterator.value().text(1),
-                         treeIterator.value().text(2)]
-                items.append(value)
-            treeIterator += 1
-
-        # add timeseries to tree-view
-        root = self.invisibleRootItem()
-        if source[0] in items:
-            l1_child_count = root.childCount()
-            for i in range(l1_child_count):
-                l1_item = root.child(i)
-                if l1_item.text(0) == source[0]:
-                    if variable[0] not in items:
-                        l1_item.addChild(self.l2)
-                        self.l2.addChild(self.l3)
-                        break
-                    else:
-                        l2_child_count = l1_item.childCount()
-                        for j in range(l2_child_count):
-                            l2_item = l1_item.child(j)
-                            if l2_item.text(0) == variable[0]:
-                                if timeseries[:-3] not in items:
-                                    l2_item.addChild(self.l3)
-                                    break
-        else:
-            self.l1.addChild(self.l2)
-            self.l2.addChild(self.l3)
-            self.addTopLevelItem(self.l1)
+        self.l2.addChild(self.l3)
+        self.seriesItems[str(ts_id)] = self.l3
+        self.seriesKeys[seriesKey] = str(ts_id)
+
+    def addSites(self, time_series_identifiers):
+        """
+            Add multiple timeseries {ts_id: time_series_identifier}; sorting is applied once at the end
+        """
+        self.setSortingEnabled(False)
+        for ts_id in time_series_identifiers:
+            self.addSite(ts_id, time_series_identifiers[ts_id])
+        self.setSortingEnabled(True)
+
+    def seriesItem(self, ts_id):
+        # timeseries tree-view item by timeseries id
+        return self.seriesItems.get(str(ts_id))
+
+    def clear(self):
+        super(TimeseriesTreeView, self).clear()
+        self.sourceItems = {}
+        self.variableItems = {}
+        self.seriesItems = {}
+        self.seriesKeys = {}
 
     def openMenu(self):
         self.item = self.currentItem()          # selected item
+        if self.item is None:
+            return
+
+        # analysis of a single timeseries or of all timeseries of a variable (multi-station)
+        self.menu = QMenu()
+        self.missingAnalysis = QAction('Missing data analysis', self)
+        self.missingAnalysis.triggered.connect(lambda: self.emitAnalysis('missing'))
+        self.statisticsAnalysis = QAction('Hydrological statistics', self)
+        self.statisticsAnalysis.triggered.connect(lambda: self.emitAnalysis('statistics'))
+        self.frequencyAnalysis = QAction('Frequency analysis', self)
+        self.frequencyAnalysis.triggered.connect(lambda: self.emitAnalysis('frequency'))
+        self.gapFilling = QAction('Fill gaps from neighbours', self)
+        self.gapFilling.triggered.connect(lambda: self.emitAnalysis('gapfill'))
+        self.qualityControl = QAction('Quality control flags', self)
+        self.qualityControl.triggered.connect(lambda: self.emitAnalysis('qc'))
+        self.monthlyMenu = QMenu('Monthly report')
+        for name, statistic in [('Totals', 'sum'), ('Means', 'mean'), ('Maxima', 'max'), ('Minima', 'min')]:
+            action = self.monthlyMenu.addAction(name)
+            action.triggered.connect(lambda checked, i=statistic: self.emitAnalysis('monthly-' + i))
+
         if self.item.parent() and self.item.parent().parent():
             # check if item is a timeseries item
             self.tsId = self.item.text(3)   # timeseries id in dictionary
-            self.menu = QMenu()
             self.deleteTimeSeries = QAction('Delete timeseries', self)
             self.processTimeSeries = QAction('Display timeseries', self)
             self.processTimeSeries.triggered.connect(self.emitTimeSeriesParameters)
             self.menu.addAction(self.processTimeSeries)
             self.menu.addSeparator()
+            self.menu.addAction(self.missingAnalysis)
+            self.menu.addAction(self.qualityControl)
+            self.menu.addAction(self.statisticsAnalysis)
+            self.menu.addAction(self.frequencyAnalysis)
+            self.menu.addMenu(self.monthlyMenu)
+            self.menu.addSeparator()
             self.menu.addAction(self.deleteTimeSeries)
             self.menu.popup(QCursor.pos())
 
             if self.item.isDisplayed:
                 self.processTimeSeries.setEnabled(False)
+        elif self.item.parent():
+            self.menu.addAction(self.missingAnalysis)
+            self.menu.addAction(self.qualityControl)
+            self.menu.addAction(self.statisticsAnalysis)
+            self.menu.addAction(self.frequencyAnalysis)
+            self.menu.addMenu(self.monthlyMenu)
+            self.menu.addSeparator()
+            self.menu.addAction(self.gapFilling)
+            self.menu.popup(QCursor.pos())
+
+    def itemSeries(self, item):
+        # timeseries ids of a timeseries item or of all timeseries items of a variable item
+        if item.parent() and item.parent().parent():
+            return [int(item.text(3))]
+        return [int(item.child(i).text(3)) for i in range(item.childCount())]
+
+    def emitAnalysis(self, analysis):
+        # emit analysis name and timeseries ids to be processed in the workspace
+        self.analyzeTimeSeries.emit([analysis, self.itemSeries(self.item)])
 
     def emitTimeSeriesParameters(self):
         # emit timeseries parameters to query in the workspace
@@ -633,7 +793,146 @@ class TimeseriesTreeView(QTreeWidget):
 # %% Vector timeseries view
 
 # %% Matrix timeseries view
+# noinspection PyUnresolvedReferences
+class MatrixView(GenericTableView):
+    """
+    Year x month matrix of a station (Aggregation.year_month_matrices / report_matrix dataframe)
+    """
+    def __init__(self, matrix):
+        dictionary = {'Year': [str(i) for i in matrix.index]}
+        for col in matrix.columns:
+            dictionary[col] = ['' if np.isnan(i) else '%.1f' % i for i in matrix[col]]
+        super(MatrixView, self).__init__(dictionary, ['Year'] + list(matrix.columns),
+                                         [0] + [2] * len(matrix.columns))
+
+        self.tableView.verticalHeader().setDefaultSectionSize(18)
+        self.tableView.setSortingEnabled(False)
+
 
 # %% Monthly report view
+# noinspection PyUnresolvedReferences
+class MonthlyReportView(QVBoxLayout):
+    """
+    Monthly report of multiple stations (year x month matrix with summary rows of the selected station):
+        reports: {code: report dataframe}
+    """
+    def __init__(self, reports, parent=None):
+        super(MonthlyReportView, self).__init__(parent)
+
+        self.reports = reports
+        self.matrixWidget = None
+
+        # station selection
+        self.stationCb = QComboBox()
+        for code in reports:
+            self.stationCb.addItem(code)
+        self.stationCb.currentIndexChanged.connect(self.showStation)
+        self.addWidget(self.stationCb)
+
+        self.showStation()
+
+    def showStation(self):
+        if self.matrixWidget is not None:
+            self.removeWidget(self.matrixWidget)
+            self.matrixWidget.deleteLater()
+
+        code = self.stationCb.currentText()
+        self.matrixWidget = QWidget()
+        if code in self.reports:
+            self.matrixWidget.setLayout(MatrixView(self.reports[code]))
+        self.addWidget(self.matrixWidget)
+
 
 # %% Missing analysis report view
+# noinspection PyUnresolvedReferences
+class MissingReportView(GenericTableView):
+    """
+    Missing data report (MissingAnalysis.missing_report tidy table):
+        Year 0 rows summarize the whole record, Month 0 rows summarize a year
+    """
+    def __init__(self, report):
+        dictionary = {'Code': list(report['Code']), 'Year': list(report['Year']), 'Month': list(report['Month']),
+                      'Days': list(report['Days']), 'Missing': list(report['Missing']),
+                      'Completeness': ['%.1f' % i for i in report['Completeness']],
+                      'LongestGap': list(report['LongestGap']), 'Gaps': list(report['Gaps'])}
+        super(MissingReportView, self).__init__(dictionary, ['Code', 'Year', 'Month', 'Days', 'Missing',
+                                                             'Completeness (%)', 'Longest gap', 'Gaps'],
+                                                [0, 2, 2, 2, 2, 2, 2, 2])
+
+        self.tableView.verticalHeader().setDefaultSectionSize(18)
+
+        # search parameters [station code]
+        self.search_le = QLineEdit()
+        self.search_le.setPlaceholderText('Code')
+        self.search_le.textChanged.connect(self.filter_proxy_model.setFilterRegExp)
+        self.addWidget(self.search_le)
+
+
+# %% Statistics view
+# noinspection PyUnresolvedReferences
+class StatisticsView(GenericTableView):
+    """
+    Hydrological statistics of multiple stations (HydroStatistics.station_statistics dataframe)
+    """
+    def __init__(self, statistics):
+        dictionary = {'Code': [str(i) for i in statistics.index]}
+        for col in statistics.columns:
+            if col == 'N':
+                dictionary[col] = [str(int(i)) for i in statistics[col]]
+            else:
+                dictionary[col] = ['' if np.isnan(i) else '%.3f' % i for i in statistics[col]]
+        super(StatisticsView, self).__init__(dictionary, ['Code'] + list(statistics.columns),
+                                             [0] + [2] * len(statistics.columns))
+
+        self.tableView.verticalHeader().setDefaultSectionSize(18)
+
+
+# %% Frequency analysis view
+# noinspection PyUnresolvedReferences
+class FrequencyView(GenericTableView):
+    """
+    Return period quantiles of multiple stations (FrequencyAnalysis.fit_distributions dataframe)
+    """
+    def __init__(self, quantiles):
+        periods = ['%g' % i for i in quantiles.columns]
+        dictionary = {'Code': [str(i[0]) for i in quantiles.index], 'Distribution': [i[1] for i in quantiles.index]}
+        for col, period in zip(quantiles.columns, periods):
+            dictionary[period] = ['' if np.isnan(i) else '%.3f' % i for i in quantiles[col]]
+        super(FrequencyView, self).__init__(dictionary, ['Code', 'Distribution'] + ['Tr %s' % i for i in periods],
+                                            [0, 0] + [2] * len(periods))
+
+        self.tableView.verticalHeader().setDefaultSectionSize(18)
+
+        # search parameters [station code]
+        self.search_le = QLineEdit()
+        self.search_le.setPlaceholderText('Code')
+        self.search_le.textChanged.connect(self.filter_proxy_model.setFilterRegExp)
+        self.addWidget(self.search_le)
+
+
+# %% Gap filling view
+# noinspection PyUnresolvedReferences
+class GapFillingView(GenericTableView):
+    """
+    Filled days and neighbours used by each station (GapFilling.fill_summary dataframe)
+    """
+    def __init__(self, summary):
+        dictionary = {'Code': list(summary['Code']), 'Filled': [str(i) for i in summary['Filled']],
+                      'Neighbours': list(summary['Neighbours'])}
+        super(GapFillingView, self).__init__(dictionary, ['Code', 'Filled days', 'Neighbours'], [0, 2, 1])
+
+        self.tableView.verticalHeader().setDefaultSectionSize(18)
+
+
+# %% Quality control view
+# noinspection PyUnresolvedReferences
+class QualityControlView(GenericTableView):
+    """
+    Flagged values of each station by test (QualityControl.flag_counts dataframe)
+    """
+    def __init__(self, counts):
+        dictionary = {col: [str(i) for i in counts[col]] for col in counts.columns}
+        super(QualityControlView, self).__init__(dictionary, list(counts.columns),
+                                                 [0] + [2] * (len(counts.columns) - 1))
+
+        self.tableView.verticalHeader().setDefaultSectionSize(18)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Monthly and annual aggregation of daily series (all stations in one pass over a days x stations matrix)
+        - Totals, means, maxima and minima
+        - Completeness thresholds (fraction of valid days in the month/year)
+    + Year x month matrix per station (classic IDEAM report), with annual column and summary rows
+    + Cache of matrices keyed by series version (reports regenerate only when data changes)
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import hashlib
+import numpy as np
+import pandas as pd
+from SeriesArrays import stack_daily, calendar, period_starts
+
+STATISTICS = ('sum', 'mean', 'max', 'min')
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+# %% Grouped reductions
+def _reduce(values, valid, starts, periods_days, statistic, min_completeness):
+    """
+        Reduce daily matrix over periods starting at rows 'starts'; periods below completeness are NaN
+    """
+    count = np.add.reduceat(valid, starts, axis=0)
+
+    if statistic in ('sum', 'mean'):
+        result = np.add.reduceat(np.where(valid, values, 0.), starts, axis=0)
+        if statistic == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = result / count
+    elif statistic == 'max':
+        result = np.maximum.reduceat(np.where(valid, values, -np.inf), starts, axis=0)
+    elif statistic == 'min':
+        result = np.minimum.reduceat(np.where(valid, values, np.inf), starts, axis=0)
+    else:
+        raise ValueError('Unknown statistic %s (%s)' % (statistic, ', '.join(STATISTICS)))
+
+    complete = count >= np.ceil(min_completeness * periods_days[:, None] - 1e-9)
+    return np.where(complete & (count > 0), result, np.nan)
+
+
+# %% Monthly and annual aggregation
+def aggregate(series_dict, statistic='mean', min_completeness=0.9):
+    """
+        Aggregate daily series {code: pandas series} to monthly and annual values
+            statistic: 'sum', 'mean', 'max' or 'min'
+            min_completeness: minimum fraction of valid days in the month (year) to report a value
+        [codes, years, monthly (stations x years x 12), annual (stations x years)]
+    """
+    codes, dates, values = stack_daily(series_dict)
+    if not len(dates):
+        return codes, np.array([], dtype=np.int64), np.empty((len(codes), 0, 12)), np.empty((len(codes), 0))
+
+    valid = ~np.isnan(values)
+    years, months, _ = calendar(dates)
+
+    # calendar days of each month and year (months at the ends of the matrix may be partial)
+    monthStarts = period_starts(years * 12 + months)
+    monthDates = dates[monthStarts].astype('datetime64[M]')
+    monthDays = ((monthDates + 1).astype('datetime64[D]') - monthDates.astype('datetime64[D]')).astype(np.int64)
+    yearStarts = period_starts(years)
+    yearDates = dates[yearStarts].astype('datetime64[Y]')
+    yearDays = ((yearDates + 1).astype('datetime64[D]') - yearDates.astype('datetime64[D]')).astype(np.int64)
+
+    monthValues = _reduce(values, valid, monthStarts, monthDays, statistic, min_completeness)
+    yearValues = _reduce(values, valid, yearStarts, yearDays, statistic, min_completeness)
+
+    # scatter monthly values to a year x month grid
+    allYears = years[yearStarts]
+    monthly = np.full((len(codes), len(allYears), 12), np.nan)
+    monthly[:, years[monthStarts] - allYears[0], months[monthStarts] - 1] = monthValues.T
+
+    return codes, allYears, monthly, yearValues.T
+
+
+def matrix_frame(years, monthly, annual):
+    """
+        Year x month dataframe of a single station (months columns and 'Annual' column)
+    """
+    frame = pd.DataFrame(monthly, index=pd.Index(years, name='Year'), columns=MONTHS)
+    frame['Annual'] = annual
+    return frame
+
+
+def year_month_matrices(series_dict, statistic='mean', min_completeness=0.9):
+    """
+        Year x month matrix of each station {code: dataframe}; years without data are dropped
+    """
+    codes, years, monthly, annual = aggregate(series_dict, statistic, min_completeness)
+    matrices = {}
+    for n, code in enumerate(codes):
+        frame = matrix_frame(years, monthly[n], annual[n])
+        matrices[code] = frame[frame.notna().any(axis=1)]
+    return matrices
+
+
+def report_matrix(matrix, statistic='mean'):
+    """
+        Matrix with summary rows of each column (Mean, Max, Min and valid years)
+    """
+    summary = pd.DataFrame([matrix.mean(), matrix.max(), matrix.min(), matrix.count()],
+                           index=['Mean', 'Max', 'Min', 'Years'])
+    if statistic == 'sum':
+        summary.loc['Mean', 'Annual'] = matrix[MONTHS].mean().sum()
+    report = matrix.copy()
+    report.index = report.index.astype(str)
+    return pd.concat([report, summary])
+
+
+# %% Cache of matrices keyed by series version
+def series_version(series):
+    """
+        Version of a series (digest of its dates and values)
+    """
+    digest = hashlib.sha1(np.ascontiguousarray(np.asarray(series.index.values, dtype='datetime64[s]')).view(np.uint8))
+    digest.update(np.ascontiguousarray(np.asarray(series.values, dtype=np.float64)).view(np.uint8))
+    return digest.hexdigest()
+
+
+class AggregationCache(object):
+    """
+    Year x month matrices cached by (code, statistic, completeness, series version); stale stations are
+    aggregated together in one pass
+    """
+    def __init__(self):
+        self.matrices = {}
+
+    def get(self, series_dict, statistic='mean', min_completeness=0.9, versions=None):
+        """
+            Year x month matrix of each station {code: dataframe}
+            versions: {code: version} when known by the caller (e.g. database watermark), digest otherwise
+        """
+        versions = versions or {}
+        keys = {}
+        stale = {}
+        for code, series in series_dict.items():
+            version = versions.get(code) or series_version(series)
+            keys[code] = (code, statistic, min_completeness, version)
+            if keys[code] not in self.matrices:
+                stale[code] = series
+
+        if stale:
+            for code, frame in year_month_matrices(stale, statistic, min_completeness).items():
+                self.matrices[keys[code]] = frame
+
+        return {str(code): self.matrices[keys[code]] for code in series_dict}
+
+    def clear(self):
+        self.matrices.clear()
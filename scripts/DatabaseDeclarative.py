@@ -21,7 +21,7 @@ email:      andresfduque@gmail.com
 """
 
 # %% Main imports
-from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, Text, Float, DateTime
+from sqlalchemy import Column, ForeignKey, Integer, SmallInteger, String, Boolean, Text, Float, DateTime
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 import warnings
@@ -357,6 +357,13 @@ class DataValues(Base):
     QualityControl = relationship(QualityControlLevels)
 
 
+# %% Quality control flags [QualityControl bitmask of flagged values]
+class DataValuesQC(Base):
+    __tablename__ = 'DataValuesQC'
+    ValueId = Column(Integer, ForeignKey('DataValues.ValueId', ondelete='CASCADE'), primary_key=True)
+    QCFlags = Column(SmallInteger, nullable=False)
+
+
 # %% Derived data
 class DerivedForm(Base):
     __tablename__ = 'DerivedForm'
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Synchronize reference data (controlled vocabularies, ODM2COL structure) with an existing database
+        - Diff incoming rows against existing rows by primary key (one query per chunk of keys)
+        - Set-based upsert of new and changed rows only (INSERT ... ON CONFLICT DO UPDATE in postgres and
+          sqlite, insert + update executemany in other databases)
+        - Report inserted, updated and unchanged rows
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import math
+import datetime
+import numpy as np
+from sqlalchemy import inspect, select, tuple_, and_, bindparam
+from Instrumentation import instrumented, count
+
+CHUNK_SIZE = 1000
+
+
+# %% Rows from declarative objects
+def object_rows(objects):
+    """
+        Attribute dictionaries of declarative objects (only attributes set on each object)
+    """
+    rows = []
+    for obj in objects:
+        row = {}
+        for key, value in vars(obj).items():
+            if not key.startswith('_'):
+                row[key] = value.item() if isinstance(value, np.generic) else value
+        rows.append(row)
+    return rows
+
+
+# %% Value comparison
+def _normalize(value, column):
+    """
+        Comparable value of a column (csv strings against database typed values)
+    """
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+
+    try:
+        pythonType = column.type.python_type
+    except NotImplementedError:
+        pythonType = None
+
+    try:
+        if pythonType in (int, float) or (pythonType is not None and pythonType.__name__ == 'Decimal'):
+            return float(value)
+        if pythonType in (datetime.datetime, datetime.date):
+            return str(np.datetime64(value.replace(' ', 'T') if isinstance(value, str) else value, 's'))
+        if pythonType is bool:
+            return str(value).lower() in ('1', 'true', 't')
+    except (TypeError, ValueError):
+        pass
+    return str(value)
+
+
+def _comparable(column):
+    """
+        Columns without python type (e.g. geometries) are written but not compared
+    """
+    try:
+        column.type.python_type
+        return True
+    except NotImplementedError:
+        return False
+
+
+# %% Set-based upsert of a single table
+@instrumented('db', 'upsert')
+def _upsert(session, table, pk_columns, rows, update_columns):
+    """
+        rows: [(is_new, row), ...] with rows keyed by column name
+    """
+    dialect = session.get_bind().dialect.name
+    count('db.upserted_rows', len(rows))
+
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        # rows are grouped by key set, one multi-values statement per group
+        groups = {}
+        for _, row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+
+        for keys, groupRows in groups.items():
+            stmt = insert(table).values(groupRows)
+            updates = {c: stmt.excluded[c] for c in keys if c in update_columns}
+            if updates:
+                stmt = stmt.on_conflict_do_update(index_elements=[c.name for c in pk_columns], set_=updates)
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=[c.name for c in pk_columns])
+            session.execute(stmt)
+    else:
+        # generic path [existence is known from the diff]
+        inserts = [i[1] for i in rows if i[0]]
+        updates = [i[1] for i in rows if not i[0]]
+        if inserts:
+            session.execute(table.insert(), inserts)
+        for row in updates:
+            values = {c: row[c] for c in row if c in update_columns}
+            if values:
+                session.execute(table.update().where(and_(*[c == bindparam('pk_' + c.key) for c in pk_columns])),
+                                dict(values, **{'pk_' + c.key: row[c.key] for c in pk_columns}))
+
+
+# %% Synchronize rows of a declarative class
+def sync_rows(session, mapped_class, rows, insert_only=()):
+    """
+        Insert new rows and update changed rows of a declarative class:
+            rows: attribute dictionaries [{'Name': ..., 'Term': ...}, ...]
+            insert_only: attributes written only on insert (not compared, e.g. generated uuids)
+        Joined-table classes (e.g. Sites) are synchronized table by table
+        {'inserted': n, 'updated': n, 'unchanged': n}
+    """
+    mapper = inspect(mapped_class)
+
+    # database column -> class attribute
+    columnAttrs = {}
+    for prop in mapper.column_attrs:
+        for column in prop.columns:
+            columnAttrs[column] = prop.key
+
+    states = [None] * len(rows)                                       # 'inserted' / 'updated' / None
+    for table in mapper.tables:
+        columns = [c for c in table.columns if c in columnAttrs]
+        pkColumns = list(table.primary_key.columns)
+        compared = [c for c in columns if c not in pkColumns and columnAttrs[c] not in insert_only and
+                    _comparable(c)]
+        updateColumns = {c.key for c in columns if c not in pkColumns and columnAttrs[c] not in insert_only}
+
+        tableRows = [{c.key: row[columnAttrs[c]] for c in columns if columnAttrs[c] in row} for row in rows]
+        keys = [tuple(_normalize(r.get(c.key), c) for c in pkColumns) for r in tableRows]
+
+        # existing rows with the incoming primary keys [one query per chunk]
+        existing = {}
+        for start in range(0, len(tableRows), CHUNK_SIZE):
+            chunk = [tuple(r.get(c.key) for c in pkColumns) for r in tableRows[start:start + CHUNK_SIZE]]
+            if len(pkColumns) == 1:
+                where = pkColumns[0].in_([i[0] for i in chunk])
+            else:
+                where = tuple_(*pkColumns).in_(chunk)
+            for dbRow in session.execute(select(*(pkColumns + compared)).where(where)):
+                dbRow = tuple(dbRow)
+                existing[tuple(_normalize(v, c) for v, c in zip(dbRow, pkColumns))] = dbRow[len(pkColumns):]
+
+        # diff incoming rows [new, changed or unchanged]; repeated keys keep the last row
+        last = {key: n for n, key in enumerate(keys)}
+        changed = []
+        for n, (key, row) in enumerate(zip(keys, tableRows)):
+            if last[key] != n:
+                continue
+            if key not in existing:
+                changed.append((True, row))
+                states[n] = states[n] or 'inserted'
+            else:
+                dbValues = dict(zip(compared, existing[key]))
+                if any(_normalize(row[c.key], c) != _normalize(dbValues[c], c) for c in compared if c.key in row):
+                    changed.append((False, row))
+                    states[n] = states[n] or 'updated'
+
+        for start in range(0, len(changed), CHUNK_SIZE):
+            _upsert(session, table, pkColumns, changed[start:start + CHUNK_SIZE], updateColumns)
+
+    counts = {'inserted': states.count('inserted'), 'updated': states.count('updated')}
+    counts['unchanged'] = len(rows) - counts['inserted'] - counts['updated']
+    return counts
+
+
+def sync_objects(session, objects, insert_only=()):
+    """
+        Synchronize declarative objects (all of the same class) with the database
+        {'inserted': n, 'updated': n, 'unchanged': n}
+    """
+    if not objects:
+        return {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    return sync_rows(session, type(objects[0]), object_rows(objects), insert_only)
+
+
+def format_counts(name, counts):
+    return '%s: %d inserted, %d updated, %d unchanged' % (name, counts['inserted'], counts['updated'],
+                                                          counts['unchanged'])
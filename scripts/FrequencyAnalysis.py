@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Frequency analysis of annual maxima series (all stations at once, years x stations matrix)
+        - Annual maxima from daily series or from IDEAM monthly maxima (maximos_mensuales)
+        - L-moments estimated for every station with vectorized probability weighted moments
+        - Gumbel, GEV and Log-Pearson III fits (Hosking & Wallis L-moments approximations)
+        - Quantiles for return periods (years)
+    + Parallel execution across stations (process pool) and cache of fits keyed by series version
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import math
+import hashlib
+import numpy as np
+import pandas as pd
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor
+from Aggregation import aggregate
+
+DISTRIBUTIONS = ('Gumbel', 'GEV', 'LP3')
+RETURN_PERIODS = (2, 2.33, 5, 10, 25, 50, 100, 200, 500)
+EULER = 0.5772156649015329
+
+_gamma = np.vectorize(math.gamma, otypes=[np.float64])
+_lgamma = np.vectorize(math.lgamma, otypes=[np.float64])
+
+
+# %% Annual maxima series
+def annual_maxima(series_dict, min_completeness=0.9):
+    """
+        Annual maxima of daily series {code: pandas series} [years x stations dataframe]
+    """
+    codes, years, _, annual = aggregate(series_dict, 'max', min_completeness)
+    return pd.DataFrame(annual.T, index=pd.Index(years, name='Year'), columns=codes)
+
+
+def annual_maxima_from_monthly(monthly_dict, min_months=12):
+    """
+        Annual maxima from monthly maxima series {code: pandas series} (e.g. IDEAM 'maximos_mensuales')
+        [years x stations dataframe]
+    """
+    maxima = {}
+    for code, series in monthly_dict.items():
+        years = pd.DatetimeIndex(series.index).year
+        grouped = series.groupby(years)
+        annual = grouped.max()
+        maxima[str(code)] = annual.where(grouped.count() >= min_months)
+    return pd.DataFrame(maxima).sort_index().rename_axis('Year')
+
+
+# %% Vectorized L-moments
+def l_moments(values):
+    """
+        Sample L-moments of each column of a years x stations matrix (NaN for missing years)
+        [n, l1, l2, t3] arrays
+    """
+    x = np.sort(values, axis=0)                                   # NaN values sorted to the end
+    valid = ~np.isnan(x)
+    n = valid.sum(axis=0).astype(np.float64)
+    x = np.where(valid, x, 0.)
+    rank = np.arange(x.shape[0], dtype=np.float64)[:, None]        # i - 1
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        b0 = x.sum(axis=0) / n
+        b1 = (rank / (n - 1) * x).sum(axis=0) / n
+        b2 = (rank * (rank - 1) / ((n - 1) * (n - 2)) * x).sum(axis=0) / n
+        l1 = b0
+        l2 = 2 * b1 - b0
+        l3 = 6 * b2 - 6 * b1 + b0
+        t3 = l3 / l2
+
+    return n, l1, l2, t3
+
+
+# %% Distribution fits
+def fit_gumbel(l1, l2):
+    alpha = l2 / math.log(2)
+    return {'xi': l1 - EULER * alpha, 'alpha': alpha}
+
+
+def quantile_gumbel(params, prob):
+    return params['xi'][:, None] - params['alpha'][:, None] * np.log(-np.log(prob))
+
+
+def fit_gev(l1, l2, t3):
+    c = 2. / (3. + t3) - math.log(2) / math.log(3)
+    k = 7.8590 * c + 2.9554 * c ** 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gk = _gamma(np.where(np.isnan(k), 1., 1 + k))
+        alpha = l2 * k / ((1 - 2. ** -k) * gk)
+        xi = l1 - alpha * (1 - gk) / k
+    return {'xi': xi, 'alpha': alpha, 'k': k}
+
+
+def quantile_gev(params, prob):
+    k = params['k'][:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = params['xi'][:, None] + params['alpha'][:, None] / k * (1 - (-np.log(prob)) ** k)
+    # k ~ 0 reduces to Gumbel
+    gumbel = params['xi'][:, None] - params['alpha'][:, None] * np.log(-np.log(prob))
+    return np.where(np.abs(k) < 1e-6, gumbel, x)
+
+
+def fit_pearson3(l1, l2, t3):
+    """
+        Pearson III parameters from L-moments (mean, standard deviation, skewness)
+    """
+    at3 = np.abs(t3)
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        z = np.where(at3 >= 1. / 3, 1 - at3, 3 * math.pi * t3 ** 2)
+        shape = np.where(at3 >= 1. / 3,
+                         (0.36067 * z - 0.59567 * z ** 2 + 0.25361 * z ** 3) /
+                         (1 - 2.78861 * z + 2.56096 * z ** 2 - 0.77045 * z ** 3),
+                         (1 + 0.2906 * z) / (z + 0.1882 * z ** 2 + 0.0442 * z ** 3))
+        shape = np.where(np.isnan(shape), np.inf, shape)
+        finite = np.isfinite(shape) & (shape > 0)
+        safeShape = np.where(finite, shape, 1.)
+        ratio = np.exp(_lgamma(safeShape) - _lgamma(safeShape + 0.5))
+        sigma = np.where(finite, l2 * math.sqrt(math.pi) * np.sqrt(safeShape) * ratio, l2 * math.sqrt(math.pi))
+        skew = np.where(finite, 2 * np.sign(t3) / np.sqrt(safeShape), 0.)
+    return {'mu': l1, 'sigma': sigma, 'skew': skew}
+
+
+def frequency_factor(skew, prob):
+    """
+        Pearson III frequency factor (Wilson-Hilferty approximation)
+    """
+    z = np.array([NormalDist().inv_cdf(p) for p in np.ravel(prob)]).reshape(np.shape(prob))
+    g = skew[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        k = 2 / g * ((1 + g * z / 6 - g ** 2 / 36) ** 3 - 1)
+    return np.where(np.abs(g) < 1e-6, z, k)
+
+
+def quantile_lp3(params, prob):
+    return 10 ** (params['mu'][:, None] + params['sigma'][:, None] * frequency_factor(params['skew'], prob))
+
+
+# %% Frequency analysis of a set of stations
+def fit_distributions(maxima, return_periods=RETURN_PERIODS, min_years=10):
+    """
+        Fit distributions to annual maxima (years x stations dataframe)
+        [quantiles dataframe (Code, Distribution) x return periods, parameters dataframe]
+    """
+    codes = [str(i) for i in maxima.columns]
+    values = maxima.values.astype(np.float64)
+    prob = 1 - 1. / np.asarray(return_periods, dtype=np.float64)[None, :]
+
+    n, l1, l2, t3 = l_moments(values)
+    enough = n >= min_years
+
+    # log-space L-moments for Log-Pearson III (non positive maxima are discarded)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        logValues = np.where(values > 0, np.log10(values), np.nan)
+    _, ll1, ll2, lt3 = l_moments(logValues)
+
+    params = {'Gumbel': fit_gumbel(l1, l2), 'GEV': fit_gev(l1, l2, t3), 'LP3': fit_pearson3(ll1, ll2, lt3)}
+    quantiles = {'Gumbel': quantile_gumbel(params['Gumbel'], prob), 'GEV': quantile_gev(params['GEV'], prob),
+                 'LP3': quantile_lp3(params['LP3'], prob)}
+
+    quantileFrames = []
+    paramFrames = []
+    for dist in DISTRIBUTIONS:
+        q = np.where(enough[:, None], quantiles[dist], np.nan)
+        index = pd.MultiIndex.from_product([codes, [dist]], names=['Code', 'Distribution'])
+        quantileFrames.append(pd.DataFrame(q, index=index, columns=list(return_periods)))
+        p = {key: np.where(enough, value, np.nan) for key, value in params[dist].items()}
+        p.update({'N': n, 'L1': l1, 'L2': l2, 'T3': t3})
+        paramFrames.append(pd.DataFrame(p, index=index))
+
+    quantileTable = pd.concat(quantileFrames).sort_index(level=0, sort_remaining=False)
+    paramTable = pd.concat(paramFrames).sort_index(level=0, sort_remaining=False)
+    return quantileTable, paramTable
+
+
+def batch_fit(maxima, return_periods=RETURN_PERIODS, min_years=10, workers=None, chunk_size=500):
+    """
+        Fit distributions to many stations; with workers > 1 stations are split in chunks processed by a pool
+        of processes (see fit_distributions)
+    """
+    if not workers or workers <= 1 or maxima.shape[1] <= chunk_size:
+        return fit_distributions(maxima, return_periods, min_years)
+
+    chunks = [maxima.iloc[:, i:i + chunk_size] for i in range(0, maxima.shape[1], chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(fit_distributions, chunks, [return_periods] * len(chunks),
+                                    [min_years] * len(chunks)))
+    return pd.concat([i[0] for i in results]), pd.concat([i[1] for i in results])
+
+
+# %% Cache of fits keyed by annual maxima version
+class FrequencyCache(object):
+    """
+    Fits cached by (code, return periods, minimum years, annual maxima digest); new data changes the digest
+    and only the stale stations are fitted again
+    """
+    def __init__(self):
+        self.fits = {}
+
+    @staticmethod
+    def version(values):
+        return hashlib.sha1(np.ascontiguousarray(values, dtype=np.float64).view(np.uint8)).hexdigest()
+
+    def get(self, maxima, return_periods=RETURN_PERIODS, min_years=10, workers=None):
+        """
+            Quantiles and parameters of each station (see fit_distributions)
+        """
+        keys = {}
+        stale = []
+        for code in maxima.columns:
+            column = maxima[code].dropna()
+            keys[code] = (str(code), tuple(return_periods), min_years,
+                          FrequencyCache.version(np.c_[column.index.values, column.values]))
+            if keys[code] not in self.fits:
+                stale.append(code)
+
+        if stale:
+            quantiles, params = batch_fit(maxima[stale], return_periods, min_years, workers)
+            for code in stale:
+                self.fits[keys[code]] = (quantiles.loc[[str(code)]], params.loc[[str(code)]])
+
+        fits = [self.fits[keys[code]] for code in maxima.columns]
+        if not fits:
+            return pd.DataFrame(), pd.DataFrame()
+        return pd.concat([i[0] for i in fits]), pd.concat([i[1] for i in fits])
+
+    def clear(self):
+        self.fits.clear()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Gap filling of daily series of a whole region at once (days x stations matrix)
+        - Neighbour candidates by distance (site coordinates of the Sites table)
+        - Correlation and linear regression of every pair of stations over their overlapping days
+          (matrix products over the stacked station array)
+        - Gaps filled from the most correlated neighbours (best ranked neighbour with data on each day)
+    + Fill provenance (neighbour, correlation and qualifier code of each filled value)
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import numpy as np
+import pandas as pd
+from SeriesArrays import stack_daily
+from SpatialIndex import haversine_km
+from MissingAnalysis import record_mask
+
+FILL_QUALIFIER_CODE = 'GF'
+PROVENANCE_COLUMNS = ['Code', 'Date', 'Value', 'Neighbour', 'Correlation', 'QualifierCode']
+NEIGHBOUR_COLUMNS = ['Code', 'Rank', 'Neighbour', 'Distance', 'Correlation', 'Overlap', 'Intercept', 'Slope']
+
+
+# %% Station distances
+def distance_matrix(lons, lats):
+    """
+        Great circle distances (km) between all stations [stations x stations]
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    return haversine_km(lons[:, None], lats[:, None], lons[None, :], lats[None, :])
+
+
+# %% Pairwise regressions over overlapping days
+def overlap_regressions(values):
+    """
+        Overlapping days, correlation, intercept and slope of the regression of each station (rows) on each
+        other station (columns) over the days both have data [stations x stations matrices]
+    """
+    valid = ~np.isnan(values)
+    v = valid.astype(np.float64)
+    x = np.where(valid, values, 0.)
+
+    n = v.T @ v                                 # overlapping days
+    sx = x.T @ v                                # sx[i, j]: sum of station i on days j has data
+    sxx = (x * x).T @ v
+    sxy = x.T @ x
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = n * sxy - sx * sx.T
+        varTarget = n * sxx - sx ** 2
+        varNeighbour = varTarget.T
+        r = cov / np.sqrt(varTarget * varNeighbour)
+        slope = cov / varNeighbour
+        intercept = (sx - slope * sx.T) / n
+
+    np.fill_diagonal(r, np.nan)
+    return n, r, intercept, slope
+
+
+def select_neighbours(r, n, distances=None, k=3, candidates=10, max_distance_km=None, min_overlap=365,
+                      min_correlation=0.7):
+    """
+        Most correlated neighbours of each station among its nearest candidates
+        [stations x k] indexes, -1 where there are not enough neighbours
+    """
+    nStations = r.shape[0]
+    eligible = (n >= min_overlap) & (r >= min_correlation)
+    np.fill_diagonal(eligible, False)
+
+    if distances is not None:
+        distances = np.where(np.isnan(distances), np.inf, distances)
+        np.fill_diagonal(distances, np.inf)
+        if max_distance_km is not None:
+            eligible &= distances <= max_distance_km
+        if candidates and candidates < nStations:
+            nearest = np.argsort(distances, axis=1, kind='stable')[:, :candidates]
+            closest = np.zeros_like(eligible)
+            closest[np.arange(nStations)[:, None], nearest] = True
+            eligible &= closest
+
+    score = np.where(eligible, r, -np.inf)
+    order = np.argsort(-score, axis=1, kind='stable')[:, :k]
+    ranked = np.take_along_axis(score, order, axis=1)
+    neighbours = np.where(np.isfinite(ranked), order, -1)
+    if neighbours.shape[1] < k:
+        neighbours = np.hstack((neighbours, np.full((nStations, k - neighbours.shape[1]), -1)))
+    return neighbours
+
+
+# %% Fill gaps
+def fill_matrix(values, neighbours, intercept, slope, non_negative=True):
+    """
+        Fill missing days inside each station record with the regression on the best ranked neighbour that
+        has (observed) data on that day
+        [filled values, source matrix (neighbour column of filled days, -1 otherwise)]
+    """
+    stations = np.arange(values.shape[1])
+    fillable = record_mask(~np.isnan(values)) & np.isnan(values)
+    filled = values.copy()
+    source = np.full(values.shape, -1, dtype=np.int64)
+
+    for rank in range(neighbours.shape[1]):
+        nb = neighbours[:, rank]
+        has = nb >= 0
+        if not has.any() or not fillable.any():
+            break
+        cols = np.where(has, nb, 0)
+        with np.errstate(invalid='ignore'):
+            estimate = intercept[stations, cols] + slope[stations, cols] * values[:, cols]
+        if non_negative:
+            estimate = np.maximum(estimate, 0.)
+        use = fillable & has & ~np.isnan(estimate)
+        filled[use] = estimate[use]
+        source[use] = np.broadcast_to(cols, values.shape)[use]
+        fillable &= ~use
+
+    return filled, source
+
+
+def fill_gaps(series_dict, coordinates=None, k=3, candidates=10, max_distance_km=None, min_overlap=365,
+              min_correlation=0.7, non_negative=True):
+    """
+        Fill gaps of daily series of a region {code: pandas series}
+            coordinates: {code: (longitude, latitude)}; all stations are candidates when not given
+            k: neighbours used by each station (best correlated first)
+            candidates: nearest stations evaluated as neighbours
+        [filled series {code: pandas series}, provenance dataframe (PROVENANCE_COLUMNS),
+         neighbours dataframe (NEIGHBOUR_COLUMNS)]
+    """
+    codes, dates, values = stack_daily(series_dict)
+    if not len(dates):
+        return ({code: series_dict[code] for code in series_dict}, pd.DataFrame(columns=PROVENANCE_COLUMNS),
+                pd.DataFrame(columns=NEIGHBOUR_COLUMNS))
+
+    distances = None
+    if coordinates is not None:
+        lonLat = np.array([coordinates.get(code, (np.nan, np.nan)) for code in codes], dtype=np.float64)
+        distances = distance_matrix(lonLat[:, 0], lonLat[:, 1])
+
+    n, r, intercept, slope = overlap_regressions(values)
+    neighbours = select_neighbours(r, n, distances, k, candidates, max_distance_km, min_overlap, min_correlation)
+    filled, source = fill_matrix(values, neighbours, intercept, slope, non_negative)
+
+    # filled series inside each station record
+    inRecord = record_mask(~np.isnan(values))
+    filledDict = {}
+    for col, code in enumerate(codes):
+        keep = inRecord[:, col] & ~np.isnan(filled[:, col])
+        filledDict[code] = pd.Series(filled[keep, col], index=pd.DatetimeIndex(dates[keep]), name=code)
+
+    codesArray = np.asarray(codes, dtype=object)
+    rows, cols = np.nonzero(source >= 0)
+    provenance = pd.DataFrame({'Code': codesArray[cols], 'Date': dates[rows], 'Value': filled[rows, cols],
+                               'Neighbour': codesArray[source[rows, cols]], 'Correlation': r[cols, source[rows, cols]],
+                               'QualifierCode': FILL_QUALIFIER_CODE}, columns=PROVENANCE_COLUMNS)
+    provenance = provenance.sort_values(['Code', 'Date'], kind='stable').reset_index(drop=True)
+
+    targets, ranks = np.nonzero(neighbours >= 0)
+    nb = neighbours[targets, ranks]
+    neighboursTable = pd.DataFrame({'Code': codesArray[targets], 'Rank': ranks + 1, 'Neighbour': codesArray[nb],
+                                    'Distance': distances[targets, nb] if distances is not None else np.nan,
+                                    'Correlation': r[targets, nb], 'Overlap': n[targets, nb].astype(np.int64),
+                                    'Intercept': intercept[targets, nb], 'Slope': slope[targets, nb]},
+                                   columns=NEIGHBOUR_COLUMNS)
+
+    return filledDict, provenance, neighboursTable
+
+
+def fill_summary(series_dict, provenance):
+    """
+        Filled days of each station and neighbours used [Code, Filled, Neighbours] dataframe
+    """
+    grouped = provenance.groupby('Code')
+    filledDays = grouped.size()
+    used = grouped['Neighbour'].agg(lambda i: ', '.join(pd.unique(i)))
+    codes = [str(i) for i in series_dict]
+    return pd.DataFrame({'Code': codes, 'Filled': [int(filledDays.get(i, 0)) for i in codes],
+                         'Neighbours': [used.get(i, '') for i in codes]})
+
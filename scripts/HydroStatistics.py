@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Hydrological statistics of many stations at once (vectorized over a days x stations matrix)
+        - Base statistics (count, mean, standard deviation, coefficient of variation, min, max, skewness)
+        - Flow duration curves and exceedance percentiles (Q95, Q50, Q10)
+        - Annual maxima series (completeness threshold)
+    + Process-pool mode for very large sets of stations (stations split in chunks)
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from SeriesArrays import stack_daily
+from Aggregation import aggregate
+
+# exceedance probabilities (%) of the flow duration curve and reported percentiles
+FDC_PROBABILITIES = np.array([0.01, 0.1, 0.5, 1, 2, 5, 10, 15, 20, 25, 30, 40, 50, 60, 70, 75, 80, 85, 90, 95,
+                              98, 99, 99.5, 99.9, 99.99])
+PERCENTILES = (95, 50, 10)
+
+
+# %% Base statistics
+def base_statistics(values):
+    """
+        NaN aware statistics of each column of a days x stations matrix
+        {'N', 'Mean', 'Std', 'CV', 'Min', 'Max', 'Skew'} arrays
+    """
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=0)
+    filled = np.where(valid, values, 0.)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = filled.sum(axis=0) / n
+        dev = np.where(valid, values - mean, 0.)
+        m2 = (dev ** 2).sum(axis=0)
+        m3 = (dev ** 3).sum(axis=0)
+        std = np.sqrt(m2 / (n - 1))
+        skew = n * m3 / ((n - 1) * (n - 2) * std ** 3)           # sample skewness (adjusted)
+        minimum = np.where(n > 0, np.where(valid, values, np.inf).min(axis=0), np.nan)
+        maximum = np.where(n > 0, np.where(valid, values, -np.inf).max(axis=0), np.nan)
+
+    return {'N': n, 'Mean': mean, 'Std': std, 'CV': std / mean, 'Min': minimum, 'Max': maximum, 'Skew': skew}
+
+
+# %% Flow duration curves
+def flow_duration(values, probabilities=FDC_PROBABILITIES):
+    """
+        Values exceeded a percentage of the time (probabilities, %) of each column of a days x stations matrix
+        [probabilities x stations] array
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    if not values.shape[1]:
+        return np.empty((len(probabilities), 0))
+
+    with np.errstate(invalid='ignore'):
+        return np.nanquantile(values, 1 - probabilities / 100., axis=0)
+
+
+# %% Statistics of a set of stations
+def station_statistics(series_dict, probabilities=FDC_PROBABILITIES, min_completeness=0.9):
+    """
+        Statistics of daily series {code: pandas series}
+        [statistics dataframe (stations rows), flow duration dataframe (probabilities x stations),
+         annual maxima dataframe (years x stations)]
+    """
+    codes, dates, values = stack_daily(series_dict)
+
+    statistics = pd.DataFrame(base_statistics(values), index=codes)
+    percentiles = flow_duration(values, PERCENTILES)
+    for n, p in enumerate(PERCENTILES):
+        statistics['Q%d' % p] = percentiles[n]
+
+    fdc = pd.DataFrame(flow_duration(values, probabilities), index=pd.Index(probabilities, name='Exceedance'),
+                       columns=codes)
+
+    _, years, _, annual = aggregate(series_dict, 'max', min_completeness)
+    maxima = pd.DataFrame(annual.T, index=pd.Index(years, name='Year'), columns=codes)
+
+    return statistics, fdc, maxima
+
+
+def _chunks(series_dict, size):
+    codes = list(series_dict)
+    for start in range(0, len(codes), size):
+        yield {code: series_dict[code] for code in codes[start:start + size]}
+
+
+def batch_statistics(series_dict, probabilities=FDC_PROBABILITIES, min_completeness=0.9, workers=None,
+                     chunk_size=250):
+    """
+        Statistics of a large set of daily series; with workers > 1 stations are split in chunks processed
+        by a pool of processes (see station_statistics)
+    """
+    if not workers or workers <= 1 or len(series_dict) <= chunk_size:
+        return station_statistics(series_dict, probabilities, min_completeness)
+
+    chunks = list(_chunks(series_dict, chunk_size))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(station_statistics, chunks, [probabilities] * len(chunks),
+                                    [min_completeness] * len(chunks)))
+
+    statistics = pd.concat([i[0] for i in results])
+    fdc = pd.concat([i[1] for i in results], axis=1)
+    maxima = pd.concat([i[2] for i in results], axis=1).sort_index()
+    return statistics, fdc, maxima
@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Streaming reader of IDEAM daily text files: one typed record per station-year block (generator, memory
+      bounded by a single block)
+        - Station code, name and type, variable, value type, time resolution and year
+        - 31 x 12 daily values (NaN for missing and non-existing days) and qualifier digits (0 for none)
+        - Monthly maxima and minima with their qualifier digits
+    + Composable sinks fed from a single read of an archive (sequentially or each sink in its own thread
+      with bounded queues); a failing sink stops the read and every sink is closed
+        - DatabaseSink: bulk inserts of DataValues (daily values, monthly maxima and minima)
+        - CsvSink / ParquetSink: long tables [Code, Variable, Type, Date, Value, Qualifier]
+        - StatisticsSink: count, mean, standard deviation, extremes and period of each station variable
+
+Usage:
+    stats = StatisticsSink()
+    run_pipeline(iter_ideam_archive(files), [CsvSink('values.csv'), stats], threads=True)
+    stats.result()
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import abc
+import csv
+import sys
+import queue
+import argparse
+import calendar
+import threading
+import functools
+import collections
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from Instrumentation import count
+from IdeamResolver import IdeamResolver, ideam_variable
+
+VALUE_COLUMNS = [(18, 26), (27, 35), (36, 44), (45, 53), (54, 62), (63, 71), (72, 80), (81, 89), (90, 98),
+                 (99, 107), (108, 116), (117, 125)]
+LINE_WIDTH = 126
+TABLE_COLUMNS = ['Code', 'Variable', 'Type', 'Date', 'Value', 'Qualifier']
+DATA_VALUE_COLUMNS = ['DataValue', 'LocalDateTime', 'UTCOffset', 'DateTimeUTC', 'SiteId', 'VariableId', 'QualifierId',
+                      'MethodId', 'SourceId', 'QualityControlLevelId', 'CensorCode']
+
+IdeamBlock = collections.namedtuple('IdeamBlock', ['code', 'name', 'station_type', 'variable', 'value_type',
+                                                   'time_resolution', 'year', 'values', 'flags', 'maxima',
+                                                   'maxima_flags', 'minima', 'minima_flags'])
+IdeamBlock.__doc__ = """
+    Station-year block of an IDEAM daily file
+        values, flags: 31 x 12 daily values (NaN if missing) and qualifier digits (0 for none)
+        maxima, minima (and flags): monthly extremes (NaN if the block has no maxima/minima line)
+    """
+
+
+# %% Fixed-width lines
+def parse_value_line(line):
+    """
+        Twelve monthly columns of a value line [values (NaN if blank), qualifier digits (0 for none)]
+    """
+    line = line.ljust(LINE_WIDTH)
+    values = [np.nan] * 12
+    flags = [0] * 12
+    for month, (first, last) in enumerate(VALUE_COLUMNS):
+        field = line[first:last]
+        if field.isspace():
+            continue
+        try:
+            values[month] = float(field)
+        except ValueError:
+            continue
+        if line[last].isdigit():
+            flags[month] = int(line[last])
+    return values, flags
+
+
+# %% Calendar tables
+def _calendar_tables():
+    masks = np.zeros((2, 31, 12), dtype=bool)
+    offsets = np.zeros((2, 31, 12), dtype=np.int64)
+    for leap, year in ((0, 2001), (1, 2000)):
+        lengths = np.array([calendar.monthrange(year, month)[1] for month in range(1, 13)])
+        firstDays = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        masks[leap] = np.arange(1, 32)[:, None] <= lengths[None, :]
+        offsets[leap] = firstDays[None, :] + np.arange(31)[:, None]
+    return masks, offsets
+
+
+LOCAL_HOUR = np.timedelta64(12, 'h')        # local time of daily values and monthly extremes
+
+# 31 x 12 tables [leap][day - 1, month - 1]: existing days and day of the year offsets (from January 1st)
+DAY_MASKS, DAY_OFFSETS = _calendar_tables()
+DAY_LINE_MONTHS = [[np.nonzero(DAY_MASKS[leap][day])[0] for day in range(31)] for leap in (0, 1)]
+
+
+def calendar_mask(year):
+    """
+        31 x 12 mask of existing days of a year
+    """
+    return DAY_MASKS[int(calendar.isleap(year))]
+
+
+def day_offsets(year):
+    """
+        31 x 12 day of the year offsets of a year (only meaningful where calendar_mask is True)
+    """
+    return DAY_OFFSETS[int(calendar.isleap(year))]
+
+
+def day_line_dates(year, day):
+    """
+        Months (0 based) with an existing day 'day' in a year and its dates (datetime64[D])
+    """
+    leap = int(calendar.isleap(year))
+    months = DAY_LINE_MONTHS[leap][day - 1]
+    return months, np.datetime64('%04d-01-01' % year) + DAY_OFFSETS[leap][day - 1, months]
+
+
+@functools.lru_cache(maxsize=512)
+def month_starts(year):
+    """
+        First day of each month of a year (datetime64[D])
+    """
+    return np.datetime64('%04d-01-01' % year) + day_offsets(year)[0]
+
+
+def _parse_block(lines):
+    """
+        Typed record of the lines of a block (banner at position 0); None if the block has no station header
+    """
+    if len(lines) < 45:
+        return None
+    try:
+        variableLine = lines[2].split()
+        year = int(lines[4][59:64])
+        code = int(lines[4][104:112])
+    except (IndexError, ValueError):
+        return None
+
+    variable = ideam_variable(lines[2])
+    valueType = variableLine[1] if len(variableLine) > 1 else ''
+    timeResolution = variableLine[2] if len(variableLine) > 2 else ''
+
+    values = np.full((31, 12), np.nan)
+    flags = np.zeros((31, 12), dtype=np.uint8)
+    for line in lines[14:45]:
+        try:
+            day = int(line[11:13])
+        except ValueError:
+            continue
+        if 1 <= day <= 31:
+            values[day - 1], flags[day - 1] = parse_value_line(line)
+    exists = calendar_mask(year)
+    values[~exists] = np.nan
+    flags[~exists] = 0
+
+    maxima = minima = np.full(12, np.nan)
+    maximaFlags = minimaFlags = np.zeros(12, dtype=np.uint8)
+    for line in lines[46:49]:
+        if line[0:3] == 'MAX':
+            maxima, maximaFlags = (np.asarray(i) for i in parse_value_line(line))
+        elif line[0:3] == 'MIN':
+            minima, minimaFlags = (np.asarray(i) for i in parse_value_line(line))
+
+    return IdeamBlock(code, ' '.join(lines[4][114:].split()), lines[6][48:50], variable, valueType, timeResolution,
+                      year, values, flags, maxima, maximaFlags.astype(np.uint8), minima, minimaFlags.astype(np.uint8))
+
+
+# %% Streaming readers
+def iter_ideam_blocks(path, encoding=None):
+    """
+        Station-year blocks of an IDEAM daily file (generator of IdeamBlock records)
+    """
+    with open(path, 'r', encoding=encoding, errors='replace') as f:
+        banner = ' '.join(f.readline().split())
+        lines = ['']
+        nBlocks = 0
+        for line in f:
+            if ' '.join(line.split()) == banner:
+                block = _parse_block(lines)
+                if block is not None:
+                    nBlocks += 1
+                    yield block
+                lines = ['']
+            else:
+                lines.append(line.rstrip('\r\n'))
+        block = _parse_block(lines)
+        if block is not None:
+            nBlocks += 1
+            yield block
+    count('ideam.blocks_read', nBlocks)
+
+
+def iter_ideam_archive(paths, encoding=None):
+    """
+        Station-year blocks of several IDEAM files, read one after the other
+    """
+    for path in paths:
+        for block in iter_ideam_blocks(path, encoding):
+            yield block
+
+
+def block_dates(block):
+    """
+        Rows and columns (day - 1, month - 1) of the daily values of a block and their dates (datetime64[D])
+    """
+    days, months = np.nonzero(~np.isnan(block.values))
+    return days, months, np.datetime64('%04d-01-01' % block.year) + day_offsets(block.year)[days, months]
+
+
+def utc_offset_delta(utc_offset):
+    """
+        UTC offset in hours (any sign or fraction) as timedelta64[s]
+    """
+    return np.timedelta64(int(round(utc_offset * 3600)), 's')
+
+
+def block_times(dates, utc_offset):
+    """
+        Local and UTC times (datetime64[s]) of values dated at local noon: local = date + 12 h and
+        utc = local - utc_offset (e.g. -5: 12:00 local is 17:00 UTC, also across midnight for large offsets)
+    """
+    local = dates.astype('datetime64[s]') + LOCAL_HOUR
+    return local, local - utc_offset_delta(utc_offset)
+
+
+def time_strings(times):
+    """
+        'YYYY-MM-DD HH:MM:SS' text of datetime64 times (vectorized, no datetime objects)
+    """
+    return np.char.replace(np.datetime_as_string(times, unit='s'), 'T', ' ')
+
+
+def daily_values(block):
+    """
+        Local times, values and qualifiers (1 if none) of the daily values of a block
+    """
+    days, months, dates = block_dates(block)
+    local = dates.astype('datetime64[s]') + LOCAL_HOUR
+    return local, block.values[days, months], np.maximum(block.flags[days, months], 1)
+
+
+def block_table(block):
+    """
+        Long table of the daily values of a block [Code, Variable, Type, Date, Value, Qualifier]
+    """
+    days, months, dates = block_dates(block)
+    return pd.DataFrame({'Code': block.code, 'Variable': block.variable, 'Type': block.value_type, 'Date': dates,
+                         'Value': block.values[days, months], 'Qualifier': block.flags[days, months]},
+                        columns=TABLE_COLUMNS)
+
+
+# %% Sinks
+class Sink(abc.ABC):
+    """
+    Output of a block stream: write(block) for each block, close() when the stream ends or fails (returns the
+    result)
+    """
+    @abc.abstractmethod
+    def write(self, block):
+        pass
+
+    def close(self):
+        return None
+
+
+class CsvSink(Sink):
+    """
+    Daily values written to a CSV file [Code, Variable, Type, Date, Value, Qualifier]
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(TABLE_COLUMNS)
+        self.rows = 0
+
+    def write(self, block):
+        days, months, dates = block_dates(block)
+        n = len(dates)
+        self.writer.writerows(zip([block.code] * n, [block.variable] * n, [block.value_type] * n,
+                                  dates.astype(str).tolist(), block.values[days, months].tolist(),
+                                  block.flags[days, months].tolist()))
+        self.rows += n
+
+    def close(self):
+        self.file.close()
+        return self.rows
+
+
+class ParquetSink(Sink):
+    """
+    Daily values written to a Parquet file (pyarrow), one row group every group_blocks blocks
+    """
+    def __init__(self, path, group_blocks=500):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('ParquetSink requires pyarrow (pip install pyarrow)')
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.groupBlocks = group_blocks
+        self.tables = []
+        self.writer = None
+        self.rows = 0
+
+    def write(self, block):
+        self.tables.append(block_table(block))
+        if len(self.tables) >= self.groupBlocks:
+            self.flush()
+
+    def flush(self):
+        if not self.tables:
+            return
+        table = self.pa.Table.from_pandas(pd.concat(self.tables, ignore_index=True), preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+        self.rows += table.num_rows
+        self.tables = []
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+        return self.rows
+
+
+class StatisticsSink(Sink):
+    """
+    Running statistics of each station variable [count, mean, standard deviation, min, max, flagged values,
+    first and last year] (constant memory per series)
+    """
+    def __init__(self):
+        self.series = {}
+
+    def write(self, block):
+        valid = ~np.isnan(block.values)
+        values = block.values[valid]
+        if not len(values):
+            return
+        key = (block.code, block.variable, block.value_type)
+        stats = self.series.get(key)
+        if stats is None:
+            stats = self.series[key] = [0, 0., 0., np.inf, -np.inf, 0, block.year, block.year]
+        stats[0] += len(values)
+        stats[1] += values.sum()
+        stats[2] += (values * values).sum()
+        stats[3] = min(stats[3], values.min())
+        stats[4] = max(stats[4], values.max())
+        stats[5] += int((block.flags[valid] > 0).sum())
+        stats[6] = min(stats[6], block.year)
+        stats[7] = max(stats[7], block.year)
+
+    def result(self):
+        table = []
+        for (code, variable, valueType), (n, total, squares, low, high, flagged, first, last) in self.series.items():
+            mean = total / n
+            std = np.sqrt(max(squares - n * mean ** 2, 0.) / (n - 1)) if n > 1 else np.nan
+            table.append([code, variable, valueType, n, mean, std, low, high, flagged, first, last])
+        return pd.DataFrame(table, columns=['Code', 'Variable', 'Type', 'Values', 'Mean', 'Std', 'Min', 'Max',
+                                            'Flagged', 'First year', 'Last year'])
+
+    def close(self):
+        return self.result()
+
+
+class DataValueRecords(object):
+    """
+    DataValues records of blocks (daily values and monthly maxima and minima), tuples in DATA_VALUE_COLUMNS order
+        methods, variables: database tables of ImportSeries.importIdeamDailyTxt ({'ID', 'Description'} and
+        {'ID', 'Variable', 'Type'}); blocks of unknown variables or station types have no records
+        text_times: timestamps as 'YYYY-MM-DD HH:MM:SS' text instead of datetime objects (DB-API executemany and
+        CSV COPY; asyncpg needs datetime objects)
+        resolver: IdeamResolver of methods and variables (built from them if None)
+    """
+    def __init__(self, methods, variables, source_id, quality_id, censor_term, utc_offset, text_times=False,
+                 resolver=None):
+        self.resolver = resolver if resolver is not None else IdeamResolver(methods, variables)
+        self.sourceId = source_id
+        self.qualityId = quality_id
+        self.censorTerm = censor_term
+        self.utcOffset = utc_offset
+        self.textTimes = text_times
+
+    def _records(self, values, qualifiers, dates, code, variable_id, method_id):
+        local, utc = block_times(dates, self.utcOffset)
+        if self.textTimes:
+            local, utc = time_strings(local), time_strings(utc)
+        n = len(values)
+        return list(zip(values.tolist(), local.tolist(), [self.utcOffset] * n, utc.tolist(), [code] * n,
+                        [variable_id] * n, [int(i) or 1 for i in qualifiers.tolist()], [method_id] * n,
+                        [self.sourceId] * n, [self.qualityId] * n, [self.censorTerm] * n))
+
+    def records(self, block):
+        """
+            Records of a block; None if its variable or station type is not in the database
+        """
+        methodId = self.resolver.method_id(block.station_type)
+        meanId, maxId, minId = self.resolver.variable_series(block.variable)
+        if methodId is None or meanId is None:
+            return None
+
+        days, months, dates = block_dates(block)
+        records = self._records(block.values[days, months], block.flags[days, months], dates, block.code, meanId,
+                                methodId)
+
+        monthStarts = month_starts(block.year)
+        for variableId, values, flags in ((maxId, block.maxima, block.maxima_flags),
+                                          (minId, block.minima, block.minima_flags)):
+            valid = ~np.isnan(values)
+            if variableId is not None and valid.any():
+                records += self._records(values[valid], flags[valid], monthStarts[valid], block.code, variableId,
+                                         methodId)
+        return records
+
+
+class DatabaseSink(Sink):
+    """
+    Bulk inserts of daily values and monthly extremes into DataValues (chunked executemany); see DataValueRecords
+    """
+    INSERT = text('INSERT INTO "DataValues" (%s) VALUES (%s)' % (', '.join('"%s"' % i for i in DATA_VALUE_COLUMNS),
+                                                                 ', '.join(':' + i for i in DATA_VALUE_COLUMNS)))
+
+    def __init__(self, engine, methods, variables, source_id, quality_id, censor_term, utc_offset, chunk_size=5000):
+        self.engine = engine
+        self.builder = DataValueRecords(methods, variables, source_id, quality_id, censor_term, utc_offset)
+        self.chunkSize = chunk_size
+        self.buffer = []
+        self.rows = 0
+        self.skipped = 0
+
+    def write(self, block):
+        records = self.builder.records(block)
+        if records is None:
+            self.skipped += 1
+            return
+        self.buffer.extend(dict(zip(DATA_VALUE_COLUMNS, i)) for i in records)
+        if len(self.buffer) >= self.chunkSize:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            with self.engine.begin() as conn:
+                conn.execute(self.INSERT, self.buffer)
+            self.rows += len(self.buffer)
+            count('ideam.values_inserted', len(self.buffer))
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        return self.rows
+
+
+# %% Pipeline
+def _consume(sink, blocks, errors, stop):
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                return
+            if not stop.is_set():
+                sink.write(block)
+    except Exception as e:
+        errors.append(e)
+        stop.set()                              # producer stops reading the archive
+        while blocks.get() is not None:         # unblock the producer until it sends the end of the stream
+            pass
+
+
+def _close_sinks(sinks):
+    """
+        close() of every sink, also when one of them fails [close() result of each sink]
+    """
+    results = []
+    errors = []
+    for sink in sinks:
+        try:
+            results.append(sink.close())
+        except Exception as e:
+            results.append(None)
+            errors.append(e)
+    if errors:
+        raise errors[0]
+    return results
+
+
+def _feed_threads(blocks, sinks, queue_size):
+    errors = []
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queue_size) for _ in sinks]
+    workers = [threading.Thread(target=_consume, args=(sink, q, errors, stop), daemon=True)
+               for sink, q in zip(sinks, queues)]
+    for worker in workers:
+        worker.start()
+    try:
+        for block in blocks:
+            if stop.is_set():
+                break
+            for q in queues:
+                q.put(block)
+    finally:
+        for q in queues:
+            q.put(None)
+        for worker in workers:
+            worker.join()
+    if errors:
+        raise errors[0]
+
+
+def run_pipeline(blocks, sinks, threads=False, queue_size=64):
+    """
+        Feed each block to all sinks; [close() result of each sink]
+            threads: each sink consumes the stream in its own thread (bounded queues, constant memory)
+        The first error (reading or writing) stops the stream; every sink is closed before it is raised
+    """
+    try:
+        if threads:
+            _feed_threads(blocks, sinks, queue_size)
+        else:
+            for block in blocks:
+                for sink in sinks:
+                    sink.write(block)
+    except BaseException:
+        try:
+            _close_sinks(sinks)
+        except Exception:
+            pass                                # the stream error is reported
+        raise
+    return _close_sinks(sinks)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Read IDEAM daily text files into CSV, Parquet and statistics')
+    parser.add_argument('files', help='IDEAM daily text files', nargs='+')
+    parser.add_argument('--csv', help='Daily values CSV file')
+    parser.add_argument('--parquet', help='Daily values Parquet file (requires pyarrow)')
+    parser.add_argument('--stats', help='Statistics CSV file of each station variable')
+    parser.add_argument('--encoding', help='Text encoding of the files (default: locale encoding)')
+    parser.add_argument('-t', '--threads', help='Run each output in its own thread', action='store_true')
+    args = parser.parse_args()
+
+    outputs = []
+    if args.csv:
+        outputs.append(CsvSink(args.csv))
+    if args.parquet:
+        outputs.append(ParquetSink(args.parquet))
+    statistics = StatisticsSink()
+    outputs.append(statistics)
+
+    run_pipeline(iter_ideam_archive(args.files, args.encoding), outputs, args.threads)
+    summary = statistics.result()
+    if args.stats:
+        summary.to_csv(args.stats, index=False)
+    else:
+        summary.to_csv(sys.stdout, index=False)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Resolution of IDEAM block headers to database ids, built once per import or validation
+        - Station type (last two characters of the method description) -> MethodId
+        - (variable, time resolution, type) -> VariableId
+        - Variable -> daily (average or cumulative), maximum and minimum VariableId of an imported series
+        - Station code -> SiteId
+    + IDEAM header names -> database names (variables, value types and time resolutions)
+
+Usage:
+    resolver = IdeamResolver(SqlQuery.get_methods_table(engine), SqlQuery.get_vars_table(engine),
+                             SqlQuery.get_sites_table(engine))
+    methodId = resolver.method_id(line[48:50])
+    varIdMean, varIdMax, varIdMin = resolver.series_variables(line)
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+VARIABLE_NAMES = {'CAUDALES': 'Streamflow', 'PRECIPITACION': 'Precipitation', 'NIVELES': 'Water depth',
+                  'SEDIMENTOS': 'Sediment, suspended', 'TRANSPORTE': 'Solids, total suspended'}
+VALUE_TYPES = {'MEDIOS': 'Average', 'MEDIA': 'Average', 'MAXIMOS': 'Maximum', 'MINIMOS': 'Minimum',
+               'TOTALES': 'Cumulative'}
+TIME_RESOLUTIONS = {'DIARIOS': 'day', 'DIARIA': 'day', 'MENSUALES': 'month'}
+SERIES_KINDS = {'Average': 0, 'Cumulative': 0, 'Maximum': 1, 'Minimum': 2}
+
+
+# %% Header names
+def ideam_variable(variable_line):
+    """
+        IDEAM variable of a header variable line (fifth word, or TRANSPORTE for sediment transport files)
+    """
+    words = variable_line.split() + [''] * 5
+    return 'TRANSPORTE' if words[0] == 'TRANSPORTE' else words[4]
+
+
+def header_variable(variable_line):
+    """
+        Database variable name, time resolution and type of a header variable line
+    """
+    words = variable_line.split() + [''] * 5
+    timeResolution = 'day' if words[1] == 'DIARIO' else TIME_RESOLUTIONS.get(words[2], words[2])
+    variable = ideam_variable(variable_line)
+    return VARIABLE_NAMES.get(variable, variable), timeResolution, VALUE_TYPES.get(words[1], 'Average')
+
+
+# %% Resolver
+class IdeamResolver(object):
+    """
+    Dictionary indexes of the methods, variables and sites tables (SQLAlchemyQueries get_methods_table,
+    get_vars_table and get_sites_table) for constant time resolution of block headers
+        methods: {'ID', 'Description'}
+        variables: {'ID', 'Variable', 'Time Resolution', 'Type'}
+        sites: {SiteId: [...]} (None: sites are not resolved)
+    """
+    def __init__(self, methods=None, variables=None, sites=None):
+        # last method of each station type and last variable of each series kind (as the former lookup loops of
+        # the importer); first variable of each (variable, time resolution, type) (as the file explorer)
+        self.methodIds = {}
+        if methods is not None:
+            for i in range(len(methods['ID'])):
+                self.methodIds[methods['Description'][i][-2:]] = methods['ID'][i]
+
+        self.variableIds = {}
+        self.seriesIds = {}
+        if variables is not None:
+            for i in range(len(variables['ID'])):
+                name = variables['Variable'][i]
+                varType = variables['Type'][i]
+                if 'Time Resolution' in variables:
+                    self.variableIds.setdefault((name, variables['Time Resolution'][i], varType), variables['ID'][i])
+                if varType in SERIES_KINDS:
+                    self.seriesIds.setdefault(name, [None, None, None])[SERIES_KINDS[varType]] = variables['ID'][i]
+
+        self.siteIds = None if sites is None else {code: code for code in sites}
+
+    def method_id(self, station_type):
+        """
+            MethodId of a station type (None if missing)
+        """
+        return self.methodIds.get(station_type)
+
+    def variable_id(self, name, time_resolution, var_type):
+        """
+            VariableId of a database variable name, time resolution and type (None if missing)
+        """
+        return self.variableIds.get((name, time_resolution, var_type))
+
+    def header_variable_id(self, variable_line):
+        """
+            VariableId of a header variable line (None if missing)
+        """
+        return self.variableIds.get(header_variable(variable_line))
+
+    def variable_series(self, ideam_name):
+        """
+            Daily, maximum and minimum VariableId of an IDEAM variable (None if missing)
+        """
+        name = VARIABLE_NAMES.get(ideam_name, ideam_name)
+        return tuple(self.seriesIds.get(name, (None, None, None)))
+
+    def series_variables(self, variable_line):
+        """
+            Daily, maximum and minimum VariableId of a header variable line (None if missing)
+        """
+        return self.variable_series(ideam_variable(variable_line))
+
+    def site_id(self, code):
+        """
+            SiteId of a station code (None if missing or sites are not resolved)
+        """
+        return None if self.siteIds is None else self.siteIds.get(code)
@@ -20,9 +20,11 @@ email:      andresfduque@gmail.com
 
 import sys
 import numpy as np
-from datetime import datetime
 from sqlalchemy.orm import sessionmaker
 from DatabaseDeclarative import (Base)
+from Instrumentation import instrumented, count
+from IdeamResolver import IdeamResolver, header_variable
+from IdeamReader import DATA_VALUE_COLUMNS, DataValueRecords, DatabaseSink, daily_values, iter_ideam_blocks
 
 
 # %% Start DBSession
@@ -44,135 +46,46 @@ def startDBSession(engine):
 
 
 # %% Import IDEAM daily file data
-def importIdeamDailyTxt(filepath, engine, methods, variables, source_id, quality_id, censor_term, utc_offset):
+@instrumented('ideam')
+def importIdeamDailyTxt(filepath, engine, methods, variables, source_id, quality_id, censor_term, utc_offset,
+                        qc_stage=None, resolver=None, chunk_size=5000):
     """
         Import data from IDEAM txt file, containing daily data, to POSTGRES database
-    """
-    # database connection
-    global year, code, methodId, utc_date, varIdMean, varIdMax, varIdMin
-    conn = engine.connect()
-
-    # base file
-    f = open(filepath, 'r')
-    first_line = f.readline()
-    first_line = ' '.join(first_line.split())
-    i = 1
-
-    for line in f:
-        # identify each variable in each data block (year, variable)
-        if i == 2:
-            varIdMean, varIdMax, varIdMin = ideamSupportedVars(line, variables)
+        qc_stage: QualityControl.QCStage collecting daily values keyed (code, variable id, method id), flagged when
+        the import finishes
+        resolver: IdeamResolver of methods and variables (built from them if None; share it between files)
 
-        # Get station basic parameters
-        if i == 4:
-            year = int(line[59:64])  # register year
-            code = int(line[104:112])  # station code
-
-        if i == 6:  # get station type
-            sta_type = line[48:50]
-
-            # asociate station type in text line with database method
-            j = 0
-            while j < len(methods['ID']):
-                if methods['Description'][j][-2:] == sta_type:
-                    methodId = methods['ID'][j]
-                j += 1
-
-        # Datavalues for one year are located in these lines
-        if 14 <= i <= 44:
-            day = int(line[11:13])  # get tha date day form text line
-            day_line = split_ideam_line(line)  # get list with 12 datavalues one for each month for that day and year
-
-            # prepare data to be inserted in database
-            month = 1  # month counter
-            for v in day_line:
-                try:  # check if date exist
-                    local_date = datetime(year, month, day, 12)
-                    utc_date = datetime(year, month, day, np.int(12 + utc_offset))
-                except ValueError:
-                    local_date = False
-                if local_date:
-                    if not np.isnan(v[0]):
-                        qualifier = 1 if np.isnan(v[1]) else v[1]  # if qualifier is different from 1
-                        conn.execute('INSERT INTO "DataValues" ("DataValue", "LocalDateTime", "UTCOffset", '
-                                     '"DateTimeUTC", "SiteId", "VariableId", "QualifierId", "MethodId", '
-                                     '"SourceId", "QualityControlLevelId", "CensorCode") '
-                                     'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
-                                     (v[0], local_date, utc_offset, utc_date, code, varIdMean, qualifier, methodId,
-                                      source_id, quality_id, censor_term))
-                month += 1
-
-        if i == 47 and line[0:3] == 'MAX':  # check if "MAXIMO ABSOLUTO" exists (its supposed to be in line 47)
-            month_line = split_ideam_line(line)  # max daily instantaneous month flow
-
-            month = 1  # month index
-            for v in month_line:
-                try:  # check if date exist
-                    local_date = datetime(year, month, 1, 12)
-                    utc_date = datetime(year, month, 1, np.int(12 + utc_offset))
-                except ValueError:
-                    local_date = False
-                if local_date:
-                    if not np.isnan(v[0]):
-                        qualifier = 1 if np.isnan(v[1]) else v[1]
-                        conn.execute('INSERT INTO "DataValues" ("DataValue", "LocalDateTime", "UTCOffset", '
-                                     '"DateTimeUTC", "SiteId", "VariableId", "QualifierId", "MethodId", '
-                                     '"SourceId", "QualityControlLevelId", "CensorCode") '
-                                     'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
-                                     (v[0], local_date, utc_offset, utc_date, code, varIdMax, qualifier, methodId,
-                                      source_id, quality_id, censor_term))
-                month += 1
-
-        elif i == 47 and line[0:3] == 'MIN':  # if "MINIMA MEDIA" exists in the position of the maximum
-            month_line = split_ideam_line(line)  # min month flow
-
-            month = 1  # month index
-            for v in month_line:
-                try:  # check if date exist
-                    local_date = datetime(year, month, 1, 12)
-                    utc_date = datetime(year, month, 1, np.int(12 + utc_offset))
-                except ValueError:
-                    local_date = False
-                if local_date:
-                    if not np.isnan(v[0]):
-                        qualifier = 1 if np.isnan(v[1]) else v[1]
-                        conn.execute('INSERT INTO "DataValues" ("DataValue", "LocalDateTime", "UTCOffset", '
-                                     '"DateTimeUTC", "SiteId", "VariableId", "QualifierId", "MethodId", '
-                                     '"SourceId", "QualityControlLevelId", "CensorCode") '
-                                     'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
-                                     (v[0], local_date, utc_offset, utc_date, code, varIdMin, qualifier, methodId,
-                                      source_id, quality_id, censor_term))
-                month += 1
-
-        if 48 == i and line[0:3] == 'MIN':  # if "MINIMA MEDIA" exists
-            month_line = split_ideam_line(line)  # min month flow
-
-            month = 1  # month index
-            for v in month_line:
-                try:  # check if date exist
-                    local_date = datetime(year, month, 1, 12)
-                    utc_date = datetime(year, month, 1, np.int(12 + utc_offset))
-                except ValueError:
-                    local_date = False
-                if local_date:
-                    if not np.isnan(v[0]):
-                        qualifier = 1 if np.isnan(v[1]) else v[1]
-                        conn.execute('INSERT INTO "DataValues" ("DataValue", "LocalDateTime", "UTCOffset", '
-                                     '"DateTimeUTC", "SiteId", "VariableId", "QualifierId", "MethodId", '
-                                     '"SourceId", "QualityControlLevelId", "CensorCode") '
-                                     'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
-                                     (v[0], local_date, utc_offset, utc_date, code, varIdMin, qualifier, methodId,
-                                      source_id, quality_id, censor_term))
-                month += 1
-
-        # check if line is header (new year of data)
-        if ' '.join(line.split()) == first_line:
-            i = 0
-
-        i += 1  # count
-    #    print('!Archivo ' + files[-13:] + ' Imported!') # convert into a progress bar
+        Timestamps of whole blocks are NumPy datetime64 arithmetic (local = date + 12 h, utc = local - utc_offset,
+        any offset) written as text, and values are inserted in chunks of chunk_size (executemany)
+    """
+    if resolver is None:
+        resolver = IdeamResolver(methods, variables)
+    builder = DataValueRecords(methods, variables, source_id, quality_id, censor_term, utc_offset, True, resolver)
+
+    nBlocks = 0
+    nInserted = 0
+    buffer = []
+    with engine.begin() as conn:
+        for block in iter_ideam_blocks(filepath):
+            nBlocks += 1
+            records = builder.records(block)  # None if the variable or the station type are not in the database
+            if records is None:
+                continue
+            buffer.extend(dict(zip(DATA_VALUE_COLUMNS, i)) for i in records)
+            if qc_stage is not None:
+                qc_stage.add_many((block.code, resolver.variable_series(block.variable)[0],
+                                   resolver.method_id(block.station_type)), *daily_values(block))
+            if len(buffer) >= chunk_size:
+                conn.execute(DatabaseSink.INSERT, buffer)
+                nInserted += len(buffer)
+                buffer = []
+        if buffer:
+            conn.execute(DatabaseSink.INSERT, buffer)
+            nInserted += len(buffer)
+
+    count('ideam.blocks', nBlocks)
+    count('ideam.values_inserted', nInserted)
     print('completed')
-    f.close()
 
 
 # %% Split IDEAM textfile line
@@ -248,11 +161,15 @@ def split_ideam_line(line):
 
 
 # %% Check IDEAM multiple files
-def exploreIdeamMultipleFiles(filelist, methods, variables, sites):
+def exploreIdeamMultipleFiles(filelist, methods, variables, sites, resolver=None):
     """
         Explore IDEAM listo of txt files:
             + Get number of stations, variables and methods contained
+        resolver: IdeamResolver of methods, variables and sites (built once for all files if None)
     """
+    if resolver is None:
+        resolver = IdeamResolver(methods, variables, sites)
+
     nStations = 0
     varList = []
     metList = []
@@ -264,7 +181,7 @@ def exploreIdeamMultipleFiles(filelist, methods, variables, sites):
 
     # explor each file in list
     for i in filelist:
-        fileExplore = exploreIdeamFile(i, methods, variables, sites)
+        fileExplore = exploreIdeamFile(i, methods, variables, sites, resolver)
         nSites = fileExplore[0]
         methodsList = fileExplore[1]
         variablesList = fileExplore[2]
@@ -294,11 +211,15 @@ def exploreIdeamMultipleFiles(filelist, methods, variables, sites):
 
 # %% Check IDEAM file
 # noinspection PyShadowingNames
-def exploreIdeamFile(filepath, methods, variables, sites):
+@instrumented('ideam')
+def exploreIdeamFile(filepath, methods, variables, sites, resolver=None):
     """
         Explore IDEAM txt file:
             + Get number of stations, variables and methods contained
     """
+    if resolver is None:
+        resolver = IdeamResolver(methods, variables, sites)
+
     # get first line
     f = open(filepath, 'r')
     first_line = f.readline()
@@ -326,58 +247,13 @@ def exploreIdeamFile(filepath, methods, variables, sites):
             if code != codeId:
                 nSites += 1
                 codeId = code
-                try:
-                    sites[code]
-                except KeyError:
+                if resolver.site_id(code) is None:
                     allSitesCreated = False
 
         # get variables in files
         if i == 2:
-            varType = line.split()[1]
-            varTimeRes = line.split()[2]
-            varName = line.split()[4]
-
-            varName2 = line.split()[0]
-            varTimeRes2 = line.split()[1]
-
-            if varType == 'MEDIOS' or varType == 'MEDIA':
-                varType = 'Average'
-            elif varType == 'MAXIMOS':
-                varType = 'Maximum'
-            elif varType == 'MINIMOS':
-                varType = 'Minimum'
-            elif varType == 'TOTALES':
-                varType = 'Cumulative'
-            else:
-                varType = 'Average'
-
-            if varTimeRes == 'DIARIOS' or varTimeRes == 'DIARIA' or varTimeRes2 == 'DIARIO':
-                varTimeRes = 'day'
-            elif varTimeRes == 'MENSUALES':
-                varTimeRes = 'month'
-
-            if varName == 'CAUDALES':
-                varName = 'Streamflow'
-            elif varName == 'PRECIPITACION':
-                varName = 'Precipitation'
-            elif varName == 'NIVELES':
-                varName = 'Water depth'
-            elif varName == 'SEDIMENTOS':
-                varName = 'Sediment, suspended'
-            elif varName2 == 'TRANSPORTE':
-                varName = 'Solids, total suspended'
-
-            # do while
-            j = 0
-            varExist = 0
-            while varExist == 0 and j < len(variables['ID']):
-                if variables['Variable'][j] == varName:
-                    if variables['Time Resolution'][j] == varTimeRes:
-                        if variables['Type'][j] == varType:
-                            varExist = 1
-                j += 1
-            if varExist == 1:
-                varId = variables['ID'][j - 1]
+            varId = resolver.variable_id(*header_variable(line))
+            if varId is not None:
                 if varId not in variablesList:
                     variablesList.append(varId)
             else:
@@ -386,17 +262,9 @@ def exploreIdeamFile(filepath, methods, variables, sites):
         # get station type
         if i == 6:
             sta_type = line[48:50]
+            methodId = resolver.method_id(sta_type)
 
-            # do while method dont exist
-            j = 0
-            methodExist = 0
-            while methodExist == 0 and j < len(methods['ID']):
-                if methods['Description'][j][-2:] == sta_type:
-                    methodExist = 1
-                j += 1
-
-            if methodExist == 1:
-                methodId = methods['ID'][j - 1]
+            if methodId is not None:
                 if methodId not in methodsList:
                     methodsList.append(methodId)
             else:
@@ -410,37 +278,3 @@ def exploreIdeamFile(filepath, methods, variables, sites):
 
     f.close()
     return [nSites, methodsList, variablesList, allVarsCreated, allMethodsCreated, allSitesCreated]
-
-
-# noinspection PyShadowingNames
-def ideamSupportedVars(ideam_var_line, db_variables):
-    varIdMean = None
-    varIdMax = None
-    varIdMin = None
-    varName = ideam_var_line.split()[4]
-    varName2 = ideam_var_line.split()[0]
-
-    # supported IDEAM variables
-    if varName == 'CAUDALES':
-        varName = 'Streamflow'
-    elif varName == 'PRECIPITACION':
-        varName = 'Precipitation'
-    elif varName == 'NIVELES':
-        varName = 'Water depth'
-    elif varName == 'SEDIMENTOS':
-        varName = 'Sediment, suspended'
-    elif varName2 == 'TRANSPORTE':
-        varName = 'Solids, total suspended'
-
-    # asociate variable in text line with database variable
-    j = 0
-    while j < len(db_variables['ID']):
-        if db_variables['Variable'][j] == varName:
-            if db_variables['Type'][j] == 'Average' or db_variables['Type'][j] == 'Cumulative':
-                varIdMean = db_variables['ID'][j]
-            elif db_variables['Type'][j] == 'Maximum':
-                varIdMax = db_variables['ID'][j]
-            elif db_variables['Type'][j] == 'Minimum':
-                varIdMin = db_variables['ID'][j]
-        j += 1
-    return varIdMean, varIdMax, varIdMin
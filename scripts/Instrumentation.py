@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Lightweight instrumentation of hot paths (imports, database flushes, queries and GUI models)
+        - Spans (context manager / decorator): count, total, min and max time and latency histogram
+        - Counters (values parsed, rows written, ...)
+    + Export as JSON or Prometheus text (file), automatic export at exit with the environment variable
+      HYDROCLIMAT_METRICS=/path/to/metrics.json (or .prom)
+    + Stack of active spans per thread (logical operation of SqlProfiler statements)
+
+Usage:
+    from Instrumentation import span, count, instrumented
+
+    with span('ideam.parse_file'):
+        ...
+        count('ideam.values', n)
+
+    @instrumented('query')
+    def get_sites_table(engine): ...
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import os
+import re
+import json
+import time
+import atexit
+import bisect
+import functools
+import itertools
+import threading
+from contextlib import contextmanager
+
+METRICS_ENV = 'HYDROCLIMAT_METRICS'
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1., 5., 10., 30., 60., 300.)       # seconds
+
+
+# %% Metrics registry
+class SpanStats(object):
+    """
+    Timing statistics of a span (count, total, min, max and cumulative histogram buckets)
+    """
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.min = float('inf')
+        self.max = 0.
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def asDict(self):
+        return {'count': self.count, 'total': self.total, 'mean': self.total / self.count if self.count else None,
+                'min': self.min if self.count else None, 'max': self.max,
+                'buckets': dict(zip([str(i) for i in BUCKETS] + ['+Inf'], self.buckets))}
+
+
+class MetricsRegistry(object):
+    """
+    Spans and counters of the process (thread safe)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+        self.started = time.time()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.add(seconds)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.spans.clear()
+            self.counters.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        """
+            Metrics dictionary {started, exported, spans, counters}
+        """
+        with self.lock:
+            return {'started': self.started, 'exported': time.time(),
+                    'spans': {name: stats.asDict() for name, stats in sorted(self.spans.items())},
+                    'counters': dict(sorted(self.counters.items()))}
+
+    def toJson(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def toPrometheus(self, prefix='hydroclimat'):
+        """
+            Metrics in Prometheus text exposition format (span histograms and counters)
+        """
+        metrics = self.snapshot()
+        lines = ['# HELP %s_span_seconds Time spent in instrumented spans' % prefix,
+                 '# TYPE %s_span_seconds histogram' % prefix]
+        for name, stats in metrics['spans'].items():
+            cumulative = 0
+            for bound, n in stats['buckets'].items():
+                cumulative += n
+                lines.append('%s_span_seconds_bucket{span="%s",le="%s"} %d' % (prefix, name, bound, cumulative))
+            lines.append('%s_span_seconds_sum{span="%s"} %.6f' % (prefix, name, stats['total']))
+            lines.append('%s_span_seconds_count{span="%s"} %d' % (prefix, name, stats['count']))
+
+        for name, value in metrics['counters'].items():
+            metric = '%s_%s_total' % (prefix, re.sub(r'[^a-zA-Z0-9_]', '_', name))
+            lines.append('# TYPE %s counter' % metric)
+            lines.append('%s %s' % (metric, value))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path):
+        """
+            Write metrics to file (Prometheus text for *.prom or *.txt files, JSON otherwise)
+        """
+        text = self.toPrometheus() if os.path.splitext(path)[1].lower() in ('.prom', '.txt') else self.toJson()
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+
+REGISTRY = MetricsRegistry()
+_active = threading.local()
+_serials = itertools.count(1)
+
+
+# %% Active spans
+def _push(name):
+    stack = _active.__dict__.setdefault('stack', [])
+    stack.append((name, next(_serials)))
+    return stack
+
+
+def active_spans():
+    """
+        Spans running in the current thread, outermost first [(name, call serial), ...]
+    """
+    return tuple(getattr(_active, 'stack', ()))
+
+
+# %% Instrumentation API
+@contextmanager
+def span(name, registry=REGISTRY):
+    """
+        Time the enclosed block as span 'name'
+    """
+    stack = _push(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - start)
+        stack.pop()
+
+
+def count(name, value=1, registry=REGISTRY):
+    registry.count(name, value)
+
+
+def instrumented(prefix, name=None, registry=REGISTRY):
+    """
+        Decorator timing each call of a function as span 'prefix.function_name'
+    """
+    def decorator(func):
+        spanName = '%s.%s' % (prefix, name or func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = _push(spanName)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(spanName, time.perf_counter() - start)
+                stack.pop()
+        return wrapper
+    return decorator
+
+
+def export_metrics(path=None, registry=REGISTRY):
+    """
+        Write metrics to path (or to the HYDROCLIMAT_METRICS file); written path or None
+    """
+    path = path or os.environ.get(METRICS_ENV)
+    if not path:
+        return None
+    return registry.export(path)
+
+
+def _export_at_exit():
+    try:
+        export_metrics()
+    except OSError:
+        pass
+
+
+if os.environ.get(METRICS_ENV):
+    atexit.register(_export_at_exit)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Missing data analysis of daily series (many stations at once, vectorized over a days x stations matrix)
+        - Completeness per station record, year and month (days inside the station record period)
+        - Longest gap and number of gaps per period (run-length encoding of missing days)
+        - Gaps table (start, end and length of every gap)
+    + Command line report of the series stored in a project file (*.hct)
+
+Report table (tidy):
+    Code, Year, Month, Days, Valid, Missing, Completeness (%), LongestGap, Gaps
+    Year 0 and Month 0 rows summarize the whole record; Month 0 rows summarize a year
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+from SeriesArrays import stack_daily, calendar, period_starts, is_daily
+
+REPORT_COLUMNS = ['Code', 'Year', 'Month', 'Days', 'Valid', 'Missing', 'Completeness', 'LongestGap', 'Gaps']
+
+
+# %% Record period of each station
+def record_mask(valid):
+    """
+        True between the first and the last valid day of each station (column)
+    """
+    rows = np.arange(valid.shape[0])[:, None]
+    anyValid = valid.any(axis=0)
+    first = np.argmax(valid, axis=0)
+    last = valid.shape[0] - 1 - np.argmax(valid[::-1], axis=0)
+    return (rows >= first) & (rows <= last) & anyValid
+
+
+# %% Run-length encoding of missing days
+def gap_length(missing, starts):
+    """
+        Length of the gap ending at each day (0 for valid days), restarted at each period start
+    """
+    rows = np.arange(missing.shape[0])[:, None]
+    breaks = np.where(missing, -1, rows)
+    resets = np.full(missing.shape[0], -1)
+    resets[starts] = starts - 1
+    breaks = np.maximum(breaks, resets[:, None])
+    return np.where(missing, rows - np.maximum.accumulate(breaks, axis=0), 0)
+
+
+def gap_starts(missing, starts):
+    """
+        True where a gap starts (gaps crossing a period start are counted in both periods)
+    """
+    previous = np.vstack((np.zeros((1, missing.shape[1]), dtype=bool), missing[:-1]))
+    previous[starts] = False
+    return missing & ~previous
+
+
+def gap_runs(missing):
+    """
+        Gaps of each station: [station column, first row, length] arrays
+    """
+    padded = np.zeros((missing.shape[1], missing.shape[0] + 2), dtype=np.int8)
+    padded[:, 1:-1] = missing.T
+    change = np.diff(padded, axis=1)
+    cols, first = np.nonzero(change == 1)
+    _, end = np.nonzero(change == -1)
+    return cols, first, end - first
+
+
+# %% Period summaries
+def _summary(valid, inRecord, missing, starts):
+    days = np.add.reduceat(inRecord, starts, axis=0)
+    count = np.add.reduceat(valid, starts, axis=0)
+    longest = np.maximum.reduceat(gap_length(missing, starts), starts, axis=0)
+    gaps = np.add.reduceat(gap_starts(missing, starts), starts, axis=0)
+    return days, count, longest, gaps
+
+
+def _table(codes, years, months, days, count, longest, gaps):
+    nPeriods, nStations = days.shape
+    table = pd.DataFrame({'Code': np.tile(np.asarray(codes, dtype=object), nPeriods),
+                          'Year': np.repeat(years, nStations), 'Month': np.repeat(months, nStations),
+                          'Days': days.ravel(), 'Valid': count.ravel(), 'Missing': (days - count).ravel(),
+                          'LongestGap': longest.ravel(), 'Gaps': gaps.ravel()})
+    table = table[table['Days'] > 0]
+    table['Completeness'] = 100. * table['Valid'] / table['Days']
+    return table
+
+
+# %% Missing data report
+def missing_report(series_dict):
+    """
+        Completeness, longest gap and number of gaps of daily series {code: pandas series}
+        per station record, year and month (tidy dataframe, see REPORT_COLUMNS)
+    """
+    codes, dates, values = stack_daily(series_dict)
+    if not len(dates):
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+
+    valid = ~np.isnan(values)
+    inRecord = record_mask(valid)
+    missing = inRecord & ~valid
+    years, months, _ = calendar(dates)
+
+    # monthly, annual and whole record summaries
+    tables = []
+    monthStarts = period_starts(years * 12 + months)
+    tables.append(_table(codes, years[monthStarts], months[monthStarts],
+                         *_summary(valid, inRecord, missing, monthStarts)))
+    yearStarts = period_starts(years)
+    tables.append(_table(codes, years[yearStarts], np.zeros(len(yearStarts), dtype=np.int64),
+                         *_summary(valid, inRecord, missing, yearStarts)))
+    tables.append(_table(codes, np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64),
+                         *_summary(valid, inRecord, missing, np.zeros(1, dtype=np.int64))))
+
+    report = pd.concat(tables, ignore_index=True)
+    report['Order'] = report['Code'].map({c: n for n, c in enumerate(codes)})
+    report = report.sort_values(['Order', 'Year', 'Month']).drop(columns='Order')
+    return report[REPORT_COLUMNS].reset_index(drop=True)
+
+
+def gaps_table(series_dict, min_length=1):
+    """
+        Gaps of daily series {code: pandas series} inside each station record
+        [Code, Start, End, Days] dataframe
+    """
+    codes, dates, values = stack_daily(series_dict)
+    valid = ~np.isnan(values)
+    cols, first, length = gap_runs(record_mask(valid) & ~valid)
+
+    keep = length >= min_length
+    cols, first, length = cols[keep], first[keep], length[keep]
+    return pd.DataFrame({'Code': np.asarray(codes, dtype=object)[cols], 'Start': dates[first],
+                         'End': dates[first + length - 1], 'Days': length}, columns=['Code', 'Start', 'End', 'Days'])
+
+
+# %% Command line report
+def project_daily_series(project_file):
+    """
+        Daily series stored in a project file {'code [ts_id]': pandas series}
+    """
+    from ProjectFile import ProjectArchive
+
+    archive = ProjectArchive(project_file)
+    seriesDict = {}
+    for ts_id, identifier in sorted(archive.identifiers().items()):
+        series = archive.series(ts_id)
+        if is_daily(series):
+            seriesDict['%s [%d]' % (identifier[4][0], ts_id)] = series
+    archive.close()
+    return seriesDict
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Missing data report of the daily series of a project file')
+    parser.add_argument('project_file', help='HydroClimaT project file (*.hct)')
+    parser.add_argument('-o', '--output', help='Report csv file (printed when not given)')
+    parser.add_argument('-g', '--gaps', help='Gaps csv file')
+    parser.add_argument('-m', '--min-gap', help='Minimum gap length (days) in gaps file', default=1, type=int,
+                        dest='min_gap')
+    args = parser.parse_args()
+
+    projectSeries = project_daily_series(args.project_file)
+    if not projectSeries:
+        sys.stderr.write('No daily series in %s\n' % args.project_file)
+        sys.exit(1)
+
+    missingReport = missing_report(projectSeries)
+    if args.output:
+        missingReport.to_csv(args.output, index=False, float_format='%.2f')
+    else:
+        print(missingReport[missingReport['Month'] == 0].to_string(index=False))
+
+    if args.gaps:
+        gaps_table(projectSeries, args.min_gap).to_csv(args.gaps, index=False)
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + HydroClimaT project file (*.hct)
+        - Zip container with a JSON manifest (workspace identifiers, series ids)
+        - Columnar payloads (one .npy member per column) for series and derived results; object columns (text,
+          mixed values) as JSON members, column dtypes restored from the manifest (no pickle)
+        - Lazy loading: opening a project only reads the manifest, payloads are read on first display
+
+Project layout:
+    manifest.json
+    series/<ts_id>/index.npy, series/<ts_id>/values.npy
+    results/<ts_id>/<name>/index.npy, results/<ts_id>/<name>/c<n>.npy (.json for object columns)
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import io
+import os
+import json
+import zipfile
+import datetime
+import numpy as np
+import pandas as pd
+
+PROJECT_FORMAT = 'hydroclimat-project'
+PROJECT_VERSION = 2
+PROJECT_EXTENSION = '.hct'
+
+
+# %% Check project file
+def is_project(path):
+    """
+        True if path is a HydroClimaT project (zip container with a manifest)
+    """
+    if not zipfile.is_zipfile(path):
+        return False
+
+    with zipfile.ZipFile(path) as archive:
+        return 'manifest.json' in archive.namelist()
+
+
+# %% Array (de)serialization
+def _array_to_bytes(array):
+    array = np.asarray(array)
+    if array.dtype.kind == 'M':                     # datetimes stored as seconds since epoch
+        array = array.astype('datetime64[s]')
+
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _bytes_to_array(data):
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+def _json_value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return {'$datetime': value.isoformat()}
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    return value
+
+
+def _json_object(item):
+    if '$datetime' in item:
+        return pd.Timestamp(item['$datetime'])
+    return item
+
+
+def _json_to_array(data):
+    items = json.loads(data.decode('utf-8'), object_hook=_json_object)
+    array = np.empty(len(items), dtype=object)
+    array[:] = items
+    return array
+
+
+def _write_member(archive, prefix, name, values):
+    """
+        Write a column as .npy (typed arrays) or .json (object columns: text, mixed values, missing values);
+        returns manifest entry {'member', 'dtype'}
+    """
+    dtype = str(values.dtype)
+    array = np.asarray(values)
+    if array.dtype.kind == 'O':
+        member = name + '.json'
+        archive.writestr(prefix + member, json.dumps([_json_value(i) for i in array]))
+    else:
+        member = name + '.npy'
+        archive.writestr(prefix + member, _array_to_bytes(array))
+    return {'member': member, 'dtype': dtype}
+
+
+def _read_member(archive, prefix, entry):
+    member = prefix + entry['member']
+    if member.endswith('.json'):
+        array = _json_to_array(archive.read(member))
+    else:
+        array = _bytes_to_array(archive.read(member))
+
+    # restore pandas dtype (extension and string dtypes, datetime resolution)
+    values = pd.Series(array, copy=False)
+    if entry['dtype'] != str(values.dtype):
+        try:
+            values = values.astype(entry['dtype'])
+        except (TypeError, ValueError):
+            pass
+    return values
+
+
+def _write_columns(archive, prefix, pd_object):
+    """
+        Write pandas series or dataframe as one member per column; returns manifest entry
+    """
+    entry = {'length': len(pd_object), 'index': _write_member(archive, prefix, 'index', pd_object.index)}
+
+    if isinstance(pd_object, pd.DataFrame):
+        entry['kind'] = 'frame'
+        entry['columns'] = [str(i) for i in pd_object.columns]
+        entry['data'] = [_write_member(archive, prefix, 'c%d' % n, pd_object.iloc[:, n])
+                         for n in range(pd_object.shape[1])]
+        return entry
+
+    entry['kind'] = 'series'
+    entry['data'] = [_write_member(archive, prefix, 'values', pd_object)]
+    return entry
+
+
+def _read_columns(archive, prefix, entry):
+    if 'index' not in entry:                        # version 1 projects (.npy members, text as unicode)
+        index = _bytes_to_array(archive.read(prefix + 'index.npy'))
+        if entry['kind'] == 'frame':
+            data = {}
+            for n, col in enumerate(entry['columns']):
+                data[col] = _bytes_to_array(archive.read(prefix + 'c%d.npy' % n))
+            return pd.DataFrame(data, index=index, columns=entry['columns'])
+        return pd.Series(_bytes_to_array(archive.read(prefix + 'values.npy')), index=index)
+
+    index = pd.Index(_read_member(archive, prefix, entry['index']))
+    if entry['kind'] == 'frame':
+        data = {col: _read_member(archive, prefix, column).values
+                for col, column in zip(entry['columns'], entry['data'])}
+        return pd.DataFrame(data, index=index, columns=entry['columns'])
+
+    return pd.Series(_read_member(archive, prefix, entry['data'][0]).values, index=index)
+
+
+# %% Save project
+def save_project(path, identifiers, next_id, series=None, results=None, source=None):
+    """
+        Write workspace to a project file:
+            identifiers: {ts_id: time_series_identifier} (HydroClimate.timeSeriesDict)
+            next_id: next time-series id in the workspace
+            series: {ts_id: pandas series} loaded series payloads
+            results: {ts_id: {name: pandas series/dataframe}} derived results
+            source: opened ProjectArchive; payloads not loaded in memory are copied from it without decoding
+    """
+    series = series or {}
+    results = results or {}
+    manifest = {'format': PROJECT_FORMAT, 'version': PROJECT_VERSION, 'nextId': int(next_id), 'series': [],
+                'results': []}
+
+    tmp_path = path + '.tmp'
+    try:
+        _write_project(tmp_path, manifest, identifiers, series, results, source)
+    except BaseException:
+        if os.path.exists(tmp_path):           # incomplete project is never left behind
+            os.remove(tmp_path)
+        raise
+
+    # replace project file only when the new one is complete
+    if source is not None:
+        source.close()
+    os.replace(tmp_path, path)
+
+    return ProjectArchive(path)
+
+
+def _write_project(tmp_path, manifest, identifiers, series, results, source):
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for ts_id in sorted(identifiers):
+            entry = {'id': int(ts_id), 'identifier': identifiers[ts_id], 'payload': None}
+            prefix = 'series/%d/' % ts_id
+
+            if series.get(ts_id) is not None:
+                entry['payload'] = _write_columns(archive, prefix, series[ts_id])
+            elif source is not None and source.hasSeries(ts_id):
+                entry['payload'] = source.copySeries(ts_id, archive)
+
+            manifest['series'].append(entry)
+
+            # derived results [in memory results replace the ones stored in the source project]
+            tsResults = results.get(ts_id, {})
+            for name in sorted(tsResults):
+                resultEntry = {'id': int(ts_id), 'name': name}
+                resultEntry.update(_write_columns(archive, 'results/%d/%s/' % (ts_id, name), tsResults[name]))
+                manifest['results'].append(resultEntry)
+
+            if source is not None:
+                for name in source.resultNames(ts_id):
+                    if name not in tsResults:
+                        manifest['results'].append(source.copyResult(ts_id, name, archive))
+
+        archive.writestr('manifest.json', json.dumps(manifest))
+
+
+# %% Opened project
+class ProjectArchive(object):
+    """
+    Opened project file; only the manifest is read when opening, series payloads and derived results
+    are read on first access
+    """
+    def __init__(self, path):
+        self.path = path
+        self.archive = zipfile.ZipFile(path)
+        self.manifest = json.loads(self.archive.read('manifest.json').decode('utf-8'))
+
+        if self.manifest.get('format') != PROJECT_FORMAT:
+            raise ValueError('%s is not a HydroClimaT project' % path)
+
+        self.entries = {i['id']: i for i in self.manifest['series']}
+        self.resultEntries = {(i['id'], i['name']): i for i in self.manifest['results']}
+
+    def identifiers(self):
+        """
+            Workspace identifiers {ts_id: time_series_identifier}
+        """
+        return {ts_id: entry['identifier'] for ts_id, entry in self.entries.items()}
+
+    def nextId(self):
+        return self.manifest['nextId']
+
+    def hasSeries(self, ts_id):
+        return ts_id in self.entries and self.entries[ts_id]['payload'] is not None
+
+    def series(self, ts_id):
+        """
+            Read series payload (pandas series) or None if the project has no payload for ts_id
+        """
+        if not self.hasSeries(ts_id):
+            return None
+        return _read_columns(self.archive, 'series/%d/' % ts_id, self.entries[ts_id]['payload'])
+
+    def resultNames(self, ts_id):
+        return sorted(name for (i, name) in self.resultEntries if i == ts_id)
+
+    def result(self, ts_id, name):
+        """
+            Read derived result (pandas series/dataframe)
+        """
+        return _read_columns(self.archive, 'results/%d/%s/' % (ts_id, name), self.resultEntries[(ts_id, name)])
+
+    def copySeries(self, ts_id, archive):
+        """
+            Copy series payload members to another zip archive without decoding them
+        """
+        self._copyMembers('series/%d/' % ts_id, archive)
+        return self.entries[ts_id]['payload']
+
+    def copyResult(self, ts_id, name, archive):
+        self._copyMembers('results/%d/%s/' % (ts_id, name), archive)
+        return self.resultEntries[(ts_id, name)]
+
+    def _copyMembers(self, prefix, archive):
+        for member in self.archive.namelist():
+            if member.startswith(prefix):
+                archive.writestr(member, self.archive.read(member))
+
+    def close(self):
+        self.archive.close()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Quality control flags of whole series (vectorized over a time x series matrix, rolling windows by
+      cumulative sums)
+        - Range check (physical limits)
+        - Spike detection (deviation from the centered window without the value)
+        - Flat-line detection (runs of repeated values)
+        - Step-change test (mean of the window before and after each value)
+        - Source qualifier (IDEAM qualifier digit other than 1)
+    + Flags stored as a bitmask per value (uint8)
+    + Import pipeline stage (values collected during ingest, flagged in one pass at the end over a continuous
+      daily calendar)
+    + Flags of imported values persisted in the DataValuesQC table (ValueId, bitmask; flagged values only)
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from SeriesArrays import stack_daily
+from IdeamReader import time_strings
+from Instrumentation import instrumented
+
+QC_RANGE = 1
+QC_SPIKE = 2
+QC_FLATLINE = 4
+QC_STEP = 8
+QC_QUALIFIER = 16
+QC_NAMES = {QC_RANGE: 'Range', QC_SPIKE: 'Spike', QC_FLATLINE: 'Flat-line', QC_STEP: 'Step',
+            QC_QUALIFIER: 'Qualifier'}
+
+STORE_FLAGS = '''
+INSERT INTO "DataValuesQC" ("ValueId", "QCFlags")
+SELECT "ValueId", :flags FROM "DataValues"
+WHERE "SiteId" = :site_id AND "VariableId" = :variable_id AND "MethodId" = :method_id
+  AND "SourceId" = :source_id AND "QualityControlLevelId" = :quality_id AND "LocalDateTime" = :local_time
+ON CONFLICT ("ValueId") DO UPDATE SET "QCFlags" = excluded."QCFlags"
+'''
+
+DEFAULT_PARAMETERS = {'lower': 0., 'upper': None, 'spike_window': 7, 'spike_threshold': 6., 'flat_run': 10,
+                      'ignore_zero': True, 'step_window': 30, 'step_threshold': 4.}
+
+
+# %% Rolling windows by cumulative sums
+def _cumulative(values):
+    """
+        Cumulative sums (with leading zero row) of values, squares and valid counts of a time x series matrix
+    """
+    valid = ~np.isnan(values)
+    x = np.where(valid, values, 0.)
+    zeros = np.zeros((1, values.shape[1]))
+    return (np.vstack((zeros, np.cumsum(x, axis=0))), np.vstack((zeros, np.cumsum(x * x, axis=0))),
+            np.vstack((zeros, np.cumsum(valid, axis=0))))
+
+
+def window_sums(cumulative, first, last):
+    """
+        Sums over rows [first, last) of each series (row limits clipped to the matrix)
+    """
+    nRows = cumulative.shape[0] - 1
+    first = np.clip(first, 0, nRows)
+    last = np.clip(last, 0, nRows)
+    return cumulative[last] - cumulative[first]
+
+
+def _moments(sums, squares, count):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / count
+        var = (squares - count * mean ** 2) / (count - 1)
+    return mean, np.sqrt(np.maximum(var, 0.))
+
+
+# %% Tests
+def range_flags(values, lower=None, upper=None):
+    flags = np.zeros(values.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        if lower is not None:
+            flags |= values < lower
+        if upper is not None:
+            flags |= values > upper
+    return flags
+
+
+def spike_flags(values, cumulative, window=7, threshold=6.):
+    """
+        Values deviating more than threshold standard deviations from the mean of the centered window
+        (window days each side, the value itself excluded)
+    """
+    rows = np.arange(values.shape[0])
+    csum, csq, ccount = cumulative
+    x = np.where(np.isnan(values), 0., values)
+    valid = ~np.isnan(values)
+
+    sums = window_sums(csum, rows - window, rows + window + 1) - x
+    squares = window_sums(csq, rows - window, rows + window + 1) - x * x
+    count = window_sums(ccount, rows - window, rows + window + 1) - valid
+    mean, std = _moments(sums, squares, count)
+
+    with np.errstate(invalid='ignore'):
+        return valid & (count >= window) & (std > 0) & (np.abs(values - mean) > threshold * std)
+
+
+def flatline_flags(values, min_run=10, ignore_zero=True):
+    """
+        Values in runs of at least min_run repeated values (zero runs ignored for intermittent variables)
+    """
+    nRows = values.shape[0]
+    rows = np.arange(nRows)[:, None]
+    valid = ~np.isnan(values)
+    same = np.zeros(values.shape, dtype=bool)
+    same[1:] = valid[1:] & valid[:-1] & (values[1:] == values[:-1])
+
+    # rows where each run starts and where the next run starts
+    starts = ~same
+    runStart = np.maximum.accumulate(np.where(starts, rows, 0), axis=0)
+    nextStart = np.full(values.shape, nRows)
+    nextStart[:-1] = np.minimum.accumulate(np.where(starts, rows, nRows)[::-1], axis=0)[::-1][1:]
+
+    flags = valid & (nextStart - runStart >= min_run)
+    if ignore_zero:
+        flags &= values != 0
+    return flags
+
+
+def step_flags(values, cumulative, window=30, threshold=4.):
+    """
+        First value after a step: means of the windows before and after differ more than threshold pooled
+        standard deviations
+    """
+    rows = np.arange(values.shape[0])
+    csum, csq, ccount = cumulative
+
+    meanBefore, stdBefore = _moments(window_sums(csum, rows - window, rows), window_sums(csq, rows - window, rows),
+                                     window_sums(ccount, rows - window, rows))
+    countBefore = window_sums(ccount, rows - window, rows)
+    meanAfter, stdAfter = _moments(window_sums(csum, rows, rows + window), window_sums(csq, rows, rows + window),
+                                   window_sums(ccount, rows, rows + window))
+    countAfter = window_sums(ccount, rows, rows + window)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pooled = np.sqrt((stdBefore ** 2 + stdAfter ** 2) / 2)
+        enough = (countBefore >= window / 2) & (countAfter >= window / 2) & ~np.isnan(values) & (pooled > 0)
+        statistic = np.where(enough, np.abs(meanAfter - meanBefore) / pooled, 0.)
+
+    # only the row where the step statistic peaks (windows around a step exceed the threshold too)
+    previous = np.vstack((np.zeros((1, values.shape[1])), statistic[:-1]))
+    following = np.vstack((statistic[1:], np.zeros((1, values.shape[1]))))
+    return (statistic > threshold) & (statistic > previous) & (statistic >= following)
+
+
+# %% Quality control flags
+def qc_flags(values, qualifiers=None, **parameters):
+    """
+        Quality control bitmask of each value of a time x series matrix (or a single series vector)
+            qualifiers: source qualifier digits (NaN or 1 for regular values)
+            parameters: see DEFAULT_PARAMETERS (limits, windows and thresholds)
+        [uint8 flags with the shape of values]
+    """
+    p = dict(DEFAULT_PARAMETERS, **parameters)
+    values = np.asarray(values, dtype=np.float64)
+    vector = values.ndim == 1
+    if vector:
+        values = values[:, None]
+
+    cumulative = _cumulative(values)
+    flags = np.zeros(values.shape, dtype=np.uint8)
+    flags |= range_flags(values, p['lower'], p['upper']) * np.uint8(QC_RANGE)
+    flags |= spike_flags(values, cumulative, p['spike_window'], p['spike_threshold']) * np.uint8(QC_SPIKE)
+    flags |= flatline_flags(values, p['flat_run'], p['ignore_zero']) * np.uint8(QC_FLATLINE)
+    flags |= step_flags(values, cumulative, p['step_window'], p['step_threshold']) * np.uint8(QC_STEP)
+
+    if qualifiers is not None:
+        qualifiers = np.asarray(qualifiers, dtype=np.float64).reshape(values.shape)
+        with np.errstate(invalid='ignore'):
+            flags |= ((qualifiers != 1) & ~np.isnan(qualifiers)) * np.uint8(QC_QUALIFIER)
+
+    return flags[:, 0] if vector else flags
+
+
+def flag_series(series_dict, **parameters):
+    """
+        Quality control flags of daily series {code: pandas series} checked together (days x stations matrix)
+        {code: uint8 pandas series with the index of each series}
+    """
+    codes, dates, values = stack_daily(series_dict)
+    if not len(dates):
+        return {code: pd.Series([], dtype=np.uint8) for code in codes}
+
+    flags = qc_flags(values, **parameters)
+    flagsDict = {}
+    for col, (code, series) in enumerate(zip(codes, series_dict.values())):
+        rows = (np.asarray(series.index.values, dtype='datetime64[D]') - dates[0]).astype(np.int64)
+        flagsDict[code] = pd.Series(flags[rows, col], index=series.index, name=code)
+    return flagsDict
+
+
+def flag_counts(flags_dict):
+    """
+        Flagged values of each series by test [Code, Values, Flagged, Range, Spike, ...] dataframe
+    """
+    table = []
+    for code, flags in flags_dict.items():
+        flags = np.asarray(flags, dtype=np.uint8)
+        row = {'Code': str(code), 'Values': len(flags), 'Flagged': int((flags > 0).sum())}
+        for bit, name in QC_NAMES.items():
+            row[name] = int((flags & bit > 0).sum())
+        table.append(row)
+    return pd.DataFrame(table, columns=['Code', 'Values', 'Flagged'] + list(QC_NAMES.values()))
+
+
+def describe_flags(flags):
+    """
+        Names of the tests failed by a value flag ('Range, Spike')
+    """
+    return ', '.join(name for bit, name in QC_NAMES.items() if int(flags) & bit)
+
+
+# %% Import pipeline stage
+class QCStage(object):
+    """
+    Quality control stage of an import pipeline: values are collected per series key during ingest (list
+    appends only) and flagged together in one vectorized pass when the import finishes
+    """
+    def __init__(self, **parameters):
+        self.parameters = parameters
+        self.buffers = {}
+
+    def add(self, key, date, value, qualifier=np.nan):
+        buffer = self.buffers.setdefault(key, ([], [], []))
+        buffer[0].append(date)
+        buffer[1].append(value)
+        buffer[2].append(qualifier)
+
+    def add_many(self, key, dates, values, qualifiers):
+        buffer = self.buffers.setdefault(key, ([], [], []))
+        buffer[0].extend(dates)
+        buffer[1].extend(values)
+        buffer[2].extend(qualifiers)
+
+    def run(self):
+        """
+            Flags of each collected series {key: dataframe [Value, Qualifier, Flags] indexed by date}; series are
+            flagged over a continuous daily calendar (missing days as NaN, so windows and runs span real days)
+            and repeated days keep the value of the latest time (the last collected for the same time)
+        """
+        results = {}
+        for key, (dates, values, qualifiers) in self.buffers.items():
+            frame = pd.DataFrame({'Value': np.asarray(values, dtype=np.float64),
+                                  'Qualifier': np.asarray(qualifiers, dtype=np.float64)},
+                                 index=pd.DatetimeIndex(dates)).sort_index(kind='mergesort')
+            days = frame.index.normalize()
+            frame = frame[~days.duplicated(keep='last')]
+            if not len(frame):
+                frame['Flags'] = np.array([], dtype=np.uint8)
+                results[key] = frame
+                continue
+
+            # rows of the collected days in the calendar, filler rows dropped after flagging
+            rows = ((frame.index.normalize() - frame.index[0].normalize()) // pd.Timedelta(days=1)).values
+            calendarValues = np.full(rows[-1] + 1, np.nan)
+            calendarQualifiers = np.full(rows[-1] + 1, np.nan)
+            calendarValues[rows] = frame['Value'].values
+            calendarQualifiers[rows] = frame['Qualifier'].values
+            frame['Flags'] = qc_flags(calendarValues, calendarQualifiers, **self.parameters)[rows]
+            results[key] = frame
+        return results
+
+    def clear(self):
+        self.buffers.clear()
+
+
+# %% Persisted flags
+@instrumented('db', 'store_flags')
+def store_flags(engine, results, source_id, quality_id):
+    """
+        Store flags of imported values (QCStage.run results keyed (site code, variable id, method id)) in the
+        DataValuesQC table; only flagged values are stored, matched by the whole series (site, variable, method,
+        source and quality control level) and local time
+        [stored values]
+    """
+    from DatabaseDeclarative import DataValuesQC
+    DataValuesQC.__table__.create(engine, checkfirst=True)
+
+    with engine.begin() as conn:
+        # station codes are site ids (importer convention) or site codes, as in the staged import
+        sites = conn.execute(text('SELECT "SiteId", "SiteCode" FROM "Sites" ORDER BY "SiteId"')).fetchall()
+        siteIds = {}
+        for siteId, siteCode in sites:
+            if siteCode is not None:
+                siteIds.setdefault(str(siteCode).strip(), siteId)
+        siteIds.update((str(siteId), siteId) for siteId, siteCode in sites)
+
+        rows = []
+        for (code, variableId, methodId), frame in results.items():
+            siteId = siteIds.get(str(code).strip())
+            flagged = frame[frame['Flags'] > 0]
+            if siteId is None or variableId is None or methodId is None or not len(flagged):
+                continue
+            times = time_strings(flagged.index.values.astype('datetime64[s]'))
+            rows.extend({'flags': int(f), 'site_id': siteId, 'variable_id': variableId, 'method_id': methodId,
+                         'source_id': source_id, 'quality_id': quality_id, 'local_time': t}
+                        for f, t in zip(flagged['Flags'].tolist(), times.tolist()))
+        if rows:
+            conn.execute(text(STORE_FLAGS), rows)
+    return len(rows)
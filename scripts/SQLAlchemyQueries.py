@@ -16,10 +16,13 @@ email:      andresfduque@gmail.com
 """
 
 # %% Main imports
-# from odm_sqlalchemy_declarative import DataValues
-from sqlalchemy import and_
-from odm2api import models
+from sqlalchemy import and_, tuple_
 from sqlalchemy.orm import sessionmaker
+from Instrumentation import instrumented
+from DatabaseDeclarative import (Base, CensorCodeCV, DataTypeCV, DataValues, GeneralCategoryCV, ISOMetadata, Methods,
+                                 Qualifiers, QualityControlLevels, SampleMediumCV, SiteTypeCV, Sites, Sources,
+                                 SpatialReferences, SpeciationCV, TopicCategoryCV, Units, ValueTypeCV, VariableNameCV,
+                                 Variables, VerticalDatumCV)
 
 
 
@@ -39,6 +42,7 @@ def startDBSession(engine):
 
 
 # %% Create methods dictionary
+@instrumented('query')
 def get_metadata_table(engine=None):
     """
         Create metadata dictionary to be displayed in Hydro-ClimaT
@@ -66,6 +70,7 @@ def get_metadata_table(engine=None):
 
 
 # %% Create sources dictionary
+@instrumented('query')
 def get_sources_table(engine=None):
     """
         Create sources dictionary to be displayed in Hydro-ClimaT
@@ -88,6 +93,7 @@ def get_sources_table(engine=None):
 
 
 # %% Create sites dictionary
+@instrumented('query')
 def get_sites_table(engine=None):
     """
         Create sites dictionary to be displayed in Hydro-ClimaT
@@ -106,6 +112,7 @@ def get_sites_table(engine=None):
 
 
 # %% Create variables dictionary
+@instrumented('query')
 def get_vars_table(engine=None):
     """
         Create variables dictionary to be displayed in Hydro-ClimaT
@@ -135,6 +142,7 @@ def get_vars_table(engine=None):
 
 
 # %% Create methods dictionary
+@instrumented('query')
 def get_methods_table(engine=None):
     """
         Create methods dictionary to be displayed in Hydro-ClimaT
@@ -157,6 +165,7 @@ def get_methods_table(engine=None):
 
 
 # %% Create quality control levels dictionary
+@instrumented('query')
 def get_qualities_table(engine=None):
     """
         Create quality control levels dictionary to be displayed in Hydro-ClimaT
@@ -181,6 +190,7 @@ def get_qualities_table(engine=None):
 
 
 # %% Create qualifiers dictionary
+@instrumented('query')
 def get_qualifiers_table(engine=None):
     """
         Create qualifiers dictionary to be displayed in Hydro-ClimaT
@@ -204,6 +214,7 @@ def get_qualifiers_table(engine=None):
 
 
 # %% Create site-types dictionary
+@instrumented('query')
 def get_sitetype_table(engine=None):
     """
         Create site-types dictionary to be displayed in Hydro-ClimaT
@@ -224,6 +235,7 @@ def get_sitetype_table(engine=None):
 
 
 # %% Create spatial references dictionary
+@instrumented('query')
 def get_srs_table(engine=None):
     """
         Create spatial references dictionary to be displayed in Hydro-ClimaT
@@ -246,6 +258,7 @@ def get_srs_table(engine=None):
 
 
 # %% Create sitetypes dictionary
+@instrumented('query')
 def get_vdatum_table(engine=None):
     """
         Create vertical datum dictionary to be displayed in Hydro-ClimaT
@@ -266,6 +279,7 @@ def get_vdatum_table(engine=None):
 
 
 # %% Create topic category dictionary
+@instrumented('query')
 def get_topicCategory_table(engine=None):
     """
         Create topic category dictionary to be displayed in Hydro-ClimaT
@@ -281,6 +295,7 @@ def get_topicCategory_table(engine=None):
 
 
 # %% Create variable name dictionary
+@instrumented('query')
 def get_varName_table(engine=None):
     """
         Create variable name dictionary to be displayed in Hydro-ClimaT
@@ -296,6 +311,7 @@ def get_varName_table(engine=None):
 
 
 # %% Create speciation name dictionary
+@instrumented('query')
 def get_speciation_table(engine=None):
     """
         Create variable name dictionary to be displayed in Hydro-ClimaT
@@ -311,6 +327,7 @@ def get_speciation_table(engine=None):
 
 
 # %% Create units name dictionary
+@instrumented('query')
 def get_units_table(engine=None):
     """
         Create units name dictionary to be displayed in Hydro-ClimaT
@@ -328,6 +345,7 @@ def get_units_table(engine=None):
 
 
 # %% Create sample medium dictionary
+@instrumented('query')
 def get_sampleMedium_table(engine=None):
     """
         Create sample medium dictionary to be displayed in Hydro-ClimaT
@@ -343,6 +361,7 @@ def get_sampleMedium_table(engine=None):
 
 
 # %% Create value type dictionary
+@instrumented('query')
 def get_valueType_table(engine=None):
     """
         Create value type dictionary to be displayed in Hydro-ClimaT
@@ -358,6 +377,7 @@ def get_valueType_table(engine=None):
 
 
 # %% Create data type dictionary
+@instrumented('query')
 def get_dataType_table(engine=None):
     """
         Create data type dictionary to be displayed in Hydro-ClimaT
@@ -373,6 +393,7 @@ def get_dataType_table(engine=None):
 
 
 # %% Create category type dictionary
+@instrumented('query')
 def get_category_table(engine=None):
     """
         Create general category dictionary to be displayed in Hydro-ClimaT
@@ -388,6 +409,7 @@ def get_category_table(engine=None):
 
 
 # %% Create censor code dictionary
+@instrumented('query')
 def get_censor_table(engine=None):
     """
         Create censor code dictionary to be displayed in Hydro-ClimaT
@@ -405,6 +427,7 @@ def get_censor_table(engine=None):
 
 
 # %% get sites series information
+@instrumented('query')
 def sitesQuery(site_id, engine=None):
     """
         Create sites information query to display in HydroClimaT
@@ -470,8 +493,97 @@ def sitesQuery(site_id, engine=None):
             'qualitiesDescription': qualitiesDescription}
 
 
+# %% get series catalog of a set of sites (region)
+@instrumented('query')
+def regionSeriesQuery(site_ids, variable_id, engine=None):
+    """
+        Get all series of a variable measured in a set of sites with a single catalog query
+        [[Source, Variable, Method, Quality, [Code, Name]], ...] (workspace identifiers)
+    """
+    identifiers = []
+
+    if engine and len(site_ids):
+        session = startDBSession(engine)
+        siteIds = [int(i) for i in site_ids]
+        variableId = int(variable_id)
+
+        # distinct series [site, source, method, quality] with data-values for the variable
+        catalog = session.query(DataValues.SiteId, DataValues.SourceId, DataValues.MethodId,
+                                DataValues.QualityControlLevelId).filter(and_(
+                DataValues.SiteId.in_(siteIds), DataValues.VariableId == variableId)).group_by(
+                DataValues.SiteId, DataValues.SourceId, DataValues.MethodId,
+                DataValues.QualityControlLevelId).all()
+
+        if not catalog:
+            return identifiers
+
+        # related names [one query per table]
+        sitesName = dict(session.query(Sites.SiteId, Sites.SiteName).filter(
+                Sites.SiteId.in_({i[0] for i in catalog})).all())
+        sourcesName = dict(session.query(Sources.SourceId, Sources.Organization).filter(
+                Sources.SourceId.in_({i[1] for i in catalog})).all())
+        methodsName = dict(session.query(Methods.MethodId, Methods.MethodDescription).filter(
+                Methods.MethodId.in_({i[2] for i in catalog})).all())
+        qualitiesName = dict(session.query(QualityControlLevels.QualityControlLevelId,
+                                           QualityControlLevels.Definition).filter(
+                QualityControlLevels.QualityControlLevelId.in_({i[3] for i in catalog})).all())
+        variable = session.query(Variables.VariableName, Variables.DataType, Units.UnitsName).filter(and_(
+                Variables.VariableId == variableId, Units.UnitsId == Variables.TimeUnitsId)).one()
+        variableName = '%s - %s (%s)' % (variable[0], variable[1], variable[2])
+
+        for siteId, sourceId, methodId, qualityId in catalog:
+            identifiers.append(['[%02d] %s' % (sourceId, sourcesName[sourceId]),
+                                '[%02d] %s' % (variableId, variableName),
+                                '[%02d] %s' % (methodId, methodsName[methodId]),
+                                '[%02d] %s' % (qualityId, qualitiesName[qualityId]),
+                                [str(siteId), sitesName.get(siteId, '')]])
+
+    return identifiers
+
+
+# %% get time-series of a set of series (region) with a single query
+@instrumented('query')
+def regionTimeSeriesQuery(search_parameters_list, engine=None):
+    """
+        Get multiple time-series from database with one set-based query
+        [pandas time-series, ...] in the same order as search_parameters_list
+    """
+    timeseries = [None] * len(search_parameters_list)
+
+    if engine and len(search_parameters_list):
+        session = startDBSession(engine)
+
+        # series keys [site, variable, method, quality, source]
+        keys = [(int(i[4][0]), int(i[1][1:3]), int(i[2][1:3]), int(i[3][1:3]), int(i[0][1:3]))
+                for i in search_parameters_list]
+        keyColumns = (DataValues.SiteId, DataValues.VariableId, DataValues.MethodId,
+                      DataValues.QualityControlLevelId, DataValues.SourceId)
+
+        query = session.query(*(keyColumns + (DataValues.LocalDateTime, DataValues.DataValue))).filter(
+                tuple_(*keyColumns).in_(set(keys))).all()
+
+        # temporal resolution of each variable
+        tempRes = dict(session.query(Variables.VariableId, Variables.TimeUnitsId).filter(
+                Variables.VariableId.in_({i[1] for i in keys})).all())
+
+        # split rows by series
+        dates = {}
+        data = {}
+        for row in query:
+            key = tuple(row[:5])
+            dates.setdefault(key, []).append(row[5])
+            data.setdefault(key, []).append(row[6])
+
+        for n, key in enumerate(keys):
+            if key in dates:
+                timeseries[n] = buildTimeSeries(dates[key], data[key], tempRes[key[1]])
+
+    return timeseries
+
+
 # %% get time-series series
 # noinspection PyUnresolvedReferences
+@instrumented('query')
 def timeSeriesQuery(search_parameters, engine=None):
     """
         Get time-series from database
@@ -479,9 +591,25 @@ def timeSeriesQuery(search_parameters, engine=None):
     """
     pd_timeseries = None
 
-    import pandas as pd
-    import numpy as np
-    import calendar
+    if engine:
+        valueIds, dates, data, tempRes = timeSeriesValuesQuery(search_parameters, engine)
+        pd_timeseries = buildTimeSeries(dates, data, tempRes)
+
+    return pd_timeseries
+
+
+# %% get time-series raw values
+# noinspection PyUnresolvedReferences
+@instrumented('query')
+def timeSeriesValuesQuery(search_parameters, engine=None, min_value_id=None):
+    """
+        Get time-series raw values from database, only rows with ValueId > min_value_id if given
+        [ValueId, Date, Data-value, Time units id]
+    """
+    valueIds = []
+    dates = []
+    data = []
+    tempRes = None
 
     if engine:
         session = startDBSession(engine)
@@ -494,45 +622,96 @@ def timeSeriesQuery(search_parameters, engine=None):
         siteId = int(search_parameters[4][0])
 
         # relate variable, method, source and quality (text) to the identifiers
-        query = session.query(DataValues).filter(and_(
-                DataValues.SiteId == siteId, DataValues.VariableId == variableId,
-                DataValues.MethodId == methodId, DataValues.QualityControlLevelId == qualityId,
-                DataValues.SourceId == sourceId)).all()
-        data = [i.DataValue for i in query]
-        dates = [i.LocalDateTime for i in query]
+        conditions = [DataValues.SiteId == siteId, DataValues.VariableId == variableId,
+                      DataValues.MethodId == methodId, DataValues.QualityControlLevelId == qualityId,
+                      DataValues.SourceId == sourceId]
+        if min_value_id is not None:
+            conditions.append(DataValues.ValueId > int(min_value_id))
+
+        query = session.query(DataValues.ValueId, DataValues.LocalDateTime, DataValues.DataValue).filter(
+                and_(*conditions)).all()
+        valueIds = [i[0] for i in query]
+        dates = [i[1] for i in query]
+        data = [i[2] for i in query]
 
         # check temporal resolution of the timeseries
         tempRes = session.query(Variables).filter(Variables.VariableId == variableId).one()
         tempRes = tempRes.TimeUnitsId
 
-        # create pandas timeseries to flush data
-        start_date = np.min(dates)
-        end_date = np.max(dates)
-
-        start_date = pd.datetime(start_date.year, 1, 1)
-        end_date = pd.datetime(end_date.year, 12, 31)
-
-        if tempRes == 104:  # daily data
-            daterange = pd.date_range(start_date, end_date)     # date index
-            nan_vector = np.zeros([len(daterange)])               # empty vector
-            nan_vector[:] = np.nan                                # empty vector
-            pd_timeseries = pd.Series(nan_vector, daterange)      # empty timeseries
-
-            # flush data-values in pandas timeseries by date index
-            for m in range(0, len(data)):
-                datetime = pd.datetime(dates[m].year, dates[m].month, dates[m].day)
-                pd_timeseries[datetime] = data[m]
-
-        elif tempRes == 106:   # monthly data
-            daterange = pd.date_range(start_date, end_date, freq='M')   # date index
-            nan_vector = np.zeros([len(daterange)])                       # empty vector
-            nan_vector[:] = np.nan                                        # empty vector
-            pd_timeseries = pd.Series(nan_vector, daterange)              # empty timeseries
-
-            # flush datavalues in pandas timeseries by date index
-            for m in range(0, len(data)):
-                last_day = calendar.monthrange(dates[m].year, dates[m].month)[1]
-                datetime = pd.datetime(dates[m].year, dates[m].month, last_day)
-                pd_timeseries[datetime] = data[m]
+    return valueIds, dates, data, tempRes
+
+
+# %% get time-series using the local series cache
+@instrumented('query')
+def cachedTimeSeriesQuery(search_parameters, engine=None, cache=None):
+    """
+        Get time-series from the local cache (SeriesCache), pulling from database only the rows newer
+        than the cached watermark (max ValueId). Works offline (engine=None) with cached series
+        [Date, Data-value]
+    """
+    if cache is None:
+        return timeSeriesQuery(search_parameters, engine)
+
+    from SeriesCache import series_key
+
+    key = series_key(search_parameters)
+    tempRes = cache.timeUnits(key)
+
+    if engine:
+        valueIds, dates, data, tempRes = timeSeriesValuesQuery(search_parameters, engine, cache.watermark(key))
+        if len(valueIds) or cache.watermark(key) is None:
+            cache.store(key, valueIds, dates, data, tempRes)
+
+    valueIds, dates, data = cache.load(key)
+    if not len(valueIds):
+        return None
+
+    return buildTimeSeries(dates.astype(object), data, tempRes)
+
+
+# %% flush data-values into a pandas time-series
+def buildTimeSeries(dates, data, temp_res):
+    """
+        Create pandas time-series (complete years) from dates and data-values
+        temp_res: time units id [104: daily, 106: monthly]
+    """
+    pd_timeseries = None
+
+    import pandas as pd
+    import numpy as np
+    import calendar
+
+    if len(dates) == 0:
+        return pd_timeseries
+
+    # create pandas timeseries to flush data
+    start_date = np.min(dates)
+    end_date = np.max(dates)
+
+    start_date = pd.Timestamp(start_date.year, 1, 1)
+    end_date = pd.Timestamp(end_date.year, 12, 31)
+
+    if temp_res == 104:  # daily data
+        daterange = pd.date_range(start_date, end_date)     # date index
+        nan_vector = np.zeros([len(daterange)])               # empty vector
+        nan_vector[:] = np.nan                                # empty vector
+        pd_timeseries = pd.Series(nan_vector, daterange)      # empty timeseries
+
+        # flush data-values in pandas timeseries by date index
+        for m in range(0, len(data)):
+            datetime = pd.Timestamp(dates[m].year, dates[m].month, dates[m].day)
+            pd_timeseries[datetime] = data[m]
+
+    elif temp_res == 106:   # monthly data
+        daterange = pd.date_range(start_date, end_date, freq='M')   # date index
+        nan_vector = np.zeros([len(daterange)])                       # empty vector
+        nan_vector[:] = np.nan                                        # empty vector
+        pd_timeseries = pd.Series(nan_vector, daterange)              # empty timeseries
+
+        # flush datavalues in pandas timeseries by date index
+        for m in range(0, len(data)):
+            last_day = calendar.monthrange(dates[m].year, dates[m].month)[1]
+            datetime = pd.Timestamp(dates[m].year, dates[m].month, last_day)
+            pd_timeseries[datetime] = data[m]
 
     return pd_timeseries
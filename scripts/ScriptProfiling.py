@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Shared --profile option of the command line scripts (CvLoad, Odm2ColStructure, Odm2ColBaseData,
+      ImportITimeSeriesIDEAM)
+        - cProfile stats of each phase written to {profile folder}/{script}-{NN}-{phase}.prof (snakeviz,
+          pstats)
+        - Optional tracemalloc peak memory of each phase (--trace-memory)
+        - Phase summary (time, peak memory, stats file) printed at the end
+    + Phases are plain functions called from main(), so sampling profilers (py-spy record -- python
+      CvLoad.py ...) show them as separate frames
+
+Usage:
+    parser = MyParser(...)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler = PhaseProfiler.from_args('CvLoad', args)
+    with profiler.phase('fetch'):
+        ...
+    profiler.report()
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import os
+import re
+import time
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from Instrumentation import span
+
+
+# %% Command line options
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', help="Write cProfile stats of each phase (.prof files) to this folder",
+                        default=None, metavar='FOLDER')
+    parser.add_argument('--trace-memory', help="Report peak memory of each phase (tracemalloc, slower)",
+                        action="store_true", dest='trace_memory')
+    return parser
+
+
+# %% Phase profiler
+class PhaseProfiler(object):
+    """
+    Time (and optionally cProfile and tracemalloc) the phases of a script
+        script: prefix of the stats files
+        folder: folder of the .prof files (None: no cProfile)
+        trace_memory: peak memory of each phase
+    """
+    def __init__(self, script, folder=None, trace_memory=False):
+        self.script = script
+        self.folder = folder
+        self.traceMemory = trace_memory
+        self.phases = []                    # [(phase, seconds, peak bytes or None, stats file or None), ...]
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    @classmethod
+    def from_args(cls, script, args):
+        return cls(script, getattr(args, 'profile', None), getattr(args, 'trace_memory', False))
+
+    @contextmanager
+    def phase(self, name):
+        """
+            Profile the enclosed block as phase 'name'
+        """
+        statsPath = None
+        profile = None
+        if self.folder:
+            fileName = '%s-%02d-%s.prof' % (self.script, len(self.phases) + 1, re.sub(r'\W+', '_', name))
+            statsPath = os.path.join(self.folder, fileName)
+            profile = cProfile.Profile()
+
+        started = self.traceMemory and not tracemalloc.is_tracing()
+        if self.traceMemory:
+            if started:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            with span('%s.%s' % (self.script, name)):
+                if profile is not None:
+                    profile.enable()
+                try:
+                    yield
+                finally:
+                    if profile is not None:
+                        profile.disable()
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if self.traceMemory:
+                peak = tracemalloc.get_traced_memory()[1]
+                if started:
+                    tracemalloc.stop()
+            if profile is not None:
+                profile.dump_stats(statsPath)
+            self.phases.append((name, seconds, peak, statsPath))
+
+    def report(self):
+        """
+            Print the phase summary [phase, time, peak memory, stats file]
+        """
+        if not self.phases:
+            return
+        print('\n%-25s %10s %12s  %s' % ('Phase', 'Time (s)', 'Peak (MB)', 'Stats'))
+        for name, seconds, peak, statsPath in self.phases:
+            print('%-25s %10.2f %12s  %s' % (name[:25], seconds, '-' if peak is None else '%.1f' % (peak / 1e6),
+                                             statsPath or '-'))
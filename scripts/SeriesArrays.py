@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Stack multiple station series into a single calendar matrix (days x stations)
+        - Daily matrix of float64 values (NaN for missing days)
+        - Calendar helpers (year, month and day of each row, period boundaries)
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import numpy as np
+
+
+# %% Stack daily series
+def stack_daily(series_dict):
+    """
+        Stack daily pandas series {code: series} into a calendar matrix covering all series
+        [codes, dates (datetime64[D]), values (float64 matrix days x stations, NaN for missing days)]
+    """
+    codes = [str(i) for i in series_dict]
+    series = [series_dict[i] for i in series_dict]
+
+    # series dates as day numbers [repeated days keep the last value]
+    days = [np.asarray(s.index.values, dtype='datetime64[D]') for s in series]
+    nonEmpty = [d for d in days if len(d)]
+    if not nonEmpty:
+        return codes, np.array([], dtype='datetime64[D]'), np.empty((0, len(codes)))
+
+    first = min(d.min() for d in nonEmpty)
+    last = max(d.max() for d in nonEmpty)
+    dates = np.arange(first, last + 1, dtype='datetime64[D]')
+
+    values = np.full((len(dates), len(codes)), np.nan)
+    for col, (d, s) in enumerate(zip(days, series)):
+        values[(d - first).astype(np.int64), col] = np.asarray(s.values, dtype=np.float64)
+
+    return codes, dates, values
+
+
+# %% Check daily series
+def is_daily(series):
+    """
+        True if the most common time step of a series is one day
+    """
+    if series is None or len(series) < 2:
+        return False
+    steps = np.diff(np.asarray(series.index.values, dtype='datetime64[D]')).astype(np.int64)
+    return np.median(steps) == 1
+
+
+# %% Calendar of a daily date vector
+def calendar(dates):
+    """
+        Year, month and day of month of datetime64[D] dates
+    """
+    years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    months = dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    days = (dates - dates.astype('datetime64[M]')).astype(np.int64) + 1
+    return years, months, days
+
+
+def period_starts(keys):
+    """
+        Row index where each period starts in a sorted key vector (e.g. year*12 + month)
+    """
+    if not len(keys):
+        return np.array([], dtype=np.int64)
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
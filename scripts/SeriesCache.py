@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Local time-series cache (SQLite file stored next to the project file)
+        - Store series fetched from the database (ValueId, LocalDateTime, DataValue)
+        - Keep database watermark (max ValueId) for each series
+        - Reopen series from disk and pull only rows newer than the watermark
+    + Used by the main-window through HydroClimate.querySeries (SQLAlchemyQueries.cachedTimeSeriesQuery);
+      inactive until the workspace tree (HomeWidget) is enabled again, since series display
+      (getTimeSeries) and the tree signals are still disabled in the main-window
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import os
+import sqlite3
+import numpy as np
+
+
+# %% Cache file path for a project file
+def cache_path(project_file):
+    """
+        Cache file associated to a project file: /path/project.hct -> /path/project.hcache
+    """
+    return os.path.splitext(project_file)[0] + '.hcache'
+
+
+# %% Series key from workspace search parameters
+def series_key(search_parameters):
+    """
+        Unique key of a workspace time-series
+        search_parameters: [source, variable, method, quality, [code, name], ...]
+    """
+    return '|'.join([str(i) for i in search_parameters[:4]] + [str(search_parameters[4][0])])
+
+
+# %% Local series cache
+class SeriesCache(object):
+    """
+    SQLite cache of database time-series:
+        series: key, watermark (max ValueId fetched), time units id
+        datavalues: key, ValueId, LocalDateTime (seconds since epoch), DataValue
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS series (key TEXT PRIMARY KEY, watermark INTEGER, '
+                          'timeunits INTEGER)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS datavalues (key TEXT NOT NULL, valueid INTEGER NOT NULL, '
+                          'localdatetime INTEGER NOT NULL, datavalue REAL, PRIMARY KEY (key, valueid))')
+        self.conn.commit()
+
+    def watermark(self, key):
+        """
+            Max ValueId stored for the series (None if the series is not cached)
+        """
+        row = self.conn.execute('SELECT watermark FROM series WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def timeUnits(self, key):
+        """
+            Time units id of the cached series (104: day, 106: month)
+        """
+        row = self.conn.execute('SELECT timeunits FROM series WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def store(self, key, value_ids, dates, values, time_units):
+        """
+            Add (or replace) series rows and move the watermark to the newest ValueId
+        """
+        value_ids = np.asarray(value_ids, dtype=np.int64)
+        seconds = np.asarray(dates, dtype='datetime64[s]').astype(np.int64)
+        values = np.asarray(values, dtype=np.float64)
+
+        watermark = self.watermark(key)
+        if len(value_ids):
+            newest = int(value_ids.max())
+            watermark = newest if watermark is None else max(watermark, newest)
+
+        self.conn.executemany('INSERT OR REPLACE INTO datavalues (key, valueid, localdatetime, datavalue) '
+                              'VALUES (?, ?, ?, ?)',
+                              zip([key] * len(value_ids), value_ids.tolist(), seconds.tolist(), values.tolist()))
+        self.conn.execute('INSERT OR REPLACE INTO series (key, watermark, timeunits) VALUES (?, ?, ?)',
+                          (key, watermark, time_units))
+        self.conn.commit()
+
+    def load(self, key):
+        """
+            Cached series ordered by date: (ValueId, LocalDateTime, DataValue) numpy arrays
+        """
+        rows = self.conn.execute('SELECT valueid, localdatetime, datavalue FROM datavalues WHERE key = ? '
+                                 'ORDER BY localdatetime', (key,)).fetchall()
+        if not rows:
+            return (np.array([], dtype=np.int64), np.array([], dtype='datetime64[s]'),
+                    np.array([], dtype=np.float64))
+
+        value_ids, seconds, values = zip(*rows)
+        return (np.array(value_ids, dtype=np.int64), np.array(seconds, dtype=np.int64).astype('datetime64[s]'),
+                np.array(values, dtype=np.float64))
+
+    def remove(self, key):
+        """
+            Delete a series from the cache
+        """
+        self.conn.execute('DELETE FROM datavalues WHERE key = ?', (key,))
+        self.conn.execute('DELETE FROM series WHERE key = ?', (key,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Spatial queries of sites (stations)
+        - Sites within a bounding box
+        - Sites within a radius (km) of a point
+        - Nearest k sites to a point
+    + In-memory grid index of the sites coordinates (sites table of the GUI)
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+
+
+# %% Great circle distance
+def haversine_km(lon1, lat1, lon2, lat2):
+    """
+        Great circle distance (km) between points given in decimal degrees (numpy broadcasting)
+    """
+    lon1, lat1, lon2, lat2 = [np.radians(i) for i in (lon1, lat1, lon2, lat2)]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def radius_box(lon, lat, radius_km):
+    """
+        Bounding box [min_lon, min_lat, max_lon, max_lat] containing a circle of radius_km
+    """
+    dLat = radius_km / KM_PER_DEGREE
+    cosLat = np.cos(np.radians(min(abs(lat) + dLat, 89.9)))
+    dLon = min(radius_km / (KM_PER_DEGREE * cosLat), 180.)
+    return lon - dLon, lat - dLat, lon + dLon, lat + dLat
+
+
+# %% In-memory grid index
+class SitesGridIndex(object):
+    """
+    Regular grid index of sites coordinates:
+        site_ids: sites identifiers (codes)
+        lons, lats: decimal degrees
+        cell_size: grid cell size in degrees
+    Queries return site identifiers, nearest queries also return distances (km)
+    """
+    def __init__(self, site_ids, lons, lats, cell_size=0.5):
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        valid = ~(np.isnan(lons) | np.isnan(lats))        # sites without coordinates are not indexed
+
+        self.siteIds = np.asarray(site_ids, dtype=object)[valid]
+        self.lons = lons[valid]
+        self.lats = lats[valid]
+        self.cellSize = float(cell_size)
+
+        # sites positions sorted by cell; each cell points to a slice of the sorted positions
+        cols = np.floor(self.lons / self.cellSize).astype(np.int64)
+        rows = np.floor(self.lats / self.cellSize).astype(np.int64)
+        self.order = np.lexsort((rows, cols))
+        cells = np.stack((cols[self.order], rows[self.order]), axis=1)
+
+        self.cells = {}
+        if len(cells):
+            starts = np.flatnonzero(np.r_[True, np.any(cells[1:] != cells[:-1], axis=1)])
+            ends = np.r_[starts[1:], len(cells)]
+            for start, end in zip(starts, ends):
+                self.cells[(int(cells[start, 0]), int(cells[start, 1]))] = (start, end)
+
+    def __len__(self):
+        return len(self.siteIds)
+
+    def _candidates(self, min_lon, min_lat, max_lon, max_lat):
+        """
+            Positions of sites in the cells overlapping a bounding box
+        """
+        col0, col1 = int(np.floor(min_lon / self.cellSize)), int(np.floor(max_lon / self.cellSize))
+        row0, row1 = int(np.floor(min_lat / self.cellSize)), int(np.floor(max_lat / self.cellSize))
+
+        # scan the smaller of the box cells and the occupied cells
+        if (col1 - col0 + 1) * (row1 - row0 + 1) > len(self.cells):
+            slices = [v for (c, r), v in self.cells.items() if col0 <= c <= col1 and row0 <= r <= row1]
+        else:
+            slices = [self.cells[(c, r)] for c in range(col0, col1 + 1) for r in range(row0, row1 + 1)
+                      if (c, r) in self.cells]
+
+        if not slices:
+            return np.array([], dtype=np.int64)
+        return np.concatenate([self.order[start:end] for start, end in slices])
+
+    def withinBox(self, min_lon, min_lat, max_lon, max_lat):
+        """
+            Sites inside bounding box [min_lon, min_lat, max_lon, max_lat]
+        """
+        pos = self._candidates(min_lon, min_lat, max_lon, max_lat)
+        pos = pos[(self.lons[pos] >= min_lon) & (self.lons[pos] <= max_lon) &
+                  (self.lats[pos] >= min_lat) & (self.lats[pos] <= max_lat)]
+        return list(self.siteIds[np.sort(pos)])
+
+    def _withinRadius(self, lon, lat, radius_km):
+        pos = self._candidates(*radius_box(lon, lat, radius_km))
+        dist = haversine_km(lon, lat, self.lons[pos], self.lats[pos])
+        inside = dist <= radius_km
+        return pos[inside], dist[inside]
+
+    def withinRadius(self, lon, lat, radius_km):
+        """
+            Sites within radius_km of a point, sorted by distance: [(site, distance km), ...]
+        """
+        pos, dist = self._withinRadius(lon, lat, radius_km)
+        order = np.argsort(dist, kind='stable')
+        return [(self.siteIds[i], float(d)) for i, d in zip(pos[order], dist[order])]
+
+    def nearest(self, lon, lat, k=1):
+        """
+            Nearest k sites to a point, sorted by distance: [(site, distance km), ...]
+        """
+        k = min(int(k), len(self))
+        if k <= 0:
+            return []
+
+        # grow search box until it holds k sites, the k-th distance bounds the exact radius search
+        half = self.cellSize
+        while True:
+            pos = self._candidates(lon - half, lat - half, lon + half, lat + half)
+            if len(pos) >= k or half >= 360:
+                break
+            half *= 2
+
+        dist = haversine_km(lon, lat, self.lons[pos], self.lats[pos])
+        radius = np.partition(dist, k - 1)[k - 1]
+        return self.withinRadius(lon, lat, radius)[:k]
+
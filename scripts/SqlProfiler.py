@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Opt-in SQL statement profiler (SQLAlchemy before/after_cursor_execute events of every engine)
+        - Statements and execution time per logical operation (outermost active span of Instrumentation,
+          e.g. 'query.sitesQuery' or a GUI action wrapped in operation('gui.query_site'))
+        - Statement shapes (literals, parameters and IN/VALUES lists collapsed) to flag N+1 patterns: the
+          same shape executed more than repeat_threshold times in a single call of an operation
+        - Slow-query log (statements slower than slow_ms, with operation and parameters)
+    + Enabled with the environment variable HYDROCLIMAT_SQL_PROFILE=/path/to/slow_queries.log (threshold in
+      HYDROCLIMAT_SQL_SLOW_MS) or with the SQL profile toggle of the GUI
+
+Usage:
+    import SqlProfiler
+    profiler = SqlProfiler.enable('slow_queries.log', slow_ms=50)
+    with SqlProfiler.operation('load sites'):
+        ...
+    print(profiler.report())
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import os
+import re
+import time
+import atexit
+import functools
+import threading
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from Instrumentation import span, active_spans, count
+
+PROFILE_ENV = 'HYDROCLIMAT_SQL_PROFILE'
+SLOW_MS_ENV = 'HYDROCLIMAT_SQL_SLOW_MS'
+UNSCOPED = '<no operation>'
+
+operation = span        # logical operation: statements inside are grouped under its name
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b')
+_PARAMETERS = re.compile(r'%\(\w+\)s|%s|:\w+|\$\d+|\?')
+_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*')
+
+
+# %% Statement shapes
+@functools.lru_cache(maxsize=4096)
+def statement_shape(statement):
+    """
+        Normalized statement: literals and parameters replaced by ?, lists of values collapsed to (?...)
+    """
+    shape = _STRINGS.sub('?', statement)
+    shape = _PARAMETERS.sub('?', shape)
+    shape = _NUMBERS.sub('?', shape)
+    shape = _LISTS.sub('(?...)', shape)
+    return ' '.join(shape.split())
+
+
+# %% Profiler
+class OperationStats(object):
+    """
+    Statements of a logical operation: calls, statements, time and statistics of each statement shape
+    [count, seconds, max count in a single call]
+    """
+    def __init__(self):
+        self.calls = 0
+        self.statements = 0
+        self.seconds = 0.
+        self.shapes = {}
+        self.serial = None
+        self.callCounts = {}
+
+    def add(self, serial, shape, seconds):
+        if serial is None or serial != self.serial:     # statements outside operations are single calls
+            self.serial = serial
+            self.calls += 1
+            self.callCounts = {}
+        self.statements += 1
+        self.seconds += seconds
+        n = self.callCounts[shape] = self.callCounts.get(shape, 0) + 1
+        stats = self.shapes.get(shape)
+        if stats is None:
+            stats = self.shapes[shape] = [0, 0., 0]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], n)
+
+
+class SqlProfiler(object):
+    """
+    Profiler attached to the cursor events of all engines (or a single engine)
+        log_path: slow-query log file (None: slow statements are only counted)
+        slow_ms: slow statement threshold (milliseconds)
+        repeat_threshold: executions of a statement shape in a single operation call flagged as N+1
+    """
+    def __init__(self, log_path=None, slow_ms=100., repeat_threshold=20, target=Engine):
+        self.logPath = log_path
+        self.slowSeconds = slow_ms / 1000.
+        self.repeatThreshold = repeat_threshold
+        self.target = target
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.slowStatements = 0
+        self.attached = False
+
+    def attach(self):
+        if not self.attached:
+            event.listen(self.target, 'before_cursor_execute', self.beforeExecute)
+            event.listen(self.target, 'after_cursor_execute', self.afterExecute)
+            self.attached = True
+        return self
+
+    def detach(self):
+        if self.attached:
+            event.remove(self.target, 'before_cursor_execute', self.beforeExecute)
+            event.remove(self.target, 'after_cursor_execute', self.afterExecute)
+            self.attached = False
+        return self
+
+    def reset(self):
+        with self.lock:
+            self.operations.clear()
+            self.slowStatements = 0
+
+    # noinspection PyUnusedLocal
+    def beforeExecute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiler_start', []).append(time.perf_counter())
+
+    # noinspection PyUnusedLocal
+    def afterExecute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('profiler_start')
+        if not starts:
+            return
+        seconds = time.perf_counter() - starts.pop()
+
+        spans = active_spans()
+        name, serial = spans[0] if spans else (UNSCOPED, None)
+        shape = statement_shape(statement)
+        with self.lock:
+            stats = self.operations.get(name)
+            if stats is None:
+                stats = self.operations[name] = OperationStats()
+            stats.add(serial, shape, seconds)
+            slow = seconds >= self.slowSeconds
+            if slow:
+                self.slowStatements += 1
+        count('sql.statements')
+
+        if slow and self.logPath:
+            self.logSlow(name, seconds, statement, parameters, executemany)
+
+    def logSlow(self, name, seconds, statement, parameters, executemany):
+        params = repr(parameters)
+        if len(params) > 500:
+            params = params[:500] + '...'
+        with self.lock, open(self.logPath, 'a') as f:
+            f.write('%s\t%.1f ms\t%s%s\n\t%s\n\tparameters: %s\n' %
+                    (time.strftime('%Y-%m-%d %H:%M:%S'), seconds * 1000, name, ' [executemany]' if executemany else '',
+                     ' '.join(statement.split()), params))
+
+    def repeatedStatements(self):
+        """
+            N+1 patterns [(operation, shape, max executions in a single call, total executions), ...]
+        """
+        with self.lock:
+            return sorted([(name, shape, stats[2], stats[0]) for name, op in self.operations.items()
+                           for shape, stats in op.shapes.items() if stats[2] > self.repeatThreshold],
+                          key=lambda i: -i[2])
+
+    def summary(self):
+        """
+            Statements per operation [(operation, calls, statements, statements per call, ms), ...] by time
+        """
+        with self.lock:
+            rows = [(name, op.calls, op.statements, op.statements / max(op.calls, 1), op.seconds * 1000)
+                    for name, op in self.operations.items()]
+        return sorted(rows, key=lambda i: -i[4])
+
+    def report(self):
+        lines = ['%-45s %8s %10s %10s %12s' % ('Operation', 'Calls', 'Statements', 'Per call', 'Time (ms)')]
+        for name, calls, statements, perCall, ms in self.summary():
+            lines.append('%-45s %8d %10d %10.1f %12.1f' % (name[:45], calls, statements, perCall, ms))
+        lines.append('Slow statements (>= %.0f ms): %d' % (self.slowSeconds * 1000, self.slowStatements))
+
+        repeated = self.repeatedStatements()
+        if repeated:
+            lines.append('')
+            lines.append('Possible N+1 patterns (same statement > %d times in one call):' % self.repeatThreshold)
+            for name, shape, maxCall, total in repeated:
+                lines.append('  %s: %d per call (%d total)\n    %s' % (name, maxCall, total, shape[:300]))
+        return '\n'.join(lines)
+
+
+# %% Global profiler
+PROFILER = None
+
+
+def enable(log_path=None, slow_ms=100., repeat_threshold=20):
+    """
+        Start profiling statements of all engines (a running profiler is replaced)
+    """
+    global PROFILER
+    disable()
+    PROFILER = SqlProfiler(log_path, slow_ms, repeat_threshold).attach()
+    return PROFILER
+
+
+def disable():
+    """
+        Stop profiling; stopped profiler or None
+    """
+    global PROFILER
+    profiler, PROFILER = PROFILER, None
+    if profiler is not None:
+        profiler.detach()
+    return profiler
+
+
+def _report_at_exit():
+    if PROFILER is not None and PROFILER.logPath:
+        try:
+            with open(PROFILER.logPath, 'a') as f:
+                f.write('\n%s\n' % PROFILER.report())
+        except OSError:
+            pass
+
+
+if os.environ.get(PROFILE_ENV):
+    enable(os.environ[PROFILE_ENV], float(os.environ.get(SLOW_MS_ENV, 100.)))
+    atexit.register(_report_at_exit)
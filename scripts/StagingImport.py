@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Staged import of IDEAM daily files into DataValues (PostgreSQL)
+        - Raw values (station code, IDEAM variable, value kind, station type) copied into an UNLOGGED staging
+          table of the import (COPY, no constraints or foreign keys; dropped after the merge, so concurrent
+          imports do not share it)
+        - Single set-based merge: INSERT ... SELECT ... ON CONFLICT DO NOTHING resolving sites, variables and
+          methods with joins (no Python lookup loops), duplicates skipped by the series-time unique index
+        - Report of staged, merged and duplicated values and of unresolved codes
+    + COPY through psycopg2 (one connection) or the asyncpg backend (several connections, AsyncLoader)
+    + Unique series-time index of DataValues created once per database (ensure_merge_index), with a report of
+      the duplicated values that prevent it
+
+Sites are matched by SiteId (the importer convention) or by SiteCode; variables by name and data type
+(Average or Cumulative for daily values, Maximum and Minimum for monthly extremes); methods by the station type
+at the end of their description.
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import io
+import csv
+import uuid
+import numpy as np
+from sqlalchemy import inspect, text
+from Instrumentation import instrumented, count, span
+from IdeamResolver import VARIABLE_NAMES
+from IdeamReader import block_dates, block_times, daily_values, month_starts, time_strings, iter_ideam_archive
+
+STAGING_TABLE = 'DataValuesStaging'
+STAGING_COLUMNS = ['SiteCode', 'IdeamVariable', 'ValueKind', 'StationType', 'DataValue', 'LocalDateTime',
+                   'UTCOffset', 'DateTimeUTC', 'QualifierId']
+MERGE_KEY = ['SiteId', 'VariableId', 'MethodId', 'SourceId', 'QualityControlLevelId', 'LocalDateTime']
+MERGE_INDEX = 'DataValues_series_time_uidx'
+
+CREATE_STAGING = '''
+CREATE UNLOGGED TABLE "{table}" (
+    "SiteCode" varchar(50) NOT NULL,
+    "IdeamVariable" varchar(50) NOT NULL,
+    "ValueKind" varchar(20) NOT NULL,
+    "StationType" varchar(2) NOT NULL,
+    "DataValue" double precision NOT NULL,
+    "LocalDateTime" timestamp NOT NULL,
+    "UTCOffset" double precision NOT NULL,
+    "DateTimeUTC" timestamp NOT NULL,
+    "QualifierId" integer NOT NULL)
+'''
+
+MERGE = '''
+WITH variable_names ("IdeamVariable", "VariableName") AS (VALUES {names}),
+site_codes AS (
+    SELECT DISTINCT ON (code) code, "SiteId"
+    FROM (SELECT "SiteId"::text AS code, "SiteId", 0 AS priority FROM "Sites"
+          UNION ALL
+          SELECT trim("SiteCode"), "SiteId", 1 FROM "Sites") codes
+    ORDER BY code, priority, "SiteId"),
+variable_ids AS (
+    SELECT "VariableName",
+           CASE WHEN "DataType" IN ('Average', 'Cumulative') THEN 'Average' ELSE "DataType" END AS "ValueKind",
+           min("VariableId") AS "VariableId"
+    FROM "Variables" GROUP BY 1, 2),
+method_ids AS (
+    SELECT right("MethodDescription", 2) AS "StationType", min("MethodId") AS "MethodId"
+    FROM "Methods" GROUP BY 1),
+resolved AS (
+    SELECT st."DataValue", st."LocalDateTime", st."UTCOffset", st."DateTimeUTC", s."SiteId", v."VariableId",
+           st."QualifierId", m."MethodId"
+    FROM "{table}" st
+    JOIN site_codes s ON s.code = st."SiteCode"
+    JOIN variable_names n ON n."IdeamVariable" = st."IdeamVariable"
+    JOIN variable_ids v ON v."VariableName" = n."VariableName" AND v."ValueKind" = st."ValueKind"
+    JOIN method_ids m ON m."StationType" = st."StationType"),
+merged AS (
+    INSERT INTO "DataValues" ("DataValue", "LocalDateTime", "UTCOffset", "DateTimeUTC", "SiteId", "VariableId",
+                              "QualifierId", "MethodId", "SourceId", "QualityControlLevelId", "CensorCode")
+    SELECT "DataValue", "LocalDateTime", "UTCOffset", "DateTimeUTC", "SiteId", "VariableId", "QualifierId",
+           "MethodId", :source_id, :quality_id, :censor_term
+    FROM resolved
+    ON CONFLICT ({key}) DO NOTHING
+    RETURNING 1)
+SELECT (SELECT count(*) FROM "{table}"), (SELECT count(*) FROM resolved), (SELECT count(*) FROM merged)
+'''
+
+METHOD_IDS = '''
+SELECT right("MethodDescription", 2), min("MethodId") FROM "Methods" GROUP BY 1
+'''
+
+UNRESOLVED = '''
+SELECT DISTINCT st."SiteCode", st."IdeamVariable", st."StationType"
+FROM "{table}" st
+WHERE NOT EXISTS (SELECT 1 FROM "Sites" s WHERE s."SiteId"::text = st."SiteCode" OR trim(s."SiteCode") = st."SiteCode")
+   OR NOT EXISTS (SELECT 1 FROM "Methods" m WHERE right(m."MethodDescription", 2) = st."StationType")
+ORDER BY 1, 2
+'''
+
+DUPLICATES = '''
+SELECT count(*) OVER (), {key}, count(*)
+FROM "DataValues" GROUP BY {key} HAVING count(*) > 1
+ORDER BY count(*) DESC LIMIT 5
+'''
+
+
+# %% Staging records
+class StagingRecords(object):
+    """
+    Staging records of blocks (tuples in STAGING_COLUMNS order); no database lookups
+        text_times: timestamps as text (CSV COPY) instead of datetime objects (asyncpg COPY)
+    """
+    def __init__(self, utc_offset, text_times=True):
+        self.utcOffset = utc_offset
+        self.textTimes = text_times
+
+    def _records(self, block, kind, values, qualifiers, dates):
+        local, utc = block_times(dates, self.utcOffset)
+        if self.textTimes:
+            local, utc = time_strings(local), time_strings(utc)
+        n = len(values)
+        return list(zip([str(block.code)] * n, [block.variable] * n, [kind] * n, [block.station_type] * n,
+                        values.tolist(), local.tolist(), [self.utcOffset] * n, utc.tolist(),
+                        [int(i) or 1 for i in qualifiers.tolist()]))
+
+    def records(self, block):
+        days, months, dates = block_dates(block)
+        records = self._records(block, 'Average', block.values[days, months], block.flags[days, months], dates)
+        monthStarts = month_starts(block.year)
+        for kind, values, flags in (('Maximum', block.maxima, block.maxima_flags),
+                                    ('Minimum', block.minima, block.minima_flags)):
+            valid = ~np.isnan(values)
+            if valid.any():
+                records += self._records(block, kind, values[valid], flags[valid], monthStarts[valid])
+        return records
+
+
+def staging_batches(blocks, utc_offset, batch_rows=20000, qc_stage=None, qc_variables=None, text_times=True,
+                    qc_methods=None):
+    """
+        Lists of about batch_rows staging records of a block stream
+            qc_stage: QualityControl.QCStage collecting daily values keyed (code, variable id, method id), with
+            variable ids of the daily variables {IDEAM variable: id} (IDEAM variable name if missing) and method
+            ids of the station types {station type: id} (station type if missing)
+    """
+    builder = StagingRecords(utc_offset, text_times)
+    qc_variables = qc_variables or {}
+    qc_methods = qc_methods or {}
+    batch = []
+    for block in blocks:
+        batch.extend(builder.records(block))
+        if qc_stage is not None:
+            qc_stage.add_many((block.code, qc_variables.get(block.variable, block.variable),
+                               qc_methods.get(block.station_type, block.station_type)), *daily_values(block))
+        if len(batch) >= batch_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def daily_variable_ids(resolver):
+    """
+        Daily (average or cumulative) variable id of each IDEAM variable known to an IdeamResolver
+    """
+    ids = {ideam: resolver.variable_series(ideam)[0] for ideam in VARIABLE_NAMES}
+    return {ideam: i for ideam, i in ids.items() if i is not None}
+
+
+def merge_method_ids(engine):
+    """
+        MethodId of each station type as resolved by the merge (lowest id of the methods ending in the type)
+    """
+    with engine.connect() as conn:
+        return dict(conn.execute(text(METHOD_IDS)).fetchall())
+
+
+# %% Merge index
+def _key_columns():
+    return ', '.join('"%s"' % i for i in MERGE_KEY)
+
+
+def ensure_merge_index(engine):
+    """
+        Create the unique series-time index of DataValues used by the merge (once per database, skipped if it
+        exists); ValueError reporting the duplicated values that prevent it
+        [True if the index was created]
+    """
+    if MERGE_INDEX in [i['name'] for i in inspect(engine).get_indexes('DataValues')]:
+        return False
+
+    with engine.begin() as conn:
+        duplicates = conn.execute(text(DUPLICATES.format(key=_key_columns()))).fetchall()
+        if duplicates:
+            lines = ['DataValues has %d duplicated series-time keys (%s), remove them to create the unique index '
+                     '%s used by the staged import:' % (duplicates[0][0], ', '.join(MERGE_KEY), MERGE_INDEX)]
+            for row in duplicates:
+                lines.append('    site %s, variable %s, method %s, source %s, level %s, %s: %d values' % tuple(row[1:]))
+            raise ValueError('\n'.join(lines))
+        conn.execute(text('CREATE UNIQUE INDEX "%s" ON "DataValues" (%s)' % (MERGE_INDEX, _key_columns())))
+    return True
+
+
+# %% Staging table
+def staging_table():
+    """
+        Name of the staging table of one import (unique, so concurrent imports never share a table)
+    """
+    return '%s_%s' % (STAGING_TABLE, uuid.uuid4().hex[:12])
+
+
+def create_staging(engine, table):
+    with engine.begin() as conn:
+        conn.execute(text(CREATE_STAGING.format(table=table)))
+
+
+def drop_staging(engine, table):
+    with engine.begin() as conn:
+        conn.execute(text('DROP TABLE IF EXISTS "%s"' % table))
+
+
+def _csv_buffer(batch):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(batch)
+    buffer.seek(0)
+    return buffer
+
+
+@instrumented('db', 'copy_staging')
+def copy_to_staging(engine, batches, table):
+    """
+        COPY staging batches through a single psycopg2 connection; copied rows
+    """
+    statement = 'COPY "%s" (%s) FROM STDIN WITH (FORMAT csv)' % (table, ', '.join('"%s"' % i for i in STAGING_COLUMNS))
+    rows = 0
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        for batch in batches:
+            cursor.copy_expert(statement, _csv_buffer(batch))
+            rows += len(batch)
+        conn.commit()
+    finally:
+        conn.close()
+    count('db.copy_rows', rows)
+    return rows
+
+
+@instrumented('db', 'merge_staging')
+def merge_staging(engine, source_id, quality_id, censor_term, table):
+    """
+        Merge the staging table into DataValues (one statement)
+        {'staged', 'resolved', 'inserted', 'duplicates', 'unresolved': [(code, variable, station type), ...]}
+    """
+    names = ', '.join("('%s', '%s')" % (ideam, name.replace("'", "''")) for ideam, name in VARIABLE_NAMES.items())
+    with engine.begin() as conn:
+        unresolved = [tuple(i) for i in conn.execute(text(UNRESOLVED.format(table=table)))]
+        staged, resolved, inserted = conn.execute(
+            text(MERGE.format(table=table, names=names, key=_key_columns())),
+            {'source_id': source_id, 'quality_id': quality_id, 'censor_term': censor_term}).fetchone()
+    count('ideam.values_inserted', inserted)
+    return {'staged': staged, 'resolved': resolved, 'inserted': inserted, 'duplicates': resolved - inserted,
+            'unresolved': unresolved}
+
+
+# %% IDEAM files
+def import_ideam_staged(engine, paths, source_id, quality_id, censor_term, utc_offset, qc_stage=None,
+                        resolver=None, async_connections=0, batch_rows=20000, encoding=None):
+    """
+        Import IDEAM daily files through a staging table of the import (see merge_staging for the report)
+            async_connections: COPY with the asyncpg backend and this number of connections (0: psycopg2)
+            resolver: IdeamResolver keying qc_stage series by variable id (as importIdeamDailyTxt)
+        ValueError if duplicated values in DataValues prevent the merge index (see ensure_merge_index)
+    """
+    ensure_merge_index(engine)
+    qcVariables = daily_variable_ids(resolver) if resolver is not None else None
+    qcMethods = merge_method_ids(engine) if qc_stage is not None else None
+    batches = staging_batches(iter_ideam_archive(paths, encoding), utc_offset, batch_rows, qc_stage, qcVariables,
+                              not async_connections, qcMethods)
+
+    # regular (UNLOGGED) table rather than TEMP, the asyncpg connections must see it too
+    table = staging_table()
+    create_staging(engine, table)
+    try:
+        with span('db.staging_import'):
+            if async_connections:
+                import asyncio
+                from AsyncLoader import copy_batches
+                asyncio.run(copy_batches(engine.url.render_as_string(hide_password=False), batches, table,
+                                         STAGING_COLUMNS, None, async_connections))
+            else:
+                copy_to_staging(engine, batches, table)
+            return merge_staging(engine, source_id, quality_id, censor_term, table)
+    finally:
+        drop_staging(engine, table)
+
+
+def format_report(report):
+    """
+        Text summary of a staged import report
+    """
+    lines = ['%d values staged, %d inserted, %d duplicates skipped, %d unresolved' %
+             (report['staged'], report['inserted'], report['duplicates'], report['staged'] - report['resolved'])]
+    for code, variable, stationType in report['unresolved'][:20]:
+        lines.append('    unresolved: site %s, %s, station type %s' % (code, variable, stationType))
+    return '\n'.join(lines)
@@ -14,6 +14,7 @@ import numpy as np
 import pandas as pd
 from datetime import date
 import os, calendar, pickle, time
+from IdeamReader import day_line_dates
 
 
 def split_ideam_line(ideam_line):
@@ -240,56 +241,10 @@ for files in source_file_list:
             day_line = [i[0] for i in day_line_complete]
             day_line_quality = [i[1] for i in day_line_complete]
 
-            # check leap year
-            bisiesto = calendar.isleap(year)
-            if not bisiesto:
-                if day <= 28:
-                    station_db[code]['caudales_diarios'][date(year, 2, day)] = day_line[1]
-                    station_db[code]['caudales_diarios_quality'][date(year, 2, day)] = day_line_quality[1]
-            elif day <= 29:
-                station_db[code]['caudales_diarios'][date(year, 2, day)] = day_line[1]
-                station_db[code]['caudales_diarios_quality'][date(year, 2, day)] = day_line_quality[1]
-
-            if day <= 30:
-                station_db[code]['caudales_diarios'][date(year, 1, day)] = day_line[0]
-                station_db[code]['caudales_diarios'][date(year, 3, day)] = day_line[2]
-                station_db[code]['caudales_diarios'][date(year, 4, day)] = day_line[3]
-                station_db[code]['caudales_diarios'][date(year, 5, day)] = day_line[4]
-                station_db[code]['caudales_diarios'][date(year, 6, day)] = day_line[5]
-                station_db[code]['caudales_diarios'][date(year, 7, day)] = day_line[6]
-                station_db[code]['caudales_diarios'][date(year, 8, day)] = day_line[7]
-                station_db[code]['caudales_diarios'][date(year, 9, day)] = day_line[8]
-                station_db[code]['caudales_diarios'][date(year, 10, day)] = day_line[9]
-                station_db[code]['caudales_diarios'][date(year, 11, day)] = day_line[10]
-                station_db[code]['caudales_diarios'][date(year, 12, day)] = day_line[11]
-
-                station_db[code]['caudales_diarios_quality'][date(year, 1, day)] = day_line_quality[0]
-                station_db[code]['caudales_diarios_quality'][date(year, 3, day)] = day_line_quality[2]
-                station_db[code]['caudales_diarios_quality'][date(year, 4, day)] = day_line_quality[3]
-                station_db[code]['caudales_diarios_quality'][date(year, 5, day)] = day_line_quality[4]
-                station_db[code]['caudales_diarios_quality'][date(year, 6, day)] = day_line_quality[5]
-                station_db[code]['caudales_diarios_quality'][date(year, 7, day)] = day_line_quality[6]
-                station_db[code]['caudales_diarios_quality'][date(year, 8, day)] = day_line_quality[7]
-                station_db[code]['caudales_diarios_quality'][date(year, 9, day)] = day_line_quality[8]
-                station_db[code]['caudales_diarios_quality'][date(year, 10, day)] = day_line_quality[9]
-                station_db[code]['caudales_diarios_quality'][date(year, 11, day)] = day_line_quality[10]
-                station_db[code]['caudales_diarios_quality'][date(year, 12, day)] = day_line_quality[11]
-            else:
-                station_db[code]['caudales_diarios'][date(year, 1, day)] = day_line[0]
-                station_db[code]['caudales_diarios'][date(year, 3, day)] = day_line[2]
-                station_db[code]['caudales_diarios'][date(year, 5, day)] = day_line[4]
-                station_db[code]['caudales_diarios'][date(year, 7, day)] = day_line[6]
-                station_db[code]['caudales_diarios'][date(year, 8, day)] = day_line[7]
-                station_db[code]['caudales_diarios'][date(year, 10, day)] = day_line[9]
-                station_db[code]['caudales_diarios'][date(year, 12, day)] = day_line[11]
-
-                station_db[code]['caudales_diarios_quality'][date(year, 1, day)] = day_line_quality[0]
-                station_db[code]['caudales_diarios_quality'][date(year, 3, day)] = day_line_quality[2]
-                station_db[code]['caudales_diarios_quality'][date(year, 5, day)] = day_line_quality[4]
-                station_db[code]['caudales_diarios_quality'][date(year, 7, day)] = day_line_quality[6]
-                station_db[code]['caudales_diarios_quality'][date(year, 8, day)] = day_line_quality[7]
-                station_db[code]['caudales_diarios_quality'][date(year, 10, day)] = day_line_quality[9]
-                station_db[code]['caudales_diarios_quality'][date(year, 12, day)] = day_line_quality[11]
+            # months where the day exists (precomputed calendar tables) and their dates
+            months, dates = day_line_dates(year, day)
+            station_db[code]['caudales_diarios'].loc[dates] = np.array(day_line)[months]
+            station_db[code]['caudales_diarios_quality'].loc[dates] = np.array(day_line_quality)[months]
 
         if 47 == i:     # line where max discharge data is supposed to be located
 
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Created by AndresD at 19/10/26
+
+Features:
+    + Synthetic IDEAM daily text files (fixed-width format read by ImportSeries.importIdeamDailyTxt and
+      exploreIdeamFile) for benchmarks and load tests
+        - One block (50 lines) per station and year
+        - Configurable stations, years, variables, missing data ratio and qualifier rate
+    + Streaming archive generator (blocks written as they are generated, split in files, size limit) for
+      scale tests of tens of GB
+
+Block layout (line number inside the block):
+    0: banner (repeated at each block start)
+    2: variable line [type: split()[1], time resolution: split()[2], variable: split()[4]]
+    4: year [59:64], station code [104:112], station name [114:]
+    6: latitude, station type [48:50], departamento [80:104]
+    7: longitude, municipio [80:104]
+    8: elevation [15:20], corriente [80:104]
+    14-44: day [11:13], monthly values at split_ideam_line offsets followed by the qualifier digit
+    46: monthly means
+    47: monthly maxima (MAXIMOS)
+    48: monthly minima (MINIMOS)
+
+Usage:
+    python SyntheticIdeam.py output_folder --stations 500 --years 40 --variables CAUDALES,PRECIPITACION
+    python SyntheticIdeam.py output_folder --size 20G --missing 0.1 --qualifiers 0.02
+
+@author:    Andres Felipe Duque Perez
+Email:      andresfduque@gmail.com
+"""
+
+# %% Main imports
+import os
+import re
+import sys
+import argparse
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from IdeamReader import LINE_WIDTH, calendar_mask
+
+BANNER = 'I D E A M  -  INSTITUTO DE HIDROLOGIA, METEOROLOGIA Y ESTUDIOS AMBIENTALES'
+BLOCK_LINES = 50
+
+# supported variables [type (line 2), units, station type (line 6), first station code]
+VARIABLES = {'CAUDALES': ('MEDIOS', '(m3/seg)', 'LG', 11017010),
+             'NIVELES': ('MEDIOS', '(cms)', 'LM', 21017010),
+             'PRECIPITACION': ('TOTALES', '(mms)', 'PM', 11010010)}
+QUALIFIER_DIGITS = (3, 4, 5)
+_COLUMNS = '%8.3f ' * 12
+_DAYS = ['           %02d' % day for day in range(1, 32)]
+
+
+# %% Fixed-width lines
+def _place(fields, width=LINE_WIDTH):
+    """
+        Line with texts placed at fixed positions {position: text}
+    """
+    line = [' '] * width
+    for position, value in fields.items():
+        line[position:position + len(value)] = value
+    return ''.join(line).rstrip()
+
+
+def _field(value):
+    """
+        Value formatted in the 8 characters of an IDEAM column (blank if missing)
+    """
+    if value != value:                      # NaN
+        return '        '
+    text = '%8.3f' % value
+    if len(text) == 8:
+        return text
+    for decimals in (2, 1, 0):
+        text = '%8.*f' % (decimals, value)
+        if len(text) == 8:
+            return text
+    return '%8d' % min(int(value), 99999999)
+
+
+def value_line(prefix, values, qualifiers=None):
+    """
+        Line with 12 monthly columns (values at split_ideam_line offsets, qualifier digit after each value)
+    """
+    columns = _COLUMNS % tuple(values)
+    if len(columns) != 108:                 # values wider than 8 characters
+        columns = ''.join([_field(v) + ' ' for v in values])
+    columns = columns.replace('     nan ', '         ')
+
+    if qualifiers is not None:
+        for month, qualifier in enumerate(qualifiers):
+            if qualifier:
+                position = 9 * month + 8
+                columns = columns[:position] + str(int(qualifier)) + columns[position + 1:]
+    return (prefix.ljust(18)[:18] + columns).rstrip()
+
+
+# %% Station-year block
+def _header(code, name, year, station_type, variable, var_type, units):
+    lines = [''] * 14
+    lines[0] = BANNER
+    lines[1] = _place({60: 'FECHA DE PROCESO :  2019/01/04', 110: 'ESTACION : %08d' % code})
+    lines[2] = _place({30: 'VALORES %s DIARIOS DE %s %s' % (var_type, variable, units)})
+    lines[4] = _place({48: 'ANO', 59: '%5d' % year, 90: 'ESTACION :', 104: '%08d' % code, 114: name})
+    lines[6] = _place({0: 'LATITUD      0527 N', 35: 'TIPO EST', 48: station_type, 60: 'DEPTO', 80: 'ANTIOQUIA'})
+    lines[7] = _place({0: 'LONGITUD     7535 W', 35: 'ENTIDAD   01  IDEAM', 60: 'MUNICIPIO', 80: 'MEDELLIN'})
+    lines[8] = _place({0: 'ELEVACION', 15: '%5d' % 1450, 35: 'REGIONAL  01  ANTIOQUIA', 60: 'CORRIENTE',
+                       80: 'MEDELLIN'})
+    lines[10] = '*' * LINE_WIDTH
+    lines[11] = _place({0: '       DIA', 19: 'ENERO', 28: 'FEBRE', 37: 'MARZO', 46: 'ABRIL', 55: 'MAYO', 64: 'JUNIO',
+                        73: 'JULIO', 82: 'AGOST', 91: 'SEPTI', 100: 'OCTUB', 109: 'NOVIE', 118: 'DICIE'})
+    lines[12] = '*' * LINE_WIDTH
+    return lines
+
+
+def ideam_block(code, name, year, daily, station_type='LG', variable='CAUDALES', var_type='MEDIOS',
+                units='(m3/seg)', qualifiers=None, extremes=True):
+    """
+        Lines of a station-year block
+            daily: 31 x 12 matrix of daily values (NaN for missing or non-existing days)
+            qualifiers: 31 x 12 matrix of qualifier digits (0 for none)
+            extremes: write monthly maxima and minima lines (47, 48)
+    """
+    lines = _header(code, name, year, station_type, variable, var_type, units) + [''] * (BLOCK_LINES - 14)
+
+    dailyRows = daily.tolist()
+    qualifierRows = [None] * 31 if qualifiers is None else qualifiers.tolist()
+    for day in range(31):
+        lines[14 + day] = value_line(_DAYS[day], dailyRows[day], qualifierRows[day])
+
+    valid = ~np.isnan(daily)
+    anyValid = valid.any(axis=0)
+    counts = np.maximum(valid.sum(axis=0), 1)
+    lines[45] = '*' * LINE_WIDTH
+    lines[46] = value_line('MEDIOS', np.where(anyValid, np.where(valid, daily, 0.).sum(axis=0) / counts, np.nan))
+    if extremes:
+        lines[47] = value_line('MAXIMOS', np.where(anyValid, np.where(valid, daily, -np.inf).max(axis=0), np.nan))
+        lines[48] = value_line('MINIMOS', np.where(anyValid, np.where(valid, daily, np.inf).min(axis=0), np.nan))
+    lines[49] = '*' * LINE_WIDTH
+    return lines
+
+
+def synthetic_daily(rng, year, mean=50., missing_ratio=0.05, variable='CAUDALES'):
+    """
+        31 x 12 matrix of synthetic daily values (seasonal lognormal flows and levels, intermittent
+        precipitation), random missing days
+    """
+    exists = calendar_mask(year)
+    season = 1 + 0.5 * np.sin(2 * np.pi * (np.arange(12) - 3) / 12)
+    if variable == 'PRECIPITACION':
+        daily = np.where(rng.random((31, 12)) < 0.45 * season[None, :], rng.gamma(0.8, mean / 5., (31, 12)), 0.)
+    else:
+        daily = mean * season[None, :] * rng.lognormal(0., 0.4, (31, 12))
+    daily[~exists | (rng.random((31, 12)) < missing_ratio)] = np.nan
+    return np.round(daily, 3 if variable == 'CAUDALES' else 1)
+
+
+def synthetic_qualifiers(rng, daily, qualifier_rate=0.):
+    """
+        31 x 12 matrix of qualifier digits (0 for none) of a fraction of the existing values
+    """
+    if not qualifier_rate:
+        return None
+    flagged = ~np.isnan(daily) & (rng.random(daily.shape) < qualifier_rate)
+    return np.where(flagged, rng.choice(QUALIFIER_DIGITS, daily.shape), 0)
+
+
+# %% Streaming generator
+def iter_block_texts(stations=10, years=20, variable='CAUDALES', missing_ratio=0.05, qualifier_rate=0.,
+                     first_year=1980, first_code=None, seed=0):
+    """
+        Text of each station-year block (stations x years blocks, stations=None for an endless stream)
+        [(station code, block text)]
+    """
+    rng = np.random.default_rng(seed)
+    var_type, units, stationType, defaultCode = VARIABLES[variable]
+    firstCode = defaultCode if first_code is None else first_code
+    stationCodes = itertools.count(firstCode) if stations is None else range(firstCode, firstCode + stations)
+
+    for code in stationCodes:
+        mean = rng.uniform(5., 500.)
+        name = 'ESTACION %d' % code
+        for year in range(first_year, first_year + years):
+            daily = synthetic_daily(rng, year, mean, missing_ratio, variable)
+            qualifiers = synthetic_qualifiers(rng, daily, qualifier_rate)
+            block = ideam_block(code, name, year, daily, stationType, variable, var_type, units, qualifiers)
+            yield code, '\n'.join(block) + '\n'
+
+
+def write_ideam_file(path, stations=10, years=20, missing_ratio=0.05, first_year=1980, first_code=11010010,
+                     seed=0, variable='CAUDALES', qualifier_rate=0.):
+    """
+        Write a synthetic IDEAM daily file (stations x years blocks)
+        [station codes]
+    """
+    codes = []
+    with open(path, 'w') as f:
+        for code, block in iter_block_texts(stations, years, variable, missing_ratio, qualifier_rate, first_year,
+                                            first_code, seed):
+            if not codes or codes[-1] != code:
+                codes.append(code)
+            f.write(block)
+    return codes
+
+
+def _write_part(path, variable, first_code, stations, years, missing_ratio, qualifier_rate, first_year, seed):
+    """
+        Write one archive file (blocks streamed to disk); written bytes
+    """
+    written = 0
+    with open(path, 'w') as f:
+        for code, block in iter_block_texts(stations, years, variable, missing_ratio, qualifier_rate, first_year,
+                                            first_code, seed):
+            f.write(block)
+            written += len(block)
+    return written
+
+
+def _archive_parts(folder, stations, variables, stations_per_file, endless):
+    # file tasks [path, variable, first station code, stations, part number] (variables interleaved)
+    for part in itertools.count():
+        if not endless and part * stations_per_file >= stations:
+            return
+        count = stations_per_file if endless else min(stations_per_file, stations - part * stations_per_file)
+        for variable in variables:
+            path = os.path.join(folder, '%s_%05d.txt' % (variable.lower(), part + 1))
+            yield path, variable, VARIABLES[variable][3] + part * stations_per_file, count, part
+
+
+def write_ideam_archive(folder, stations=100, years=30, variables=('CAUDALES',), missing_ratio=0.05,
+                        qualifier_rate=0., stations_per_file=50, max_bytes=None, first_year=1980, seed=0,
+                        workers=None):
+    """
+        Write a synthetic IDEAM archive (one file per variable and group of stations); each file is streamed
+        to disk and files are written by a pool of processes when workers > 1. With max_bytes files are added
+        until the archive reaches that size (the last group of files may exceed it)
+        [written files, bytes]
+    """
+    os.makedirs(folder, exist_ok=True)
+    parts = _archive_parts(folder, stations, list(variables), stations_per_file, bool(max_bytes))
+    wave = max(workers or 1, 1)
+    files = []
+    written = 0
+
+    executor = ProcessPoolExecutor(max_workers=workers) if wave > 1 else None
+    try:
+        while not (max_bytes and written >= max_bytes):
+            tasks = list(itertools.islice(parts, wave))
+            if not tasks:
+                break
+            arguments = [(path, variable, firstCode, count, years, missing_ratio, qualifier_rate, first_year,
+                          seed * 1000003 + part * len(variables) + list(variables).index(variable))
+                         for path, variable, firstCode, count, part in tasks]
+            if executor is None:
+                sizes = [_write_part(*i) for i in arguments]
+            else:
+                sizes = list(executor.map(_write_part, *zip(*arguments)))
+            files += [i[0] for i in tasks]
+            written += sum(sizes)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return files, written
+
+
+def parse_size(text):
+    """
+        Size in bytes of a text like '500M' or '20G'
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', text.upper())
+    if not match:
+        raise argparse.ArgumentTypeError('Invalid size %s' % text)
+    return int(float(match.group(1)) * 1024 ** ' KMGT'.index(match.group(2) or ' '))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Synthetic IDEAM daily text files for load tests')
+    parser.add_argument('folder', help='Output folder')
+    parser.add_argument('--stations', help='Stations per variable', default=100, type=int)
+    parser.add_argument('--years', help='Years per station', default=30, type=int)
+    parser.add_argument('--first-year', help='First year of record', default=1980, type=int, dest='first_year')
+    parser.add_argument('--variables', help='Comma separated variables (%s)' % ', '.join(sorted(VARIABLES)),
+                        default='CAUDALES')
+    parser.add_argument('--missing', help='Missing days ratio', default=0.05, type=float)
+    parser.add_argument('--qualifiers', help='Ratio of values with qualifier digit', default=0., type=float)
+    parser.add_argument('--stations-per-file', help='Stations written in each file', default=50, type=int,
+                        dest='stations_per_file')
+    parser.add_argument('--size', help='Archive size (e.g. 500M, 20G); stations are generated until reached',
+                        type=parse_size)
+    parser.add_argument('--seed', help='Random seed', default=0, type=int)
+    parser.add_argument('-w', '--workers', help='Files written in parallel (processes)', default=os.cpu_count(),
+                        type=int)
+    args = parser.parse_args()
+
+    variablesList = [i.strip().upper() for i in args.variables.split(',')]
+    unknown = [i for i in variablesList if i not in VARIABLES]
+    if unknown:
+        sys.stderr.write('Unsupported variables: %s\n' % ', '.join(unknown))
+        sys.exit(2)
+
+    archiveFiles, archiveBytes = write_ideam_archive(args.folder, args.stations, args.years, variablesList,
+                                                     args.missing, args.qualifiers, args.stations_per_file,
+                                                     args.size, args.first_year, args.seed, args.workers)
+    print('%d files, %.1f MB' % (len(archiveFiles), archiveBytes / 1024. ** 2))
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+    Test configuration: modules of scripts/ are imported by bare name (as the GUI and the command line tools do)
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+    CvLoad concurrent vocabulary fetch and ETag cache against a local HTTP server
+"""
+
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import CvLoad
+
+
+class VocabularyHandler(BaseHTTPRequestHandler):
+    """
+    SKOS documents of every key with an ETag per key; answers 304 to a matching If-None-Match, 500 to any
+    key in server.failing
+    """
+    def do_GET(self):
+        key = self.path.strip('/')
+        server = self.server
+        with server.lock:
+            server.requests.append((key, self.headers.get('If-None-Match')))
+        if key in server.failing:
+            self.send_error(500)
+            return
+
+        etag = '"%s-%d"' % (key, server.versions.get(key, 1))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        body = ('<rdf>%s %d</rdf>' % (key, server.versions.get(key, 1))).encode()
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), VocabularyHandler)
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.versions = {}
+    httpd.failing = set()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch_args(server, cache_dir, offline=False):
+    return argparse.Namespace(url='http://127.0.0.1:%d/%%s' % server.server_address[1], cache_dir=str(cache_dir),
+                              offline=offline, workers=4)
+
+
+def test_download_then_not_modified(server, tmp_path):
+    args = fetch_args(server, tmp_path)
+    keys = [i[0] for i in CvLoad.VOCAB]
+
+    first = CvLoad.fetch_vocabularies(args)
+    assert sorted(first) == sorted(keys)
+    assert all(origin == 'download' for data, origin in first.values())
+    assert first['actiontype'][0] == b'<rdf>actiontype 1</rdf>'
+    assert all(etag is None for key, etag in server.requests)
+
+    # second run revalidates every cached document and reuses it
+    del server.requests[:]
+    second = CvLoad.fetch_vocabularies(args)
+    assert all(origin == 'cache' for data, origin in second.values())
+    assert {key: data for key, (data, origin) in second.items()} == {key: data for key, (data, origin) in first.items()}
+    assert sorted(server.requests) == sorted((key, '"%s-1"' % key) for key in keys)
+
+
+def test_changed_etag_refreshes_cache(server, tmp_path):
+    args = fetch_args(server, tmp_path)
+    CvLoad.fetchVocabulary('sitetype', args.url, args.cache_dir)
+
+    server.versions['sitetype'] = 2
+    key, data, origin = CvLoad.fetchVocabulary('sitetype', args.url, args.cache_dir)
+    assert (origin, data) == ('download', b'<rdf>sitetype 2</rdf>')
+    assert server.requests[-1] == ('sitetype', '"sitetype-1"')
+
+    cached, meta = CvLoad.readCache('sitetype', args.cache_dir)
+    assert cached == data and meta['etag'] == '"sitetype-2"'
+    assert CvLoad.fetchVocabulary('sitetype', args.url, args.cache_dir)[2] == 'cache'
+
+
+def test_fetch_failure(server, tmp_path):
+    args = fetch_args(server, tmp_path)
+    CvLoad.fetchVocabulary('status', args.url, args.cache_dir)
+    server.failing.update(['status', 'medium'])
+
+    # cached copy is used when the service fails, uncached vocabularies report the error
+    key, data, origin = CvLoad.fetchVocabulary('status', args.url, args.cache_dir)
+    assert (data, origin) == (b'<rdf>status 1</rdf>', 'cache')
+    key, data, origin = CvLoad.fetchVocabulary('medium', args.url, args.cache_dir)
+    assert data is None and '500' in origin
+
+    documents = CvLoad.fetch_vocabularies(fetch_args(server, tmp_path, offline=True))
+    assert documents['status'] == (b'<rdf>status 1</rdf>', 'cache')
+    assert documents['medium'] == (None, 'not cached')
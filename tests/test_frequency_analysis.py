@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+    FrequencyAnalysis: L-moments, GEV and Pearson III fits against known values, minimum years and fit cache
+"""
+
+import math
+import itertools
+import numpy as np
+import pandas as pd
+
+import FrequencyAnalysis
+from FrequencyAnalysis import (FrequencyCache, fit_distributions, fit_gev, fit_pearson3, frequency_factor,
+                               l_moments, quantile_gev)
+
+
+def direct_l_moments(sample):
+    """ Unbiased sample L-moments from their definition over all ordered subsamples (Hosking, 1990) """
+    x = np.sort(sample)
+    pairs = [b - a for a, b in itertools.combinations(x, 2)]
+    triples = [c - 2 * b + a for a, b, c in itertools.combinations(x, 3)]
+    l2 = np.mean(pairs) / 2
+    l3 = np.mean(triples) / 3
+    return np.mean(x), l2, l3 / l2
+
+
+def gev_l_moments(xi, alpha, k):
+    """ Population L-moments of a GEV distribution (Hosking & Wallis, 1997) """
+    gk = math.gamma(1 + k)
+    l1 = xi + alpha * (1 - gk) / k
+    l2 = alpha * (1 - 2. ** -k) * gk / k
+    t3 = 2 * (1 - 3. ** -k) / (1 - 2. ** -k) - 3
+    return np.array([l1]), np.array([l2]), np.array([t3])
+
+
+def maxima_frame(columns, first_year=1980):
+    length = max(len(i) for i in columns.values())
+    data = {code: np.r_[values, [np.nan] * (length - len(values))] for code, values in columns.items()}
+    return pd.DataFrame(data, index=pd.Index(range(first_year, first_year + length), name='Year'))
+
+
+def test_l_moments_known_values():
+    n, l1, l2, t3 = l_moments(np.arange(1., 6.)[:, None])
+    assert (n[0], l1[0], l2[0], t3[0]) == (5, 3., 1., 0.)
+
+    sample = np.random.default_rng(7).gumbel(100., 30., 15)
+    n, l1, l2, t3 = l_moments(sample[:, None])
+    assert np.allclose([l1[0], l2[0], t3[0]], direct_l_moments(sample))
+
+
+def test_l_moments_missing_years():
+    sample = np.random.default_rng(11).gumbel(50., 10., 12)
+    values = np.c_[np.r_[sample, [np.nan] * 4], np.r_[[np.nan] * 2, sample, [np.nan] * 2]]
+    n, l1, l2, t3 = l_moments(values)
+    assert list(n) == [12, 12]
+    assert np.allclose([l1, l2, t3], np.array(direct_l_moments(sample))[:, None])
+
+
+def test_gev_fit_and_quantiles():
+    xi, alpha, k = 10., 2., -0.1
+    params = fit_gev(*gev_l_moments(xi, alpha, k))
+    # Hosking's approximation of the shape parameter is accurate to 9e-4 for -0.5 < t3 < 0.5
+    assert abs(params['k'][0] - k) < 9e-4
+    assert np.allclose([params['xi'][0], params['alpha'][0]], [xi, alpha], rtol=1e-3)
+
+    prob = np.array([[0.5, 0.9, 0.99]])
+    expected = xi + alpha / k * (1 - (-np.log(prob)) ** k)
+    assert np.allclose(quantile_gev(params, prob), expected, rtol=1e-3)
+
+
+def test_pearson3_fit():
+    # exponential distribution (scale 1): l2 = 1/2, t3 = 1/3, standard deviation 1, skewness 2
+    params = fit_pearson3(np.array([1.]), np.array([0.5]), np.array([1. / 3]))
+    assert np.allclose([params['sigma'][0], params['skew'][0]], [1., 2.], rtol=1e-4)
+
+    # gamma distribution (shape 4, scale 1): standard deviation 2, skewness 1, t3 by numerical integration
+    l2 = math.gamma(4.5) / (math.sqrt(math.pi) * math.gamma(4.))
+    params = fit_pearson3(np.array([4.]), np.array([l2]), np.array([0.16466]))
+    assert np.allclose([params['sigma'][0], params['skew'][0]], [2., 1.], rtol=1e-4)
+
+    # normal distribution: t3 = 0, l2 = sigma / sqrt(pi)
+    params = fit_pearson3(np.array([0.]), np.array([1. / math.sqrt(math.pi)]), np.array([0.]))
+    assert np.allclose([params['sigma'][0], params['skew'][0]], [1., 0.])
+
+
+def test_frequency_factor():
+    prob = np.array([[0.9, 0.99]])
+    assert np.allclose(frequency_factor(np.array([0.]), prob), [[1.28155, 2.32635]], atol=1e-5)
+    # Bulletin 17B frequency factors for skewness 1.0 (10 and 100 years)
+    assert np.allclose(frequency_factor(np.array([1.]), prob), [[1.340, 3.022]], atol=0.01)
+
+
+def test_min_years():
+    rng = np.random.default_rng(3)
+    maxima = maxima_frame({'short': rng.gumbel(100., 30., 9), 'long': rng.gumbel(100., 30., 12)})
+    quantiles, params = fit_distributions(maxima, return_periods=(10, 100), min_years=10)
+
+    assert quantiles.loc['short'].isna().all().all()
+    assert quantiles.loc['long'].notna().all().all()
+    assert list(params.loc['short', 'N']) == [9, 9, 9]
+    assert params.loc['short', 'xi'].isna().all()
+
+    quantiles, _ = fit_distributions(maxima, return_periods=(10, 100), min_years=9)
+    assert quantiles.loc['short'].notna().all().all()
+
+
+def test_cache_refits_new_maximum(monkeypatch):
+    fitted = []
+
+    def counted_fit(maxima, *args, **kwargs):
+        fitted.append(list(maxima.columns))
+        return fit_distributions(maxima, *args[:2])
+
+    monkeypatch.setattr(FrequencyAnalysis, 'batch_fit', counted_fit)
+    rng = np.random.default_rng(5)
+    columns = {'A': rng.gumbel(100., 30., 20), 'B': rng.gumbel(80., 20., 20)}
+    cache = FrequencyCache()
+
+    quantiles, _ = cache.get(maxima_frame(columns))
+    quantiles, _ = cache.get(maxima_frame(columns))
+    assert fitted == [['A', 'B']]
+
+    # a new annual maximum only refits its station
+    columns['A'] = np.r_[columns['A'], 1000.]
+    newQuantiles, _ = cache.get(maxima_frame(columns))
+    assert fitted == [['A', 'B'], ['A']]
+    assert (newQuantiles.loc['A', [10, 100]].values > quantiles.loc['A', [10, 100]].values).all()
+    pd.testing.assert_frame_equal(newQuantiles.loc[['B']], quantiles.loc[['B']])
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+    IdeamReader pipeline: a failing sink stops the read of the archive and every sink is closed
+"""
+
+import pytest
+
+from IdeamReader import CsvSink, Sink, StatisticsSink, iter_ideam_archive, run_pipeline
+from SyntheticIdeam import write_ideam_file
+
+
+class FailingSink(Sink):
+    def __init__(self, fail_at):
+        self.failAt = fail_at
+        self.written = 0
+        self.closed = False
+
+    def write(self, block):
+        self.written += 1
+        if self.written == self.failAt:
+            raise ValueError('sink failed')
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(scope='module')
+def archive(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('pipeline') / 'ideam.txt')
+    write_ideam_file(path, stations=20, years=10, first_year=1990)
+    return path
+
+
+def counted(blocks, read):
+    for block in blocks:
+        read.append(block.code)
+        yield block
+
+
+def test_sink_is_abstract():
+    with pytest.raises(TypeError):
+        Sink()
+
+
+@pytest.mark.parametrize('threads', [False, True])
+def test_pipeline_results(archive, tmp_path, threads):
+    csvSink = CsvSink(str(tmp_path / 'values.csv'))
+    rows, statistics = run_pipeline(iter_ideam_archive([archive]), [csvSink, StatisticsSink()], threads)
+    assert csvSink.file.closed and rows > 0
+    assert len(statistics) == 20
+
+
+@pytest.mark.parametrize('threads', [False, True])
+def test_failing_sink_stops_read_and_closes_sinks(archive, tmp_path, threads):
+    read = []
+    csvSink = CsvSink(str(tmp_path / 'values.csv'))
+    failing = FailingSink(fail_at=5)
+    with pytest.raises(ValueError, match='sink failed'):
+        run_pipeline(counted(iter_ideam_archive([archive]), read), [csvSink, failing], threads, queue_size=4)
+
+    # 200 blocks in the archive: reading stops within the queue sizes of the failure
+    assert len(read) < 20
+    assert failing.closed and csvSink.file.closed
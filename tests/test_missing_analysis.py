@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+    MissingAnalysis: completeness, longest gap and gaps table of daily series (NaN or dropped missing days)
+"""
+
+import numpy as np
+import pandas as pd
+
+from MissingAnalysis import REPORT_COLUMNS, gaps_table, missing_report
+
+DATES = pd.date_range('2000-01-01', '2000-03-31', freq='D')
+GAPS = [('2000-01-10', '2000-01-14'), ('2000-02-27', '2000-03-03')]     # 5 and 6 days, second one crosses a month
+
+
+def series_with_gaps(drop=False):
+    series = pd.Series(np.arange(len(DATES), dtype=float), index=DATES)
+    for start, end in GAPS:
+        series[start:end] = np.nan
+    return series.dropna() if drop else series
+
+
+def late_series():
+    """ Record starting on 2000-01-16: leading missing days are outside the station record """
+    series = pd.Series(1., index=DATES)
+    series[:'2000-01-15'] = np.nan
+    return series
+
+
+def row(report, code, year, month):
+    rows = report[(report['Code'] == code) & (report['Year'] == year) & (report['Month'] == month)]
+    assert len(rows) == 1
+    return rows.iloc[0]
+
+
+def test_missing_report_completeness():
+    report = missing_report({'A': series_with_gaps(), 'B': late_series()})
+    assert list(report.columns) == REPORT_COLUMNS
+
+    record = row(report, 'A', 0, 0)
+    assert (record['Days'], record['Valid'], record['Missing']) == (91, 80, 11)
+    assert np.isclose(record['Completeness'], 100. * 80 / 91)
+    year = row(report, 'A', 2000, 0)
+    assert (year['Days'], year['Valid'], year['Missing']) == (91, 80, 11)
+
+    january = row(report, 'A', 2000, 1)
+    assert (january['Days'], january['Valid'], january['Missing']) == (31, 26, 5)
+    february = row(report, 'A', 2000, 2)
+    assert (february['Days'], february['Valid'], february['Missing']) == (29, 26, 3)
+
+    # days before the first valid value are not counted
+    lateJanuary = row(report, 'B', 2000, 1)
+    assert (lateJanuary['Days'], lateJanuary['Valid'], lateJanuary['Missing']) == (16, 16, 0)
+    assert row(report, 'B', 0, 0)['Completeness'] == 100.
+
+
+def test_missing_report_longest_gap():
+    report = missing_report({'A': series_with_gaps()})
+
+    record = row(report, 'A', 0, 0)
+    assert (record['LongestGap'], record['Gaps']) == (6, 2)
+    january = row(report, 'A', 2000, 1)
+    assert (january['LongestGap'], january['Gaps']) == (5, 1)
+
+    # the gap crossing february and march is split at the month start
+    february = row(report, 'A', 2000, 2)
+    assert (february['LongestGap'], february['Gaps']) == (3, 1)
+    march = row(report, 'A', 2000, 3)
+    assert (march['LongestGap'], march['Gaps']) == (3, 1)
+
+
+def test_gaps_table():
+    gaps = gaps_table({'A': series_with_gaps(), 'B': late_series()})
+    assert list(gaps['Code']) == ['A', 'A']
+    assert list(gaps['Start']) == [np.datetime64(start, 'D') for start, _ in GAPS]
+    assert list(gaps['End']) == [np.datetime64(end, 'D') for _, end in GAPS]
+    assert list(gaps['Days']) == [5, 6]
+
+    longGaps = gaps_table({'A': series_with_gaps()}, min_length=6)
+    assert list(longGaps['Days']) == [6]
+
+
+def test_sparse_series():
+    """ Missing days dropped from the index give the same report as NaN values """
+    nanSeries = {'A': series_with_gaps(), 'B': late_series()}
+    sparseSeries = {'A': series_with_gaps(drop=True), 'B': late_series().dropna()}
+    pd.testing.assert_frame_equal(missing_report(sparseSeries), missing_report(nanSeries))
+    pd.testing.assert_frame_equal(gaps_table(sparseSeries), gaps_table(nanSeries))
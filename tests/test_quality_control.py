@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+    QualityControl: import stage flagging over a daily calendar and flags stored for the imported series only
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+warnings.filterwarnings('ignore', category=DeprecationWarning)
+import Benchmarks
+from ImportSeries import importIdeamDailyTxt
+from QualityControl import QC_FLATLINE, QC_QUALIFIER, QC_RANGE, QCStage, store_flags
+from SyntheticIdeam import write_ideam_file
+
+COPY_SERIES = '''
+INSERT INTO "DataValues" ("DataValue", "LocalDateTime", "UTCOffset", "DateTimeUTC", "SiteId", "VariableId",
+                          "QualifierId", "MethodId", "SourceId", "QualityControlLevelId", "CensorCode")
+SELECT "DataValue", "LocalDateTime", "UTCOffset", "DateTimeUTC", "SiteId", "VariableId", "QualifierId",
+       :method_id, "SourceId", :quality_id, "CensorCode"
+FROM "DataValues" WHERE "MethodId" = 1 AND "QualityControlLevelId" = 1
+'''
+
+STORED_SERIES = '''
+SELECT v."MethodId", v."QualityControlLevelId", count(*)
+FROM "DataValuesQC" qc JOIN "DataValues" v ON v."ValueId" = qc."ValueId"
+GROUP BY 1, 2
+'''
+
+
+def days(first, number):
+    return list(pd.date_range(first, periods=number, freq='D') + pd.Timedelta(hours=12))
+
+
+def test_stage_daily_calendar():
+    stage = QCStage(flat_run=10)
+    # 12 equal values with a missing day in the middle: runs of 6 days, not a flat line of 12
+    stage.add_many('gap', days('2000-01-01', 6) + days('2000-01-08', 6), [5.] * 12, [1.] * 12)
+    stage.add_many('flat', days('2000-01-01', 12), [5.] * 12, [1.] * 12)
+    results = stage.run()
+
+    assert len(results['gap']) == 12
+    assert not (results['gap']['Flags'] & QC_FLATLINE).any()
+    assert (results['flat']['Flags'] & QC_FLATLINE).all()
+
+
+def test_stage_duplicated_days():
+    stage = QCStage()
+    stage.add_many('A', days('2000-01-01', 3), [1., 2., 3.], [1., 1., 1.])
+    # the same time again: last collected value and qualifier kept
+    stage.add('A', pd.Timestamp('2000-01-02 12:00'), -4., 3.)
+    # the same day at an earlier time: dropped
+    stage.add('A', pd.Timestamp('2000-01-03 07:00'), -5., 1.)
+    frame = stage.run()['A']
+
+    assert len(frame) == 3
+    second = frame.iloc[1]
+    assert (second['Value'], second['Qualifier']) == (-4., 3.)
+    assert second['Flags'] == QC_RANGE | QC_QUALIFIER
+    assert list(frame['Flags'].iloc[[0, 2]]) == [0, 0]
+
+
+def test_store_flags_series_key(tmp_path):
+    path = str(tmp_path / 'ideam.txt')
+    codes = write_ideam_file(path, stations=2, years=2, first_year=2000)
+    engine = create_engine('sqlite:///%s' % (tmp_path / 'qc.sqlite'))
+    Benchmarks.create_database(engine, codes)
+    stage = QCStage(upper=400.)
+    importIdeamDailyTxt(path, engine, Benchmarks.METHODS, Benchmarks.VARIABLES, 1, 1, 'nc', -5., stage)
+    results = stage.run()
+    assert sorted(results) == [(code, 1, 1) for code in codes]
+
+    # same site, variable, source and times in another method and another quality control level
+    with engine.begin() as conn:
+        conn.execute(text('INSERT INTO "Methods" ("MethodId", "MethodDescription") VALUES (2, \'Estacion LM\')'))
+        conn.execute(text('INSERT INTO "QualityControlLevels" ("QualityControlLevelId", "QualityControlLevelCode", '
+                          '"Definition", "Explanation") VALUES (2, \'1\', \'Quality controlled\', \'Synthetic\')'))
+        conn.execute(text(COPY_SERIES), {'method_id': 2, 'quality_id': 1})
+        conn.execute(text(COPY_SERIES), {'method_id': 1, 'quality_id': 2})
+
+    flagged = sum(int((frame['Flags'] > 0).sum()) for frame in results.values())
+    assert flagged > 0
+    assert store_flags(engine, results, 1, 1) == flagged
+    with engine.connect() as conn:
+        assert conn.execute(text(STORED_SERIES)).fetchall() == [(1, 1, flagged)]
+
+    # stored again: flags updated in place
+    for frame in results.values():
+        frame['Flags'] = np.where(frame['Flags'] > 0, QC_RANGE | QC_QUALIFIER, 0).astype(np.uint8)
+    assert store_flags(engine, results, 1, 1) == flagged
+    with engine.connect() as conn:
+        assert conn.execute(text(STORED_SERIES)).fetchall() == [(1, 1, flagged)]
+        assert conn.execute(text('SELECT DISTINCT "QCFlags" FROM "DataValuesQC"')).fetchall() == [
+            (QC_RANGE | QC_QUALIFIER,)]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+    Region series catalog and set-based fetch (SQLAlchemyQueries) over a SQLite database of synthetic IDEAM values
+"""
+
+import warnings
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, event
+
+warnings.filterwarnings('ignore', category=DeprecationWarning)
+import Benchmarks
+import SQLAlchemyQueries as SqlQuery
+from ImportSeries import importIdeamDailyTxt
+from SyntheticIdeam import write_ideam_file
+
+
+@pytest.fixture(scope='module')
+def engine(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('region')
+    path = str(folder / 'ideam.txt')
+    codes = write_ideam_file(path, stations=3, years=3, first_year=2000)
+    engine = create_engine('sqlite:///%s' % (folder / 'region.sqlite'))
+    Benchmarks.create_database(engine, codes)
+    importIdeamDailyTxt(path, engine, Benchmarks.METHODS, Benchmarks.VARIABLES, 1, 1, 'nc', -5.)
+    engine.codes = codes
+    return engine
+
+
+def test_region_catalog(engine):
+    # sites without values of the variable (LONG_SITE) have no series
+    identifiers = SqlQuery.regionSeriesQuery(engine.codes + [Benchmarks.LONG_SITE], 1, engine)
+    assert [i[4] for i in identifiers] == [[str(code), 'ESTACION %d' % code] for code in engine.codes]
+    assert identifiers[0][:4] == ['[01] IDEAM', '[01] Streamflow - Average (day)', '[01] Estacion limnigrafica LG',
+                                  '[01] Raw data']
+    assert SqlQuery.regionSeriesQuery([Benchmarks.LONG_SITE], 1, engine) == []
+
+
+def test_region_values_single_query(engine):
+    identifiers = SqlQuery.regionSeriesQuery(engine.codes, 1, engine)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        region = SqlQuery.regionTimeSeriesQuery(identifiers, engine)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    assert sum('FROM "DataValues"' in i for i in statements) == 1
+    for identifier, series in zip(identifiers, region):
+        single = SqlQuery.timeSeriesQuery(identifier, engine)
+        assert series.index.equals(single.index)
+        np.testing.assert_array_equal(series.values, single.values)
+        assert series.index[0].year == 2000 and series.index[-1].year == 2002